@@ -0,0 +1,586 @@
+"""Benchmarks for the DC-Mon backend.
+
+Each subcommand prints one JSON document on stdout so results can be
+collected and compared between revisions, e.g.
+
+    python benchmark.py get-servers --servers 5000 --clients 32 --duration 10
+    python benchmark.py import-csv --servers 100000
+    python benchmark.py fleet --servers 5000 --latency-ms 20 --drop-rate 0.01 --slow-rate 0.05
+    python benchmark.py serialize --servers 10000
+    python benchmark.py startup --runs 5
+
+``fleet`` runs the whole suite against a simulated fleet: it starts fake
+HTTP and SSH servers on loopback, imports them through /servers/import-csv,
+runs full sweeps through /servers/test-all and load tests GET /servers
+with and without a sweep in progress. The fake fleet needs Linux, which
+routes all of 127.0.0.0/8 to the loopback interface.
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import random
+import re
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import aiohttp
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def seed_servers(db_path: str, count: int, apps: int = 50):
+    conn = sqlite3.connect(db_path, timeout=30)
+    with conn:
+        conn.executemany(
+            'INSERT INTO applications (name, description) VALUES (?, ?)',
+            [(f"app{i}", f"Benchmark application {i}") for i in range(apps)]
+        )
+        conn.executemany(
+            'INSERT INTO servers (name, type, status, test_response, owner_name, owner_contact, hostname, port, application_id) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            [
+                (f"app{i % apps}_server{i}", "CUSTOM", "offline", "Invalid hostname or port",
+                 f"team{i % 40}", f"team{i % 40}@example.com", "", 0, i % apps + 1)
+                for i in range(count)
+            ]
+        )
+    conn.close()
+
+
+def fleet_address(index: int) -> str:
+    # 254 hosts per /24 from 127.1.1.1 up, so the prober's per-subnet
+    # limits apply as they would on a real network
+    return f"127.{index // 64516 + 1}.{index // 254 % 254 + 1}.{index % 254 + 1}"
+
+
+class FakeFleet:
+    """Simulated servers, each on its own loopback address.
+
+    One listener per protocol is bound to the wildcard address and acts
+    as whichever endpoint the client dialled, so the fleet costs two
+    sockets however large it is. Connections from outside loopback are
+    closed at once. HTTP endpoints answer every request on a connection
+    with 200; SSH endpoints send their identification line, which the SSH
+    probe waits for.
+
+    Each answer is delayed by ``latency_ms`` plus or minus ``jitter_ms``.
+    A ``slow_rate`` share of the endpoints always takes ``slow_ms``
+    instead, and each connection or request is dropped with probability
+    ``drop_rate``: the endpoint goes silent and the probe times out. The
+    fleet runs on its own thread and event loop so the benchmark's HTTP
+    clients do not hold up its timers.
+    """
+
+    def __init__(
+        self,
+        size: int,
+        http_share: float = 0.5,
+        latency_ms: float = 0.0,
+        jitter_ms: float = 0.0,
+        drop_rate: float = 0.0,
+        slow_rate: float = 0.0,
+        slow_ms: float = 3000.0,
+        seed: int = 0,
+        http_port: int = 3180,
+        ssh_port: int = 3122,
+    ):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.drop_rate = drop_rate
+        self.slow_ms = slow_ms
+        self.ports = {"WEB": http_port, "SSH": ssh_port}
+        self.random = random.Random(seed)
+        # address -> (server type, slow)
+        self.endpoints = {
+            fleet_address(index): (
+                "WEB" if self.random.random() < http_share else "SSH",
+                self.random.random() < slow_rate,
+            )
+            for index in range(size)
+        }
+        self.answered = 0
+        self.dropped = 0
+        self.refused = 0
+        self._loop = None
+        self._thread = None
+        self._servers = []
+
+    def csv(self) -> bytes:
+        lines = ["name,type,team,host,port"]
+        for index, (address, (server_type, _)) in enumerate(self.endpoints.items()):
+            lines.append(f"app{index % 50}_fleet{index},{server_type},team{index % 40},{address},{self.ports[server_type]}")
+        return ("\n".join(lines) + "\n").encode()
+
+    def start(self):
+        started = threading.Event()
+        errors = []
+
+        def run():
+            self._loop = asyncio.new_event_loop()
+            try:
+                self._servers = [
+                    self._loop.run_until_complete(asyncio.start_server(handler, "0.0.0.0", port, backlog=4096))
+                    for handler, port in ((self._serve_http, self.ports["WEB"]), (self._serve_ssh, self.ports["SSH"]))
+                ]
+            except OSError as e:
+                errors.append(e)
+                started.set()
+                return
+            started.set()
+            self._loop.run_forever()
+            for server in self._servers:
+                server.close()
+            # Connections still held open by dropped endpoints
+            tasks = asyncio.all_tasks(self._loop)
+            for task in tasks:
+                task.cancel()
+            if tasks:
+                self._loop.run_until_complete(asyncio.wait(tasks))
+            self._loop.close()
+
+        self._thread = threading.Thread(target=run, name="fake-fleet", daemon=True)
+        self._thread.start()
+        started.wait()
+        if errors:
+            raise errors[0]
+
+    def stop(self):
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join(timeout=10)
+
+    def stats(self) -> dict:
+        return {"answered": self.answered, "dropped": self.dropped, "refused": self.refused}
+
+    async def _respond(self, writer, server_type: str) -> bool:
+        """Wait as the dialled endpoint would; False if it is dropped or unknown."""
+        peer = writer.get_extra_info("peername")[0]
+        endpoint = self.endpoints.get(writer.get_extra_info("sockname")[0])
+        if endpoint is None or endpoint[0] != server_type or not peer.startswith("127."):
+            self.refused += 1
+            return False
+        if self.random.random() < self.drop_rate:
+            self.dropped += 1
+            return False
+        if endpoint[1]:
+            delay = self.slow_ms
+        else:
+            delay = self.latency_ms + self.random.uniform(-self.jitter_ms, self.jitter_ms)
+        if delay > 0:
+            await asyncio.sleep(delay / 1000)
+        self.answered += 1
+        return True
+
+    async def _hold(self, reader, writer):
+        # A dropped endpoint stays silent until the client gives up
+        try:
+            while await reader.read(4096):
+                pass
+        except ConnectionError:
+            pass
+
+    async def _serve_http(self, reader, writer):
+        try:
+            while True:
+                await reader.readuntil(b"\r\n\r\n")
+                if not await self._respond(writer, "WEB"):
+                    await self._hold(reader, writer)
+                    break
+                writer.write(b"HTTP/1.1 200 OK\r\nContent-Length: 0\r\n\r\n")
+                await writer.drain()
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError, asyncio.CancelledError):
+            # Cancelled only when the fleet stops
+            pass
+        finally:
+            writer.close()
+
+    async def _serve_ssh(self, reader, writer):
+        try:
+            if await self._respond(writer, "SSH"):
+                writer.write(b"SSH-2.0-FakeFleet\r\n")
+                await writer.drain()
+            else:
+                await self._hold(reader, writer)
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            writer.close()
+
+
+class ApiServer:
+    """Runs the API in a uvicorn subprocess against a throwaway database."""
+
+    def __init__(self, backend_dir: str, db_path: str, port: int, env: dict = None):
+        self.backend_dir = backend_dir
+        self.db_path = db_path
+        self.port = port
+        self.env = env or {}
+        self.process = None
+        # Seconds from spawning the process to its first answered request
+        self.ready_s = None
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    async def __aenter__(self):
+        env = dict(os.environ, DCMON_DB_PATH=self.db_path, **self.env)
+        started = time.perf_counter()
+        self.process = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "main:app", "--port", str(self.port), "--log-level", "warning"],
+            cwd=self.backend_dir,
+            env=env,
+        )
+        async with aiohttp.ClientSession() as session:
+            while time.perf_counter() - started < 20:
+                try:
+                    async with session.get(f"{self.url}/servers/summary") as response:
+                        if response.status == 200:
+                            self.ready_s = time.perf_counter() - started
+                            return self
+                except aiohttp.ClientError:
+                    pass
+                await asyncio.sleep(0.01)
+        self.process.terminate()
+        raise RuntimeError("API server did not start")
+
+    async def __aexit__(self, *exc):
+        self.process.terminate()
+        self.process.wait(timeout=10)
+
+
+def percentiles(values: list, scale: float = 1000) -> dict:
+    values = sorted(values)
+
+    def percentile(p):
+        if not values:
+            return None
+        return round(values[min(len(values) - 1, int(len(values) * p))] * scale, 3)
+
+    return {"p50": percentile(0.5), "p90": percentile(0.9), "p99": percentile(0.99)}
+
+
+async def load_test(url: str, clients: int, duration: float) -> dict:
+    latencies = []
+    errors = 0
+    deadline = time.perf_counter() + duration
+
+    async def client(session):
+        nonlocal errors
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            try:
+                async with session.get(url) as response:
+                    await response.read()
+                    if response.status != 200:
+                        errors += 1
+                        continue
+            except aiohttp.ClientError:
+                errors += 1
+                continue
+            latencies.append(time.perf_counter() - start)
+
+    connector = aiohttp.TCPConnector(limit=clients)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        started = time.perf_counter()
+        await asyncio.gather(*(client(session) for _ in range(clients)))
+        elapsed = time.perf_counter() - started
+
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "requests_per_second": round(len(latencies) / elapsed, 1),
+        "latency_ms": percentiles(latencies),
+    }
+
+
+_SAMPLE = re.compile(r'^(\w+)(\{[^}]*\})? (\S+)$')
+
+
+async def scrape(session: aiohttp.ClientSession, url: str) -> dict:
+    """The API's /metrics samples as {'name{labels}': value}."""
+    async with session.get(f"{url}/metrics") as response:
+        text = await response.text()
+    samples = {}
+    for line in text.splitlines():
+        match = _SAMPLE.match(line)
+        if match:
+            samples[match.group(1) + (match.group(2) or "")] = float(match.group(3))
+    return samples
+
+
+def write_rate(before: dict, after: dict, elapsed: float) -> dict:
+    """Database write transactions between two scrapes."""
+    writes = after.get('dcmon_db_duration_seconds_count{op="write"}', 0) - before.get('dcmon_db_duration_seconds_count{op="write"}', 0)
+    busy = after.get('dcmon_db_duration_seconds_sum{op="write"}', 0) - before.get('dcmon_db_duration_seconds_sum{op="write"}', 0)
+    return {
+        "transactions": int(writes),
+        "transactions_per_second": round(writes / elapsed, 1) if elapsed else None,
+        "busy_s": round(busy, 3),
+    }
+
+
+async def import_csv(session: aiohttp.ClientSession, url: str, body: bytes) -> dict:
+    form = aiohttp.FormData()
+    form.add_field("file", io.BytesIO(body), filename="servers.csv", content_type="text/csv")
+    before = await scrape(session, url)
+    started = time.perf_counter()
+    async with session.post(f"{url}/servers/import-csv", data=form) as response:
+        summary = await response.json()
+        if response.status != 200:
+            raise RuntimeError(f"CSV import failed with {response.status}: {summary}")
+    elapsed = time.perf_counter() - started
+    return {
+        "rows": summary["imported"],
+        "failed": summary["failed"],
+        "bytes": len(body),
+        "duration_s": round(elapsed, 3),
+        "rows_per_second": round(summary["imported"] / elapsed, 1),
+        "db_writes": write_rate(before, await scrape(session, url), elapsed),
+    }
+
+
+async def sweep(session: aiohttp.ClientSession, url: str) -> dict:
+    """One full sweep: a POST /servers/test-all job, followed to its end."""
+    before = await scrape(session, url)
+    started = time.perf_counter()
+    async with session.post(f"{url}/servers/test-all") as response:
+        job = await response.json()
+        if response.status != 202:
+            raise RuntimeError(f"Sweep failed with {response.status}: {job}")
+    results = []
+    first_result = None
+    async with session.get(f"{url}/jobs/{job['id']}/results", timeout=aiohttp.ClientTimeout(total=None)) as response:
+        async for line in response.content:
+            if first_result is None:
+                first_result = time.perf_counter() - started
+            results.append(json.loads(line)["result"])
+    elapsed = time.perf_counter() - started
+    async with session.get(f"{url}/jobs/{job['id']}") as response:
+        job = await response.json()
+    if job["state"] != "completed":
+        raise RuntimeError(f"Sweep job ended {job['state']}: {job['error']}")
+    outcomes = {}
+    for result in results:
+        outcome = result.get("error") or result["status"]
+        outcomes[outcome] = outcomes.get(outcome, 0) + 1
+    return {
+        "duration_s": round(elapsed, 3),
+        "first_result_s": round(first_result, 3) if first_result is not None else None,
+        "probed": len(results),
+        "probes_per_second": round(len(results) / elapsed, 1),
+        "outcomes": outcomes,
+        "probe_latency_ms": percentiles([result["latency_ms"] for result in results], 1),
+        "db_writes": write_rate(before, await scrape(session, url), elapsed),
+    }
+
+
+def api_env(args, extra: dict) -> dict:
+    env = dict(extra)
+    for setting in args.env:
+        name, _, value = setting.partition("=")
+        env[name] = value
+    return env
+
+
+async def bench_get_servers(args) -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = args.db_path or os.path.join(tmp, "bench.db")
+        async with ApiServer(args.backend_dir, db_path, args.port, api_env(args, {"DCMON_PROBE_LOOP": "0"})):
+            seed_servers(db_path, args.servers)
+            result = await load_test(f"http://127.0.0.1:{args.port}/servers", args.clients, args.duration)
+    return {
+        "benchmark": "get-servers",
+        "servers": args.servers,
+        "clients": args.clients,
+        "duration_s": args.duration,
+        **result,
+    }
+
+
+async def bench_import_csv(args) -> dict:
+    # Only the CSV is needed, nothing has to answer on the addresses
+    body = FakeFleet(args.servers, args.http_share, seed=args.seed).csv()
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = args.db_path or os.path.join(tmp, "bench.db")
+        async with ApiServer(args.backend_dir, db_path, args.port, api_env(args, {"DCMON_PROBE_LOOP": "0"})) as api:
+            async with aiohttp.ClientSession() as session:
+                result = await import_csv(session, api.url, body)
+    return {"benchmark": "import-csv", "servers": args.servers, **result}
+
+
+async def bench_fleet(args) -> dict:
+    fleet = FakeFleet(
+        args.servers, args.http_share, args.latency_ms, args.jitter_ms, args.drop_rate,
+        args.slow_rate, args.slow_ms, args.seed, args.fleet_port, args.fleet_port + 1,
+    )
+    fleet.start()
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            db_path = args.db_path or os.path.join(tmp, "bench.db")
+            # Sweeps are driven from here so each one can be timed
+            env = api_env(args, {"DCMON_PROBE_LOOP": "0"})
+            async with ApiServer(args.backend_dir, db_path, args.port, env) as api:
+                async with aiohttp.ClientSession() as session:
+                    imported = await import_csv(session, api.url, fleet.csv())
+                    sweeps = [await sweep(session, api.url) for _ in range(args.sweeps)]
+                    idle = await load_test(f"{api.url}/servers", args.clients, args.duration)
+                    # The list under load while a sweep writes statuses
+                    running = asyncio.create_task(sweep(session, api.url))
+                    during = await load_test(f"{api.url}/servers", args.clients, args.duration)
+                    sweeps.append(await running)
+    finally:
+        fleet.stop()
+    return {
+        "benchmark": "fleet",
+        "servers": args.servers,
+        "fleet": {
+            "http_share": args.http_share,
+            "latency_ms": args.latency_ms,
+            "jitter_ms": args.jitter_ms,
+            "drop_rate": args.drop_rate,
+            "slow_rate": args.slow_rate,
+            "slow_ms": args.slow_ms,
+            "seed": args.seed,
+            **fleet.stats(),
+        },
+        "import_csv": imported,
+        "sweeps": sweeps,
+        "get_servers": {"clients": args.clients, "duration_s": args.duration, "idle": idle, "during_sweep": during},
+    }
+
+
+def time_best(fn, repeat: int = 5) -> float:
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return round(best * 1000, 2)
+
+
+async def bench_serialize(args) -> dict:
+    # In process: only how a page of rows becomes a response body
+    from fastapi.encoders import jsonable_encoder
+    from listing import SERVER_COLUMNS, encode_page
+
+    conn = sqlite3.connect(":memory:")
+    conn.row_factory = sqlite3.Row
+    conn.execute(f"CREATE TABLE servers ({', '.join(SERVER_COLUMNS)})")
+    conn.executemany(
+        f"INSERT INTO servers VALUES ({', '.join('?' * len(SERVER_COLUMNS))})",
+        [
+            (i, f"app{i % 50}_server{i}", None, "HTTP", "online", "Not Started", "HTTP 200 OK",
+             f"team{i % 40}", f"team{i % 40}@example.com", f"host{i}.example.com", 443, i % 50 + 1, None, None, i)
+            for i in range(1, args.servers + 1)
+        ]
+    )
+    fields = list(SERVER_COLUMNS)
+    rows = conn.execute(f"SELECT {', '.join(fields)} FROM servers ORDER BY id").fetchall()
+    conn.close()
+    limit = len(rows)
+
+    def encoder_path():
+        # What the list endpoints did before: dicts run through jsonable_encoder
+        items = [dict(row) for row in rows]
+        json.dumps(jsonable_encoder({"items": items, "next_cursor": None, "limit": limit})).encode()
+
+    def dict_path():
+        items = [dict(row) for row in rows]
+        json.dumps({"items": items, "next_cursor": None, "limit": limit}).encode()
+
+    def orjson_path():
+        encode_page(rows, fields, fields, "id", limit)
+
+    return {
+        "benchmark": "serialize",
+        "rows": len(rows),
+        "jsonable_encoder_ms": time_best(encoder_path),
+        "json_dumps_ms": time_best(dict_path),
+        "encode_page_ms": time_best(orjson_path),
+        "body_bytes": len(encode_page(rows, fields, fields, "id", limit)),
+    }
+
+
+IMPORT_TIMER = """
+import sys, time
+started = time.perf_counter()
+import main
+print(time.perf_counter() - started, 'aiohttp' in sys.modules)
+"""
+
+
+async def bench_startup(args) -> dict:
+    imports, loaded, first, ready = [], [], None, []
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = args.db_path or os.path.join(tmp, "bench.db")
+        env = dict(os.environ, DCMON_DB_PATH=db_path)
+        for _ in range(args.runs):
+            output = subprocess.run(
+                [sys.executable, "-c", IMPORT_TIMER], cwd=args.backend_dir, env=env,
+                capture_output=True, text=True, check=True,
+            ).stdout.split()
+            imports.append(float(output[0]))
+            loaded.append(output[1] == "True")
+        # The first start on a new database runs the migrations, the
+        # rest only find the schema current
+        for run in range(args.runs + 1):
+            async with ApiServer(args.backend_dir, db_path, args.port, api_env(args, {"DCMON_PROBE_LOOP": "0"})) as api:
+                if run == 0:
+                    first = round(api.ready_s * 1000, 1)
+                else:
+                    ready.append(api.ready_s)
+    return {
+        "benchmark": "startup",
+        "runs": args.runs,
+        "import_ms": percentiles(imports),
+        "import_loads_aiohttp": any(loaded),
+        "first_start_ready_ms": first,
+        "ready_ms": percentiles(ready),
+    }
+
+
+BENCHMARKS = {
+    "get-servers": bench_get_servers,
+    "import-csv": bench_import_csv,
+    "fleet": bench_fleet,
+    "serialize": bench_serialize,
+    "startup": bench_startup,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("benchmark", choices=sorted(BENCHMARKS))
+    parser.add_argument("--servers", type=int, default=2000, help="Servers to seed, import or simulate")
+    parser.add_argument("--clients", type=int, default=16, help="Concurrent HTTP clients")
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds to run each load test")
+    parser.add_argument("--runs", type=int, default=5, help="Process starts to time (startup)")
+    parser.add_argument("--port", type=int, default=3100, help="Port for the API under test")
+    parser.add_argument("--backend-dir", default=BACKEND_DIR, help="Backend checkout to benchmark")
+    parser.add_argument("--db-path", help="Database file the API under test uses")
+    parser.add_argument("--env", action="append", default=[], metavar="NAME=VALUE",
+                        help="Extra environment for the API under test, e.g. DCMON_PROBE_TIMEOUT=2")
+    fleet = parser.add_argument_group("fake fleet")
+    fleet.add_argument("--http-share", type=float, default=0.5, help="Share of HTTP servers; the rest speak SSH")
+    fleet.add_argument("--latency-ms", type=float, default=5.0, help="Delay before each answer")
+    fleet.add_argument("--jitter-ms", type=float, default=2.0, help="Random spread of the delay, either way")
+    fleet.add_argument("--drop-rate", type=float, default=0.0, help="Chance a connection or request gets no answer")
+    fleet.add_argument("--slow-rate", type=float, default=0.0, help="Share of servers that always answer slowly")
+    fleet.add_argument("--slow-ms", type=float, default=3000.0, help="Delay of the slow servers")
+    fleet.add_argument("--sweeps", type=int, default=3, help="Timed full sweeps before the load tests")
+    fleet.add_argument("--seed", type=int, default=0, help="Seed for the fleet layout and drops")
+    fleet.add_argument("--fleet-port", type=int, default=3180, help="HTTP port of the fleet; SSH uses the next one")
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(BENCHMARKS[args.benchmark](args)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
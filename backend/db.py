@@ -0,0 +1,202 @@
+import asyncio
+import queue
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Callable, List, Optional
+
+from config import DATABASE_URL, DB_BUSY_TIMEOUT_MS, DB_CACHE_KB, DB_MMAP_BYTES, DB_PATH, DB_READERS, EXPORT_BATCH_ROWS
+from metrics import registry
+
+DB_WAIT_SECONDS = registry.histogram(
+    'dcmon_db_queue_wait_seconds', 'Time database calls waited for a free connection thread.', ('op',)
+)
+DB_SECONDS = registry.histogram(
+    'dcmon_db_duration_seconds', 'Time spent running database calls, including the commit for writes.', ('op',)
+)
+
+
+class Database:
+    """Long-lived SQLite connections driven from worker threads.
+
+    Reads are spread over a small pool of reader connections and writes go
+    through a single writer connection on its own thread, so writers are
+    serialized without SQLITE_BUSY retries and no sqlite call ever runs on
+    the event loop. Connections stay open for the life of the process, which
+    keeps their PRAGMAs and prepared statement caches warm.
+
+    Subclasses for other engines override connect() and the class
+    attributes below; see pg.PostgresDatabase.
+    """
+
+    dialect = "sqlite"
+    Error = sqlite3.Error
+    # Starts every write transaction; IMMEDIATE takes the write lock up front
+    begin = 'BEGIN IMMEDIATE'
+
+    def __init__(self, path: str = DB_PATH, readers: int = DB_READERS, writers: int = 1):
+        self.path = path
+        self.readers = readers
+        self.writers = writers
+        self._reader_pool: "queue.Queue[sqlite3.Connection]" = queue.Queue()
+        self._reader_executor: Optional[ThreadPoolExecutor] = None
+        self._writer_pool: "queue.Queue[sqlite3.Connection]" = queue.Queue()
+        self._writer_executor: Optional[ThreadPoolExecutor] = None
+        # Calls submitted but not finished, by "read" / "write"
+        self.pending = {"read": 0, "write": 0}
+        # Write transactions committed by this process
+        self.commits = 0
+
+    def connect(self, reader: bool = False) -> sqlite3.Connection:
+        """A new connection set up like the pooled ones."""
+        conn = sqlite3.connect(
+            self.path,
+            timeout=DB_BUSY_TIMEOUT_MS / 1000,
+            isolation_level=None,
+            check_same_thread=False,
+            cached_statements=512,
+        )
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute(f'PRAGMA cache_size=-{DB_CACHE_KB}')
+        conn.execute(f'PRAGMA mmap_size={DB_MMAP_BYTES}')
+        conn.execute(f'PRAGMA busy_timeout={DB_BUSY_TIMEOUT_MS}')
+        conn.execute('PRAGMA temp_store=MEMORY')
+        return conn
+
+    def _prepare(self, conn):
+        # WAL is persistent in the database file, setting it once is enough
+        conn.execute('PRAGMA journal_mode=WAL')
+
+    @property
+    def is_open(self) -> bool:
+        return self._writer_executor is not None
+
+    def open(self):
+        if self.is_open:
+            return
+        for index in range(self.writers):
+            conn = self.connect()
+            if index == 0:
+                self._prepare(conn)
+            self._writer_pool.put(conn)
+        self._writer_executor = ThreadPoolExecutor(max_workers=self.writers, thread_name_prefix="db-writer")
+        for _ in range(self.readers):
+            self._reader_pool.put(self.connect(reader=True))
+        self._reader_executor = ThreadPoolExecutor(max_workers=self.readers, thread_name_prefix="db-reader")
+
+    def close(self):
+        if not self.is_open:
+            return
+        self._writer_executor.shutdown(wait=True)
+        self._reader_executor.shutdown(wait=True)
+        self._writer_executor = None
+        for pool in (self._writer_pool, self._reader_pool):
+            while not pool.empty():
+                pool.get_nowait().close()
+
+    def _run_read(self, fn: Callable, args: tuple, queued: float) -> Any:
+        started = time.perf_counter()
+        DB_WAIT_SECONDS.observe(started - queued, op="read")
+        conn = self._reader_pool.get()
+        try:
+            return fn(conn, *args)
+        finally:
+            self._reader_pool.put(conn)
+            DB_SECONDS.observe(time.perf_counter() - started, op="read")
+
+    def _run_write(self, fn: Callable, args: tuple, queued: float) -> Any:
+        started = time.perf_counter()
+        DB_WAIT_SECONDS.observe(started - queued, op="write")
+        conn = self._writer_pool.get()
+        try:
+            conn.execute(self.begin)
+            try:
+                result = fn(conn, *args)
+            except BaseException:
+                if conn.in_transaction:
+                    conn.rollback()
+                raise
+            if conn.in_transaction:
+                conn.execute('COMMIT')
+            self.commits += 1
+            return result
+        finally:
+            self._writer_pool.put(conn)
+            DB_SECONDS.observe(time.perf_counter() - started, op="write")
+
+    async def _submit(self, op: str, executor: ThreadPoolExecutor, runner: Callable, fn: Callable, args: tuple) -> Any:
+        loop = asyncio.get_running_loop()
+        self.pending[op] += 1
+        try:
+            return await loop.run_in_executor(executor, runner, fn, args, time.perf_counter())
+        finally:
+            self.pending[op] -= 1
+
+    async def read(self, fn: Callable, *args) -> Any:
+        """Run fn(conn, *args) on a reader connection."""
+        return await self._submit("read", self._reader_executor, self._run_read, fn, args)
+
+    async def write(self, fn: Callable, *args) -> Any:
+        """Run fn(conn, *args) on a writer connection inside one transaction."""
+        return await self._submit("write", self._writer_executor, self._run_write, fn, args)
+
+    async def fetchall(self, sql: str, params: tuple = ()) -> List[sqlite3.Row]:
+        return await self.read(lambda conn: conn.execute(sql, params).fetchall())
+
+    async def fetchone(self, sql: str, params: tuple = ()) -> Optional[sqlite3.Row]:
+        return await self.read(lambda conn: conn.execute(sql, params).fetchone())
+
+    async def execute(self, sql: str, params: tuple = ()) -> sqlite3.Cursor:
+        """Run one write statement; the returned cursor carries rowcount."""
+        return await self.write(lambda conn: conn.execute(sql, params))
+
+    def _open_cursor(self, conn, sql: str, params: tuple):
+        # sqlite3 cursors step through the result as rows are fetched
+        conn.execute('BEGIN')
+        return conn.execute(sql, params)
+
+    async def stream(self, sql: str, params: tuple = (), batch: int = EXPORT_BATCH_ROWS) -> AsyncIterator[list]:
+        """Rows of one query, ``batch`` at a time, however large the result.
+
+        The query runs in one read transaction, so the rows form a single
+        snapshot, on a connection and thread of its own: a consumer as slow
+        as its HTTP client holds neither a pooled reader nor the writer.
+        Only the current batch is in memory.
+        """
+        loop = asyncio.get_running_loop()
+        # One thread, so the final close waits for any fetch still running
+        executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-stream")
+        conn = None
+        try:
+            conn = await loop.run_in_executor(executor, self.connect, True)
+            cursor = await loop.run_in_executor(executor, self._open_cursor, conn, sql, params)
+            while True:
+                rows = await loop.run_in_executor(executor, cursor.fetchmany, batch)
+                if not rows:
+                    return
+                yield rows
+        finally:
+            # Ends the transaction too
+            if conn is not None:
+                executor.submit(conn.close)
+            executor.shutdown(wait=False)
+
+
+def open_database(url: str = DATABASE_URL) -> Database:
+    """The Database for ``url``; SQLite at DB_PATH when it is empty."""
+    if url.startswith(("postgres://", "postgresql://")):
+        # psycopg2 is only needed for PostgreSQL deployments
+        from pg import PostgresDatabase
+        return PostgresDatabase(url)
+    if url:
+        raise ValueError(f"Unsupported database URL: {url}")
+    return Database()
+
+
+db = open_database()
+
+registry.gauge(
+    'dcmon_db_pending_calls', 'Database calls queued or running.',
+    lambda: {(op,): count for op, count in db.pending.items()}, ('op',),
+)
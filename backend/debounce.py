@@ -0,0 +1,99 @@
+from typing import Dict, Optional, Tuple
+
+from config import (
+    STATUS_DEGRADED_LATENCY_MS,
+    STATUS_FAIL_THRESHOLD,
+    STATUS_RECOVER_THRESHOLD,
+)
+from rollup import PROBED_STATUSES, UP_STATUSES
+
+
+class StatusDebouncer:
+    """Hysteresis between raw probe results and the stored server status.
+
+    A server is only marked offline after ``fail_after`` consecutive failed
+    probes, and only comes back after ``recover_after`` consecutive
+    successes in the new state. Until then the stored row is left alone, so
+    a single dropped packet causes no write, rollup or event. Results that
+    come back slower than ``degraded_ms`` count as "degraded", which is an
+    up status with its own hysteresis.
+
+    Only servers with a change in progress take an entry in ``_pending``;
+    ``_current`` remembers the last stored status so the probe scheduler
+    can ask whether a failure is worth confirming straight away.
+    """
+
+    def __init__(
+        self,
+        fail_after: int = STATUS_FAIL_THRESHOLD,
+        recover_after: int = STATUS_RECOVER_THRESHOLD,
+        degraded_ms: float = STATUS_DEGRADED_LATENCY_MS,
+    ):
+        self.fail_after = max(1, fail_after)
+        self.recover_after = max(1, recover_after)
+        self.degraded_ms = degraded_ms
+        # server id -> (candidate status, consecutive results seen)
+        self._pending: Dict[int, Tuple[str, int]] = {}
+        self._current: Dict[int, str] = {}
+        self.suppressed = 0
+        self.confirmed = 0
+
+    def classify(self, result: dict) -> str:
+        status = result["status"]
+        if status == "online" and self.degraded_ms and (result.get("latency_ms") or 0) > self.degraded_ms:
+            return "degraded"
+        return status
+
+    def apply(self, server_id: int, result: dict, current: Optional[str]) -> Optional[dict]:
+        """The result to store, or None while a status change is unconfirmed.
+
+        A failed result carrying ``attempts`` (from fast retries) counts as
+        that many consecutive failures.
+        """
+        status = self.classify(result)
+        if status != result["status"]:
+            result = {**result, "status": status, "message": f"{result['message']} (slow: over {self.degraded_ms:g} ms)"}
+        # Unknown, Pending and the like were set before probing began and
+        # are replaced by the first result
+        if status == current or current not in PROBED_STATUSES:
+            self._pending.pop(server_id, None)
+            self._current[server_id] = status
+            return result
+
+        candidate, count = self._pending.get(server_id, (None, 0))
+        weight = result.get("attempts", 1) if status == "offline" else 1
+        count = count + weight if candidate == status else weight
+        if count < (self.fail_after if status == "offline" else self.recover_after):
+            self._pending[server_id] = (status, count)
+            self._current[server_id] = current
+            self.suppressed += 1
+            return None
+        self._pending.pop(server_id, None)
+        self._current[server_id] = status
+        self.confirmed += 1
+        return result
+
+    def should_retry(self, server_id: int, result: dict, attempts: int) -> bool:
+        """Whether a failed probe of a server stored as up needs more failures to confirm.
+
+        Servers not seen since startup are assumed up, which costs a down
+        server a few extra probes once.
+        """
+        if result["status"] != "offline" or self._current.get(server_id, "online") not in UP_STATUSES:
+            return False
+        candidate, count = self._pending.get(server_id, (None, 0))
+        return (count if candidate == "offline" else 0) + attempts < self.fail_after
+
+    def forget(self, server_id: int):
+        self._pending.pop(server_id, None)
+        self._current.pop(server_id, None)
+
+    def stats(self) -> dict:
+        return {
+            "pending": len(self._pending),
+            "suppressed": self.suppressed,
+            "confirmed": self.confirmed,
+            "fail_after": self.fail_after,
+            "recover_after": self.recover_after,
+            "degraded_ms": self.degraded_ms,
+        }
@@ -0,0 +1,159 @@
+import asyncio
+import json
+from collections import deque
+from typing import Dict, Optional, Set
+
+from config import EVENT_KEEPALIVE, EVENT_QUEUE_SIZE, RELAY_INTERVAL
+from db import Database
+from sync import changes_since, current_version
+
+RELAY_FIELDS = ['id', 'status', 'test_response']
+
+
+class Subscription:
+    """One client's bounded event queue.
+
+    When the client falls behind, the oldest events are dropped and the
+    next event it reads is a "resync", telling it to reload instead of
+    trusting the gap.
+    """
+
+    def __init__(self, max_size: int):
+        self._events = deque(maxlen=max_size)
+        self._ready = asyncio.Event()
+        self.dropped = 0
+        self._lost = False
+
+    def put(self, event: str):
+        if len(self._events) == self._events.maxlen:
+            self.dropped += 1
+            self._lost = True
+        self._events.append(event)
+        self._ready.set()
+
+    async def get(self, timeout: Optional[float] = None) -> Optional[str]:
+        """Next encoded event, or None when ``timeout`` passes first."""
+        if not self._events:
+            self._ready.clear()
+            try:
+                await asyncio.wait_for(self._ready.wait(), timeout)
+            except asyncio.TimeoutError:
+                return None
+        if self._lost:
+            self._lost = False
+            self._events.clear()
+            return encode_event("resync", {"dropped": self.dropped})
+        return self._events.popleft()
+
+
+def encode_event(event_type: str, data) -> str:
+    return f"event: {event_type}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n"
+
+
+class BroadcastHub:
+    """Fans events out to every connected client.
+
+    Events are encoded once in publish() and the same string is queued for
+    each subscriber, so the cost per client is a deque append. publish()
+    never blocks; slow clients only lose their own oldest events.
+    """
+
+    def __init__(self, queue_size: int = EVENT_QUEUE_SIZE, keepalive: float = EVENT_KEEPALIVE):
+        self.queue_size = queue_size
+        self.keepalive = keepalive
+        self._subscribers: Set[Subscription] = set()
+        self.published = 0
+
+    def subscribe(self) -> Subscription:
+        subscription = Subscription(self.queue_size)
+        self._subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        self._subscribers.discard(subscription)
+
+    def publish(self, event_type: str, data):
+        self.published += 1
+        if not self._subscribers:
+            return
+        event = encode_event(event_type, data)
+        for subscription in self._subscribers:
+            subscription.put(event)
+
+    async def stream(self):
+        """Server-Sent Events body for one client, with keepalive comments."""
+        subscription = self.subscribe()
+        try:
+            yield f"retry: 3000\n{encode_event('hello', {'queue_size': self.queue_size})}"
+            while True:
+                event = await subscription.get(self.keepalive)
+                yield event if event is not None else ": keepalive\n\n"
+        finally:
+            self.unsubscribe(subscription)
+
+    def stats(self) -> dict:
+        return {
+            "subscribers": len(self._subscribers),
+            "published": self.published,
+            "dropped": sum(s.dropped for s in self._subscribers),
+        }
+
+
+class ChangeRelay:
+    """Publishes changes made by other processes, read from the change feed.
+
+    When several processes share the database, each one's hub only sees
+    its own writes. The relay polls the row_version feed every
+    ``interval`` seconds and publishes what changed as one "status" event,
+    plus a "servers" / "application" event when rows were added or
+    deleted, so every client sees every change whichever process it is
+    connected to.
+    """
+
+    def __init__(self, db: Database, hub: "BroadcastHub", interval: float = RELAY_INTERVAL):
+        self.db = db
+        self.hub = hub
+        self.interval = interval
+        self._versions: Dict[str, int] = {}
+        self._max_ids: Dict[str, int] = {}
+
+    def _start(self, conn):
+        for kind, table in (('server', 'servers'), ('application', 'applications')):
+            self._versions[kind] = current_version(conn, kind)
+            self._max_ids[kind] = conn.execute(f'SELECT COALESCE(MAX(id), 0) FROM {table}').fetchone()[0]
+
+    async def _changes(self, kind: str):
+        items, deleted = [], []
+        more = True
+        while more:
+            changes = await self.db.read(changes_since, kind, RELAY_FIELDS, self._versions[kind], [], [], 5000)
+            items.extend(changes["items"])
+            deleted.extend(changes["deleted"])
+            self._versions[kind] = changes["version"]
+            more = changes["more"]
+        added = [item["id"] for item in items if item["id"] > self._max_ids[kind]]
+        if added:
+            self._max_ids[kind] = max(added)
+        return items, bool(added or deleted)
+
+    async def poll(self):
+        servers, servers_changed = await self._changes('server')
+        applications, applications_changed = await self._changes('application')
+        if servers or applications:
+            self.hub.publish("status", {"servers": servers, "applications": applications})
+        if servers_changed:
+            self.hub.publish("servers", {"action": "changed"})
+        if applications_changed:
+            self.hub.publish("application", {"action": "changed"})
+
+    async def run(self):
+        await self.db.read(self._start)
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.poll()
+            except Exception as e:
+                print(f"Error relaying changes: {e}")
+
+
+hub = BroadcastHub()
@@ -0,0 +1,62 @@
+import csv
+import io
+from typing import AsyncIterator, List, Tuple
+
+from db import Database
+from listing import SERVER_COLUMNS, encode_json
+
+EXPORT_FORMATS = ('csv', 'ndjson')
+
+# CSV column -> server column. The first block is what CsvImporter reads
+# (team, host and contact are its names for the owner and address
+# columns); the rest is the status snapshot, which an import ignores.
+CSV_EXPORT_COLUMNS = (
+    ('name', 'name'), ('type', 'type'), ('team', 'owner_name'), ('contact', 'owner_contact'),
+    ('host', 'hostname'), ('port', 'port'), ('application', 'application'),
+    ('shutdown_order', 'shutdown_order'), ('dependencies', 'dependencies'),
+    ('id', 'id'), ('status', 'status'), ('shutdown_status', 'shutdown_status'),
+    ('test_response', 'test_response'),
+)
+
+MEDIA_TYPES = {'csv': 'text/csv', 'ndjson': 'application/x-ndjson'}
+
+
+def build_export_query(conditions: List[str], params: list) -> Tuple[str, list]:
+    """Every server matching the list filters, with its application's name, by id."""
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    columns = ', '.join(f's.{column}' for column in SERVER_COLUMNS)
+    # The filters name bare server columns, so they go in a subquery
+    # rather than next to the join
+    sql = (
+        f"SELECT {columns}, a.name AS application "
+        f"FROM (SELECT * FROM servers {where}) AS s "
+        f"LEFT JOIN applications a ON a.id = s.application_id ORDER BY s.id"
+    )
+    return sql, params
+
+
+def _csv_batch(rows: list, positions: List[int]) -> str:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerows([['' if row[i] is None else row[i] for i in positions] for row in rows])
+    return buffer.getvalue()
+
+
+async def export_servers(db: Database, fmt: str, conditions: List[str], params: list) -> AsyncIterator[bytes]:
+    """The filtered servers as CSV or NDJSON, one encoded batch at a time.
+
+    Rows come from Database.stream(), so memory use depends on the batch
+    size, not the fleet. The CSV imports back through /servers/import-csv:
+    servers come back in their applications, under new ids and with
+    fresh status.
+    """
+    sql, params = build_export_query(conditions, params)
+    columns = SERVER_COLUMNS + ('application',)
+    if fmt == 'csv':
+        positions = [columns.index(column) for _, column in CSV_EXPORT_COLUMNS]
+        yield _csv_batch([[header for header, _ in CSV_EXPORT_COLUMNS]], range(len(CSV_EXPORT_COLUMNS))).encode()
+        async for rows in db.stream(sql, params):
+            yield _csv_batch(rows, positions).encode()
+    else:
+        async for rows in db.stream(sql, params):
+            yield b''.join(encode_json(dict(zip(columns, row))) + b'\n' for row in rows)
@@ -0,0 +1,326 @@
+import asyncio
+import bisect
+import json
+import time
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+from config import (
+    HISTORY_FLUSH_INTERVAL,
+    HISTORY_FLUSH_ROWS,
+    HISTORY_HOUR_RETENTION_DAYS,
+    HISTORY_MAINTENANCE_INTERVAL,
+    HISTORY_MINUTE_RETENTION_DAYS,
+    HISTORY_RAW_RETENTION_DAYS,
+    HISTORY_ROLLUP_GRACE,
+)
+from db import Database
+from rollup import UP_STATUSES
+
+DAY_MS = 86400 * 1000
+
+# Error classes reported by probes; anything unknown is "other"
+ERROR_CODES = {None: 0, "invalid": 1, "dns": 2, "timeout": 3, "connect": 4, "http": 5, "other": 6, "protocol": 7}
+
+# Upper bounds (ms) of the latency histogram buckets, growing by ~40% from
+# 0.5ms to 10s; the last bucket is open
+LATENCY_EDGES_MS = tuple(round(0.5 * 1.392 ** i, 3) for i in range(31))
+HISTOGRAM = [f"h{i}" for i in range(len(LATENCY_EDGES_MS) + 1)]
+
+
+class Tier(NamedTuple):
+    name: str
+    # Width of a rollup bucket; None for raw samples
+    bucket_ms: Optional[int]
+    partition_ms: int
+    retention_ms: int
+
+    @property
+    def column(self) -> str:
+        return 'ts' if self.bucket_ms is None else 'bucket'
+
+    @property
+    def unit_ms(self) -> int:
+        # Milliseconds per step of the time column
+        return self.bucket_ms or 1
+
+    def table(self, partition: int) -> str:
+        return f"history_{self.name}_{partition}"
+
+
+RAW = Tier('raw', None, DAY_MS, int(HISTORY_RAW_RETENTION_DAYS * DAY_MS))
+MINUTE = Tier('1m', 60 * 1000, 7 * DAY_MS, int(HISTORY_MINUTE_RETENTION_DAYS * DAY_MS))
+HOUR = Tier('1h', 3600 * 1000, 91 * DAY_MS, int(HISTORY_HOUR_RETENTION_DAYS * DAY_MS))
+TIERS = (RAW, MINUTE, HOUR)
+
+
+def encode(result: dict) -> Tuple[int, int]:
+    """(code, latency_us) for a probe result.
+
+    code packs the up bit (bit 0), the error class (bits 1-3) and the
+    latency histogram bucket (bits 4-8) into one small integer.
+    """
+    latency_ms = result.get("latency_ms") or 0.0
+    up = 1 if result["status"] in UP_STATUSES else 0
+    error = ERROR_CODES.get(result.get("error"), ERROR_CODES["other"]) if not up else 0
+    bucket = bisect.bisect_left(LATENCY_EDGES_MS, latency_ms)
+    return up | error << 1 | bucket << 4, int(latency_ms * 1000)
+
+
+def servers_selector(server_ids: Sequence[int]) -> Tuple[str, tuple]:
+    """A summarize() selector for any number of servers.
+
+    The ids go in as one JSON array rather than a parameter each, which
+    would run into SQLite's bound parameter limit on large applications.
+    """
+    return 'server_id IN (SELECT value FROM json_each(?))', (json.dumps(list(server_ids)),)
+
+
+def percentile(histogram: List[int], fraction: float) -> Optional[float]:
+    """Latency (ms) at ``fraction`` of the histogram, interpolated within its bucket."""
+    total = sum(histogram)
+    if not total:
+        return None
+    rank = fraction * total
+    seen = 0
+    for index, count in enumerate(histogram):
+        if count and seen + count >= rank:
+            low = LATENCY_EDGES_MS[index - 1] if index else 0
+            high = LATENCY_EDGES_MS[index] if index < len(LATENCY_EDGES_MS) else LATENCY_EDGES_MS[-1] * 2
+            return round(low + (high - low) * (rank - seen) / count, 3)
+        seen += count
+    return float(LATENCY_EDGES_MS[-1])
+
+
+class HistoryStore:
+    """Append-only probe history with 1 minute and 1 hour rollups.
+
+    Every probe result is buffered as (ts, server_id, code, latency_us)
+    and written in batches. Each tier is split into time partitions, one
+    table per partition keyed (server_id, time) WITHOUT ROWID, so range
+    reads for a server are a single index seek and retention drops whole
+    tables instead of deleting rows. Raw samples are rolled up into
+    minute buckets, and minute buckets into hour buckets, once
+    ``rollup_grace`` has passed. Each bucket keeps the sample and up
+    counts plus a latency histogram of the successful probes.
+    """
+
+    def __init__(
+        self,
+        db: Database,
+        max_rows: int = HISTORY_FLUSH_ROWS,
+        flush_interval: float = HISTORY_FLUSH_INTERVAL,
+        maintenance_interval: float = HISTORY_MAINTENANCE_INTERVAL,
+        rollup_grace: float = HISTORY_ROLLUP_GRACE,
+    ):
+        self.db = db
+        self.max_rows = max_rows
+        self.flush_interval = flush_interval
+        self.maintenance_interval = maintenance_interval
+        self.rollup_grace_ms = int(rollup_grace * 1000)
+        self._rows: List[tuple] = []
+        self._tables = None
+        self._lock: Optional[asyncio.Lock] = None
+        self.recorded = 0
+
+    @property
+    def pending(self) -> int:
+        return len(self._rows)
+
+    def record(self, server_id: int, result: dict, ts: Optional[float] = None):
+        code, latency_us = encode(result)
+        self._rows.append((server_id, int((time.time() if ts is None else ts) * 1000), code, latency_us))
+        self.recorded += 1
+        if len(self._rows) >= self.max_rows:
+            asyncio.ensure_future(self.flush())
+
+    async def flush(self):
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            if not self._rows:
+                return
+            rows, self._rows = self._rows, []
+            try:
+                await self.db.write(self._write, rows)
+            except Exception as e:
+                print(f"Error writing probe history: {e}")
+
+    async def run(self):
+        next_maintenance = 0.0
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+            if time.monotonic() >= next_maintenance:
+                try:
+                    await self.db.write(self.maintain, int(time.time() * 1000))
+                except Exception as e:
+                    print(f"Error maintaining probe history: {e}")
+                next_maintenance = time.monotonic() + self.maintenance_interval
+
+    # Writer thread
+
+    def _known_tables(self, conn) -> set:
+        if self._tables is None:
+            self._tables = {
+                row[0] for row in
+                conn.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name LIKE 'history_%'")
+            }
+        return self._tables
+
+    def _ensure_table(self, conn, tier: Tier, partition: int) -> str:
+        table = tier.table(partition)
+        if table not in self._known_tables(conn):
+            if tier is RAW:
+                columns = 'server_id INTEGER NOT NULL, ts INTEGER NOT NULL, code INTEGER NOT NULL, latency_us INTEGER'
+                key = 'server_id, ts'
+            else:
+                counts = ', '.join(f'{column} INTEGER NOT NULL' for column in ['samples', 'up'] + HISTOGRAM)
+                columns = f'server_id INTEGER NOT NULL, bucket INTEGER NOT NULL, {counts}'
+                key = 'server_id, bucket'
+            conn.execute(f'CREATE TABLE IF NOT EXISTS {table} ({columns}, PRIMARY KEY ({key})) WITHOUT ROWID')
+            self._tables.add(table)
+        return table
+
+    def _write(self, conn, rows: List[tuple]):
+        partitions: Dict[int, List[tuple]] = {}
+        for row in rows:
+            partitions.setdefault(row[1] // RAW.partition_ms, []).append(row)
+        for partition, batch in partitions.items():
+            table = self._ensure_table(conn, RAW, partition)
+            # Two results for a server in the same millisecond keep the last
+            conn.executemany(
+                f'INSERT OR REPLACE INTO {table} (server_id, ts, code, latency_us) VALUES (?, ?, ?, ?)', batch
+            )
+
+    def _watermark(self, conn, tier: Tier) -> Optional[int]:
+        row = conn.execute('SELECT value FROM history_state WHERE name = ?', (tier.name,)).fetchone()
+        return row[0] if row else None
+
+    def maintain(self, conn, now_ms: int):
+        """Roll up closed buckets and drop partitions past retention."""
+        conn.execute('CREATE TABLE IF NOT EXISTS history_state (name TEXT PRIMARY KEY, value INTEGER NOT NULL)')
+        self._rollup(conn, RAW, MINUTE, now_ms - self.rollup_grace_ms, now_ms)
+        self._rollup(conn, MINUTE, HOUR, self._watermark(conn, MINUTE) or 0, now_ms)
+        for tier in TIERS:
+            oldest = (now_ms - tier.retention_ms) // tier.partition_ms
+            prefix = tier.table(0)[:-1]
+            for table in sorted(self._known_tables(conn)):
+                suffix = table[len(prefix):]
+                if table.startswith(prefix) and suffix.isdigit() and int(suffix) < oldest:
+                    conn.execute(f'DROP TABLE {table}')
+                    self._tables.discard(table)
+
+    def _rollup(self, conn, source: Tier, target: Tier, until_ms: int, now_ms: int):
+        end = until_ms // target.bucket_ms * target.bucket_ms
+        # Nothing older than the source's retention is left to roll up
+        start = max(self._watermark(conn, target) or 0, now_ms - source.retention_ms)
+        start = start // target.bucket_ms * target.bucket_ms
+        if start >= end:
+            return
+        if source is RAW:
+            counts = ['COUNT(*)', 'SUM(code & 1)'] + [
+                f'SUM((code & 1) AND (code >> 4) = {bucket})' for bucket in range(len(HISTOGRAM))
+            ]
+        else:
+            counts = [f'SUM({column})' for column in ['samples', 'up'] + HISTOGRAM]
+        ratio = target.bucket_ms // source.unit_ms
+        position = start
+        while position < end:
+            # Never let one statement span two partitions of either tier
+            source_partition = position // source.partition_ms
+            target_partition = position // target.partition_ms
+            slice_end = min(
+                end,
+                (source_partition + 1) * source.partition_ms,
+                (target_partition + 1) * target.partition_ms,
+            )
+            source_table = source.table(source_partition)
+            if source_table in self._known_tables(conn):
+                target_table = self._ensure_table(conn, target, target_partition)
+                column = source.column
+                conn.execute(
+                    f'''INSERT OR REPLACE INTO {target_table}
+                        SELECT server_id, {column} / {ratio}, {', '.join(counts)}
+                        FROM {source_table}
+                        WHERE {column} >= ? AND {column} < ?
+                        GROUP BY server_id, {column} / {ratio}''',
+                    (position // source.unit_ms, slice_end // source.unit_ms)
+                )
+            position = slice_end
+        conn.execute(
+            'INSERT OR REPLACE INTO history_state (name, value) VALUES (?, ?)', (target.name, end)
+        )
+
+    # Reader threads
+
+    def summarize(self, conn, selector: str, params: tuple, start_ms: int, end_ms: int, now_ms: int) -> dict:
+        """Uptime and latency percentiles for the servers matched by ``selector`` (a server_id predicate)."""
+        tables = {
+            row[0] for row in
+            conn.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name LIKE 'history_%'")
+        }
+        watermarks = {}
+        if 'history_state' in tables:
+            watermarks = dict(conn.execute('SELECT name, value FROM history_state').fetchall())
+        minute_mark = watermarks.get(MINUTE.name, start_ms)
+        hour_mark = watermarks.get(HOUR.name, start_ms)
+
+        # Coarse tiers for the old part of the range, finer ones for what
+        # has not been rolled up yet
+        if start_ms >= now_ms - RAW.retention_ms:
+            segments = [(RAW, start_ms, end_ms)]
+        elif start_ms >= now_ms - MINUTE.retention_ms:
+            segments = [(MINUTE, start_ms, minute_mark), (RAW, max(start_ms, minute_mark), end_ms)]
+        else:
+            segments = [
+                (HOUR, start_ms, hour_mark),
+                (MINUTE, max(start_ms, hour_mark), minute_mark),
+                (RAW, max(start_ms, minute_mark), end_ms),
+            ]
+
+        samples = up = 0
+        histogram = [0] * len(HISTOGRAM)
+        for tier, low, high in segments:
+            low, high = max(low, start_ms), min(high, end_ms)
+            if low >= high:
+                continue
+            if tier is RAW:
+                counts = ['COUNT(*)', 'SUM(code & 1)'] + [
+                    f'SUM((code & 1) AND (code >> 4) = {bucket})' for bucket in range(len(HISTOGRAM))
+                ]
+            else:
+                counts = [f'SUM({column})' for column in ['samples', 'up'] + HISTOGRAM]
+            for partition in range(low // tier.partition_ms, (high - 1) // tier.partition_ms + 1):
+                table = tier.table(partition)
+                if table not in tables:
+                    continue
+                row = conn.execute(
+                    f'''SELECT {', '.join(counts)} FROM {table}
+                        WHERE {selector} AND {tier.column} >= ? AND {tier.column} < ?''',
+                    params + (low // tier.unit_ms, -(-high // tier.unit_ms))
+                ).fetchone()
+                if row[0]:
+                    samples += row[0]
+                    up += row[1]
+                    histogram = [a + b for a, b in zip(histogram, row[2:])]
+
+        return {
+            "start": start_ms / 1000,
+            "end": end_ms / 1000,
+            "resolution": segments[0][0].name,
+            "samples": samples,
+            "uptime_pct": round(100.0 * up / samples, 3) if samples else None,
+            "latency_ms": {
+                "p50": percentile(histogram, 0.5),
+                "p90": percentile(histogram, 0.9),
+                "p99": percentile(histogram, 0.99),
+            },
+        }
+
+    async def query(self, selector: str, params: tuple, start: Optional[float], end: Optional[float]) -> dict:
+        now_ms = int(time.time() * 1000)
+        end_ms = int(end * 1000) if end is not None else now_ms
+        start_ms = int(start * 1000) if start is not None else end_ms - DAY_MS
+        # Samples still buffered belong in the answer
+        await self.flush()
+        return await self.db.read(self.summarize, selector, params, start_ms, end_ms, now_ms)
@@ -0,0 +1,110 @@
+import socket
+import time
+from typing import Optional
+
+import aiohttp
+import aiohttp.abc
+
+from config import HTTP_KEEPALIVE, HTTP_POOL_LIMIT, HTTP_POOL_PER_HOST, PROBE_TIMEOUT
+from probe_plugins import PROBE_PHASE_SECONDS
+from resolver import resolver
+
+# The pooled HTTP client of the probes. Only the HTTP probe imports this
+# module, so processes that never run one never load aiohttp.
+
+
+class CachedResolver(aiohttp.abc.AbstractResolver):
+    """Lets the pooled HTTP connector share the probe resolver cache."""
+
+    async def resolve(self, host, port=0, family=socket.AF_INET):
+        try:
+            addresses = await resolver.resolve(host)
+        except socket.gaierror as e:
+            raise OSError(str(e)) from e
+        results = []
+        for address in addresses:
+            address_family = socket.AF_INET6 if ":" in address else socket.AF_INET
+            if family not in (socket.AF_UNSPEC, address_family):
+                continue
+            results.append({
+                "hostname": host,
+                "host": address,
+                "port": port,
+                "family": address_family,
+                "proto": 0,
+                "flags": socket.AI_NUMERICHOST,
+            })
+        if not results:
+            raise OSError(f"No addresses for {host}")
+        return results
+
+    async def close(self):
+        pass
+
+
+def phase_trace_config() -> aiohttp.TraceConfig:
+    """Splits each HTTP probe into connect and http phases.
+
+    The connect phase excludes name resolution, which the probe path times
+    itself, and is only seen when a new connection has to be opened; on a
+    reused keep-alive connection the whole request counts as http.
+    """
+    async def on_request_start(session, ctx, params):
+        ctx.started = time.perf_counter()
+        ctx.dns = 0.0
+
+    async def on_dns_start(session, ctx, params):
+        ctx.dns_started = time.perf_counter()
+
+    async def on_dns_end(session, ctx, params):
+        ctx.dns += time.perf_counter() - ctx.dns_started
+
+    async def on_connection_start(session, ctx, params):
+        ctx.connect_started = time.perf_counter()
+
+    async def on_connection_end(session, ctx, params):
+        ctx.started = time.perf_counter()
+        PROBE_PHASE_SECONDS.observe(ctx.started - ctx.connect_started - ctx.dns, phase="connect")
+
+    async def on_request_end(session, ctx, params):
+        PROBE_PHASE_SECONDS.observe(time.perf_counter() - ctx.started, phase="http")
+
+    trace = aiohttp.TraceConfig()
+    trace.on_request_start.append(on_request_start)
+    trace.on_dns_resolvehost_start.append(on_dns_start)
+    trace.on_dns_resolvehost_end.append(on_dns_end)
+    trace.on_connection_create_start.append(on_connection_start)
+    trace.on_connection_create_end.append(on_connection_end)
+    trace.on_request_end.append(on_request_end)
+    return trace
+
+
+_http_session: Optional[aiohttp.ClientSession] = None
+
+
+def get_http_session() -> aiohttp.ClientSession:
+    global _http_session
+    if _http_session is None or _http_session.closed:
+        connector = aiohttp.TCPConnector(
+            limit=HTTP_POOL_LIMIT,
+            limit_per_host=HTTP_POOL_PER_HOST,
+            keepalive_timeout=HTTP_KEEPALIVE,
+            resolver=CachedResolver(),
+            use_dns_cache=False,
+            # Reachability probe: internal UIs commonly use self-signed certs
+            ssl=False,
+        )
+        _http_session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=PROBE_TIMEOUT),
+            auto_decompress=False,
+            trace_configs=[phase_trace_config()],
+        )
+    return _http_session
+
+
+async def close_http_session():
+    global _http_session
+    if _http_session is not None and not _http_session.closed:
+        await _http_session.close()
+    _http_session = None
@@ -0,0 +1,281 @@
+import asyncio
+import codecs
+import csv
+import io
+import itertools
+import operator
+import re
+from typing import BinaryIO, Callable, Dict, Iterator, List, Optional, Tuple
+
+from config import IMPORT_CHUNK_ROWS, IMPORT_MAX_ERRORS, IMPORT_REBUILD_INDEX_ROWS
+from db import Database
+from search import index_servers_after
+from sync import reserve_versions
+
+SERVER_TYPES = frozenset((
+    'WEB', 'HTTPS', 'DB_MYSQL', 'DB_POSTGRES', 'DB_MONGO', 'DB_REDIS', 'APP_TOMCAT', 'APP_NODEJS',
+    'APP_PYTHON', 'MAIL', 'FTP', 'SSH', 'DNS', 'MONITORING', 'CUSTOM',
+))
+
+# CSV column -> default when the column is missing, in the order
+# row_reader() returns them
+CSV_COLUMNS = (
+    ('name', None), ('type', 'CUSTOM'), ('team', 'Unknown'), ('host', ''), ('port', 80),
+    ('shutdown_order', None), ('dependencies', None), ('contact', None), ('application', None),
+)
+
+# Left in place through a bulk import: the change feed reads by row_version
+KEPT_INDEXES = ('idx_servers_row_version',)
+
+INSERT_SERVER = '''
+    INSERT INTO servers (
+        name, type, owner_name, owner_contact, hostname, port, application_id, shutdown_order, dependencies,
+        row_version
+    )
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+'''
+
+
+class ImportSummary:
+    """Counts plus the failed rows, capped so a bad file cannot grow it unbounded."""
+
+    def __init__(self, max_errors: int = IMPORT_MAX_ERRORS):
+        self.max_errors = max_errors
+        self.imported = 0
+        self.failed = 0
+        self.applications_created = 0
+        self.errors: List[dict] = []
+
+    def fail(self, line: int, name: Optional[str], error: str):
+        self.failed += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append({"line": line, "name": name or "Unknown", "error": error})
+
+    def as_dict(self) -> dict:
+        return {
+            "imported": self.imported,
+            "failed": self.failed,
+            "applications_created": self.applications_created,
+            "errors": self.errors,
+            "errors_truncated": self.failed > len(self.errors),
+        }
+
+
+# Bytes read from the upload at a time
+UPLOAD_READ_BYTES = 64 * 1024
+
+LINE_END = re.compile(r'\r\n|\r|\n')
+
+
+def decoded_lines(upload: BinaryIO, chunk_bytes: int = UPLOAD_READ_BYTES) -> Iterator[str]:
+    """Lines of a UTF-8 upload, line endings kept, as csv.reader wants them.
+
+    Decodes read() chunks itself rather than wrapping the upload in
+    io.TextIOWrapper, which needs readable() and friends that
+    SpooledTemporaryFile (UploadFile.file) lacks before Python 3.11.
+    A leading BOM is dropped.
+    """
+    decoder = codecs.getincrementaldecoder('utf-8-sig')()
+    pending = ''
+    while True:
+        data = upload.read(chunk_bytes)
+        pending += decoder.decode(data, final=not data)
+        start = 0
+        for match in LINE_END.finditer(pending):
+            if data and match.end() == len(pending) and match.group() == '\r':
+                # The \n of a \r\n may be in the next chunk
+                break
+            yield pending[start:match.end()]
+            start = match.end()
+        pending = pending[start:]
+        if not data:
+            if pending:
+                yield pending
+            return
+
+
+def row_reader(header: List[str]) -> Callable[[list], tuple]:
+    """Turns a csv.reader row into the CSV_COLUMNS values.
+
+    Resolving column positions once is several times faster than building
+    a dict per row with csv.DictReader. Missing columns read their default
+    and short rows read None, as DictReader would give.
+    """
+    width = len(header)
+    positions = {column: index for index, column in reversed(list(enumerate(header)))}
+    defaults = []
+    indexes = []
+    for column, default in CSV_COLUMNS:
+        if column in positions:
+            indexes.append(positions[column])
+        else:
+            indexes.append(width + len(defaults))
+            defaults.append(default)
+    getter = operator.itemgetter(*indexes)
+
+    def read(row: list) -> tuple:
+        if len(row) < width:
+            row += [None] * (width - len(row))
+        elif len(row) > width:
+            del row[width:]
+        row += defaults
+        return getter(row)
+
+    return read
+
+
+class CsvImporter:
+    """Streams a server CSV into the database in chunked transactions.
+
+    Rows are parsed straight from the upload's file object, ``chunk_rows``
+    at a time, on a worker thread while the writer thread inserts the
+    previous chunk. Each chunk is validated in
+    Python, and the good rows go in with one executemany, so a chunk never
+    fails half way through. Row versions are reserved per chunk instead of
+    being stamped by the per-row trigger. Applications, named by the
+    ``application`` column or else by the server name prefix, are looked
+    up in a name -> id map loaded once up front; any missing ones are created in the chunk
+    that first needs them. Memory use depends on the chunk size, not the
+    file size.
+
+    Maintaining the secondary indexes row by row dominates the cost of a
+    large load, so when the first chunk suggests the file holds at least
+    ``rebuild_index_rows`` rows and no fewer than the table already has,
+    the server indexes are dropped for the rest of the import and rebuilt
+    once at the end. List queries fall back to scans while that happens.
+    The row_version index stays, as the change feed keeps reading it, and
+    should the process die before the rebuild, the next start restores
+    the rest (migrations.restore_indexes).
+    """
+
+    def __init__(
+        self,
+        db: Database,
+        chunk_rows: int = IMPORT_CHUNK_ROWS,
+        rebuild_index_rows: int = IMPORT_REBUILD_INDEX_ROWS,
+    ):
+        self.db = db
+        self.chunk_rows = chunk_rows
+        self.rebuild_index_rows = rebuild_index_rows
+
+    async def run(self, upload: BinaryIO) -> ImportSummary:
+        summary = ImportSummary()
+        applications = dict(await self.db.fetchall('SELECT name, id FROM applications'))
+        size = upload.seek(0, io.SEEK_END)
+        upload.seek(0)
+        dropped = []
+        try:
+            reader = csv.reader(decoded_lines(upload))
+            read = row_reader(next(reader, []))
+            rows = ((reader.line_num, read(row)) for row in reader if row)
+            loop = asyncio.get_running_loop()
+            chunk = await loop.run_in_executor(None, self._read_chunk, rows)
+            first = True
+            while chunk:
+                parsing = loop.run_in_executor(None, self._read_chunk, rows)
+                try:
+                    await self.db.write(self._import_chunk, chunk, applications, summary)
+                finally:
+                    chunk = await parsing
+                if first and chunk and size and upload.tell():
+                    parsed = summary.imported + summary.failed + len(chunk)
+                    estimate = size * parsed // upload.tell()
+                    dropped = await self.db.write(self._drop_indexes, estimate)
+                first = False
+        finally:
+            if dropped:
+                await self.db.write(self._create_indexes, dropped)
+        return summary
+
+    def _drop_indexes(self, conn, estimate: int) -> List[Tuple[str, str]]:
+        if estimate < self.rebuild_index_rows:
+            return []
+        if estimate < conn.execute('SELECT COUNT(*) FROM servers').fetchone()[0]:
+            return []
+        indexes = [index for index in self._server_indexes(conn) if index[0] not in KEPT_INDEXES]
+        for name, _ in indexes:
+            conn.execute(f'DROP INDEX {name}')
+        return indexes
+
+    def _create_indexes(self, conn, indexes: List[Tuple[str, str]]):
+        # Another process starting meanwhile may have restored some
+        existing = {name for name, _ in self._server_indexes(conn)}
+        for name, sql in indexes:
+            if name not in existing:
+                conn.execute(sql)
+
+    def _server_indexes(self, conn) -> List[Tuple[str, str]]:
+        """(name, CREATE statement) of the secondary indexes on servers."""
+        if self.db.dialect == "postgres":
+            # Constraint indexes (the primary key) stay
+            indexes = conn.execute('''
+                SELECT i.relname, pg_get_indexdef(i.oid) FROM pg_index x JOIN pg_class i ON i.oid = x.indexrelid
+                WHERE x.indrelid = 'servers'::regclass AND NOT x.indisprimary AND NOT x.indisunique
+            ''').fetchall()
+        else:
+            indexes = conn.execute(
+                "SELECT name, sql FROM sqlite_master WHERE type = 'index' AND tbl_name = 'servers' AND sql IS NOT NULL"
+            ).fetchall()
+        return [tuple(index) for index in indexes]
+
+    def _read_chunk(self, rows: Iterator) -> list:
+        return list(itertools.islice(rows, self.chunk_rows))
+
+    def _import_chunk(self, conn, chunk: list, applications: Dict[str, int], summary: ImportSummary):
+        created = {}
+        values = []
+        for line, (name, server_type, team, host, port, shutdown_order, dependencies, contact, app_name) in chunk:
+            if not name:
+                summary.fail(line, name, "Missing server name")
+                continue
+            if server_type not in SERVER_TYPES:
+                summary.fail(line, name, f"Invalid server type: {server_type}")
+                continue
+            try:
+                # An empty port, as exported for servers without one, means the default
+                port = int(port) if port != '' else 80
+            except (TypeError, ValueError):
+                summary.fail(line, name, f"Invalid port: {port}")
+                continue
+            try:
+                shutdown_order = int(shutdown_order) if shutdown_order else None
+            except ValueError:
+                summary.fail(line, name, f"Invalid shutdown_order: {shutdown_order}")
+                continue
+
+            # Without an application column the name comes from the server
+            # name prefix
+            app_name = app_name or name.split('_')[0]
+            app_id = applications.get(app_name) or created.get(app_name)
+            if app_id is None:
+                app_id = conn.execute(
+                    'INSERT INTO applications (name, description) VALUES (?, ?) RETURNING id',
+                    (app_name, f"Application for {app_name} services")
+                ).fetchone()[0]
+                created[app_name] = app_id
+
+            values.append((
+                name, server_type, team, contact or None, host, port, app_id, shutdown_order, dependencies or None
+            ))
+
+        if values:
+            first = reserve_versions(conn, 'server', len(values))
+            rows = [row + (first + offset,) for offset, row in enumerate(values)]
+            if self.db.dialect == "sqlite":
+                last_id = conn.execute('SELECT COALESCE(MAX(id), 0) FROM servers').fetchone()[0]
+                # Types were checked above; SQLite's CHECK on the type list
+                # costs more per row than the rest of the insert
+                conn.execute('PRAGMA ignore_check_constraints = ON')
+                try:
+                    conn.executemany(INSERT_SERVER, rows)
+                finally:
+                    conn.execute('PRAGMA ignore_check_constraints = OFF')
+                # Reserved versions skip the search trigger too
+                index_servers_after(conn, last_id)
+            else:
+                conn.executemany(INSERT_SERVER, rows)
+        # Only remembered once the insert worked; a failed chunk rolls back
+        # the applications it created too
+        applications.update(created)
+        summary.imported += len(values)
+        summary.applications_created += len(created)
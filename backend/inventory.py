@@ -0,0 +1,330 @@
+import asyncio
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+from fastapi import HTTPException
+
+from config import INVENTORY_PAGE_CACHE_SIZE
+from db import Database
+from listing import APPLICATION_COLUMNS, SERVER_COLUMNS, decode_cursor, encode_cursor, encode_json
+from metrics import registry
+from sync import changes_since, current_version
+
+# Changes per sync up to which sort orders are patched in place rather
+# than rebuilt; each patch moves part of the list
+REORDER_LIMIT = 256
+
+INVENTORY_PAGES = registry.counter(
+    'dcmon_inventory_page_cache_total', 'Inventory list pages served from the page cache or built.',
+    ('kind', 'result'),
+)
+
+
+class Record:
+    __slots__ = ()
+
+    def update(self, row: dict):
+        for column, value in row.items():
+            setattr(self, column, value)
+
+
+class ServerRecord(Record):
+    __slots__ = SERVER_COLUMNS
+
+
+class ApplicationRecord(Record):
+    __slots__ = APPLICATION_COLUMNS
+
+
+def sort_key(sort: str) -> Callable[[Record], Any]:
+    """Key that orders records as build_list_query does: NULLs first, then id."""
+    if sort == 'id':
+        return lambda record: record.id
+
+    def key(record):
+        value = getattr(record, sort)
+        return (False, '', record.id) if value is None else (True, value, record.id)
+    return key
+
+
+# bisect's key= argument needs Python 3.10
+def bisect_left(records: List[Record], position, key: Callable[[Record], Any]) -> int:
+    low, high = 0, len(records)
+    while low < high:
+        middle = (low + high) // 2
+        if key(records[middle]) < position:
+            low = middle + 1
+        else:
+            high = middle
+    return low
+
+
+def bisect_right(records: List[Record], position, key: Callable[[Record], Any]) -> int:
+    low, high = 0, len(records)
+    while low < high:
+        middle = (low + high) // 2
+        if position < key(records[middle]):
+            high = middle
+        else:
+            low = middle + 1
+    return low
+
+
+def insort(records: List[Record], record: Record, key: Callable[[Record], Any]):
+    records.insert(bisect_right(records, key(record), key), record)
+
+
+class TableCache:
+    """One inventory table held in memory, kept current from the change feed.
+
+    Every write to the table, from any endpoint, the prober, the importer
+    or another process, bumps its row_version, so sync() only has to
+    compare versions and apply changes_since(). Readers that arrive while
+    a sync is running wait for the next one rather than each starting
+    their own, and are guaranteed to see every write committed before
+    they asked.
+
+    When this process is the only writer (``shared`` unset) the version
+    check itself is skipped while Database.commits has not moved.
+
+    Records are ``__slots__`` objects. Lists in each sort order and value
+    -> ids maps for the equality filters are built on first use and then
+    patched as rows change. Finished pages are kept as encoded JSON until
+    the next change, so a repeated request costs a dict lookup.
+    """
+
+    def __init__(
+        self,
+        db: Database,
+        kind: str,
+        record_type: type,
+        shared: bool = False,
+        page_cache_size: int = INVENTORY_PAGE_CACHE_SIZE,
+    ):
+        self.db = db
+        self.shared = shared
+        self.kind = kind
+        self.record_type = record_type
+        self.columns = list(record_type.__slots__)
+        self.page_cache_size = page_cache_size
+        self.records: Dict[int, Record] = {}
+        self.version = 0
+        # sort column -> records in ascending order
+        self._orders: Dict[str, List[Record]] = {}
+        self._keys: Dict[str, Callable[[Record], Any]] = {}
+        # filter column -> value -> ids
+        self._indexes: Dict[str, Dict[Any, Set[int]]] = {}
+        # (filters, prefix, sort) -> matching records in ascending order
+        self._views: Dict[tuple, List[Record]] = {}
+        self._pages: "OrderedDict[tuple, bytes]" = OrderedDict()
+        self._requested = 0
+        self._synced = -1
+        self._synced_commits = -1
+        self._task: Optional[asyncio.Task] = None
+
+    # Keeping current
+
+    async def sync(self) -> int:
+        """Apply every change committed before the call; returns the version."""
+        if not self.shared and self._task is None and self._synced_commits == self.db.commits:
+            return self.version
+        self._requested += 1
+        wanted = self._requested
+        while self._synced < wanted:
+            if self._task is None:
+                self._task = asyncio.create_task(self._run())
+            await asyncio.shield(self._task)
+        return self.version
+
+    async def _run(self):
+        try:
+            # Requests counted before the version is read are covered by it
+            covered = self._requested
+            commits = self.db.commits
+            items, deleted, version = await self.db.read(self._fetch, self.version)
+            self._apply(items, deleted, version)
+            self._synced = covered
+            self._synced_commits = commits
+        finally:
+            self._task = None
+
+    def _fetch(self, conn, since: int) -> Tuple[list, list, int]:
+        version = current_version(conn, self.kind)
+        items, deleted = [], []
+        while version > since:
+            changes = changes_since(conn, self.kind, self.columns, since, [], [], 5000)
+            items.extend(changes["items"])
+            deleted.extend(changes["deleted"])
+            since = changes["version"]
+            if not changes["more"]:
+                break
+        return items, deleted, max(version, since)
+
+    def _apply(self, items: List[dict], deleted: List[int], version: int):
+        if not items and not deleted:
+            self.version = version
+            return
+        if len(items) + len(deleted) > REORDER_LIMIT:
+            # Rebuilt on next use; one sort beats many list moves
+            self._orders.clear()
+        for row in items:
+            record = self.records.get(row['id'])
+            if record is None:
+                record = self.records[row['id']] = self.record_type()
+                record.update(row)
+                for column, index in self._indexes.items():
+                    index.setdefault(row[column], set()).add(record.id)
+                for sort, order in self._orders.items():
+                    insort(order, record, self._key(sort))
+                continue
+            changed = [column for column in self.columns if getattr(record, column) != row[column]]
+            # Taken out under the old key and put back under the new one
+            moved = [(sort, order) for sort, order in self._orders.items() if sort in changed]
+            for sort, order in moved:
+                del order[self._position(order, sort, record)]
+            for column in changed:
+                if column in self._indexes:
+                    self._unindex(column, getattr(record, column), record.id)
+                    self._index(column, row[column], record.id)
+            record.update(row)
+            for sort, order in moved:
+                insort(order, record, self._key(sort))
+        for row_id in deleted:
+            record = self.records.pop(row_id, None)
+            if record is not None:
+                for column in self._indexes:
+                    self._unindex(column, getattr(record, column), row_id)
+                for sort, order in self._orders.items():
+                    del order[self._position(order, sort, record)]
+        self._views.clear()
+        self._pages.clear()
+        self.version = version
+
+    def _key(self, sort: str) -> Callable[[Record], Any]:
+        key = self._keys.get(sort)
+        if key is None:
+            key = self._keys[sort] = sort_key(sort)
+        return key
+
+    def _position(self, order: List[Record], sort: str, record: Record) -> int:
+        key = self._key(sort)
+        return bisect_left(order, key(record), key)
+
+    def _index(self, column: str, value, row_id: int):
+        self._indexes[column].setdefault(value, set()).add(row_id)
+
+    def _unindex(self, column: str, value, row_id: int):
+        ids = self._indexes[column].get(value)
+        if ids is not None:
+            ids.discard(row_id)
+            if not ids:
+                del self._indexes[column][value]
+
+    # Reading
+
+    def index(self, column: str) -> Dict[Any, Set[int]]:
+        if column not in self._indexes:
+            self._indexes[column] = {}
+            for record in self.records.values():
+                self._index(column, getattr(record, column), record.id)
+        return self._indexes[column]
+
+    def order(self, sort: str) -> List[Record]:
+        records = self._orders.get(sort)
+        if records is None:
+            records = self._orders[sort] = sorted(self.records.values(), key=self._key(sort))
+        return records
+
+    def _view(self, filters: Tuple[Tuple[str, Any], ...], prefix: Optional[Tuple[str, str]], sort: str) -> List[Record]:
+        """Records matching the filters, in ascending sort order."""
+        if not filters and prefix is None:
+            return self.order(sort)
+        key = (filters, prefix, sort)
+        view = self._views.get(key)
+        if view is not None:
+            return view
+        candidates = None
+        for column, value in filters:
+            ids = self.index(column).get(value, ())
+            if candidates is None or len(ids) < len(candidates):
+                candidates = ids
+        if candidates is not None and len(candidates) * 8 < len(self.records):
+            # A selective filter: sort its matches rather than walk the table
+            source = sorted((self.records[row_id] for row_id in candidates), key=self._key(sort))
+        else:
+            source = self.order(sort)
+        view = [
+            record for record in source
+            if all(getattr(record, column) == value for column, value in filters)
+            and (prefix is None or (getattr(record, prefix[0]) or '').startswith(prefix[1]))
+        ]
+        self._views[key] = view
+        return view
+
+    def page(
+        self,
+        fields: List[str],
+        filters: Dict[str, Any],
+        sort: str,
+        order: str,
+        cursor: Optional[str],
+        limit: int,
+        prefix: Optional[Tuple[str, str]] = None,
+    ) -> bytes:
+        """One list page as encode_page() would produce it from the database."""
+        filter_items = tuple(sorted((column, value) for column, value in filters.items() if value is not None))
+        key = (tuple(fields), filter_items, prefix, sort, order, cursor, limit)
+        body = self._pages.get(key)
+        if body is not None:
+            self._pages.move_to_end(key)
+            INVENTORY_PAGES.inc(kind=self.kind, result="hit")
+            return body
+        INVENTORY_PAGES.inc(kind=self.kind, result="miss")
+
+        records = self._view(filter_items, prefix if prefix and prefix[1] else None, sort)
+        descending = order == 'desc'
+        start = len(records) - 1 if descending else 0
+        if cursor:
+            value, row_id = decode_cursor(cursor)
+            if sort == 'id':
+                position = row_id
+            elif value is None:
+                position = (False, '', row_id)
+            elif isinstance(value, str):
+                position = (True, value, row_id)
+            else:
+                raise HTTPException(status_code=400, detail="Invalid cursor")
+            keyed = self._key(sort)
+            if descending:
+                start = bisect_left(records, position, keyed) - 1
+            else:
+                start = bisect_right(records, position, keyed)
+        if descending:
+            selected = records[max(start - limit, 0):start + 1][::-1] if start >= 0 else []
+        else:
+            selected = records[start:start + limit + 1]
+        more = len(selected) > limit
+        selected = selected[:limit]
+
+        items = [{field: getattr(record, field) for field in fields} for record in selected]
+        next_cursor = None
+        if more and selected:
+            last = selected[-1]
+            next_cursor = encode_cursor(getattr(last, sort), last.id)
+        body = encode_json({"items": items, "next_cursor": next_cursor, "limit": limit})
+        self._pages[key] = body
+        if len(self._pages) > self.page_cache_size:
+            self._pages.popitem(last=False)
+        return body
+
+    def counts(self, column: str) -> Dict[Any, int]:
+        return {value: len(ids) for value, ids in self.index(column).items()}
+
+    def stats(self) -> dict:
+        return {
+            "records": len(self.records),
+            "version": self.version,
+            "orders": sorted(self._orders),
+            "views": len(self._views),
+            "pages": len(self._pages),
+        }
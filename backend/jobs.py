@@ -0,0 +1,253 @@
+import asyncio
+import itertools
+import json
+import time
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Hashable, List, Optional, Tuple
+
+from config import JOB_HISTORY, JOB_RESULTS_PAGE
+from events import BroadcastHub
+from task_store import TaskStore
+
+
+class Job:
+    """One long-running operation, run as a task of the API process.
+
+    ``work(job)`` performs it and reports along the way: ``add()`` appends
+    a result, ``advance()`` counts progress that has none. Results are kept
+    in order, so clients can page through them by offset or stream them
+    while the job runs. Whatever ``work`` returns becomes the summary; a
+    job whose work returns before accounting for all of ``total`` ends
+    'incomplete' rather than 'completed'.
+    """
+
+    def __init__(
+        self,
+        job_id: int,
+        kind: str,
+        total: int,
+        work: Callable[["Job"], Awaitable[Any]],
+        key: Optional[Hashable] = None,
+        hub: Optional[BroadcastHub] = None,
+    ):
+        self.id = job_id
+        self.kind = kind
+        self.key = key
+        self.total = total
+        self.work = work
+        self.hub = hub
+        self.state = 'pending'
+        self.done = 0
+        self.failed = 0
+        self.results: List[dict] = []
+        self.summary: Any = None
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.task: Optional[asyncio.Task] = None
+        self._changed = asyncio.Event()
+
+    @property
+    def active(self) -> bool:
+        return self.state in ('pending', 'running')
+
+    def add(self, item: dict, failed: bool = False):
+        self.results.append(item)
+        self.advance(1, int(failed))
+
+    def advance(self, count: int, failed: int = 0):
+        self.done += count
+        self.failed += failed
+        self._notify()
+
+    def _notify(self):
+        # Waiters hold the old event; the next change gets a fresh one
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def eta(self) -> Optional[float]:
+        if self.state != 'running' or not self.done:
+            return None
+        elapsed = time.time() - self.started_at
+        return round(elapsed / self.done * max(self.total - self.done, 0), 1)
+
+    def progress(self, offset: Optional[int] = None, limit: int = JOB_RESULTS_PAGE) -> dict:
+        """Job state; with ``offset``, also the results from there on, up to ``limit``."""
+        progress = {
+            "id": self.id,
+            "kind": self.kind,
+            "state": self.state,
+            "done": self.done,
+            "total": self.total,
+            "failed": self.failed,
+            "eta_s": self.eta(),
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "summary": self.summary,
+            "error": self.error,
+        }
+        if offset is not None:
+            results = self.results[offset:offset + limit]
+            progress["results"] = results
+            progress["next_offset"] = offset + len(results)
+        return progress
+
+    async def stream(self, offset: int = 0) -> AsyncIterator[str]:
+        """Results as NDJSON from ``offset``, following the job until it ends."""
+        while True:
+            changed = self._changed
+            if offset < len(self.results):
+                batch = self.results[offset:]
+                offset += len(batch)
+                yield ''.join(json.dumps(item, separators=(',', ':')) + '\n' for item in batch)
+                continue
+            if not self.active:
+                return
+            await changed.wait()
+
+    def start(self) -> asyncio.Task:
+        self.task = asyncio.create_task(self.run())
+        return self.task
+
+    def cancel(self):
+        if self.task is not None and not self.task.done():
+            self.task.cancel()
+
+    async def run(self):
+        self.state = 'running'
+        self.started_at = time.time()
+        try:
+            self.summary = await self.work(self)
+            if self.done < self.total:
+                # Work that ran out of time or targets reports what it left
+                self.state = 'incomplete'
+                self.error = f"{self.total - self.done} of {self.total} items were not processed"
+            else:
+                self.state = 'completed'
+        except asyncio.CancelledError:
+            self.state = 'cancelled'
+            raise
+        except Exception as e:
+            print(f"Error running {self.kind} job {self.id}: {e}")
+            self.state = 'failed'
+            self.error = str(e)
+        finally:
+            self.finished_at = time.time()
+            self._notify()
+            if self.hub is not None:
+                self.hub.publish("job", {"id": self.id, "kind": self.kind, "state": self.state})
+
+
+class JobManager:
+    """Jobs of every API process: the ones running here, and the rest through ``store``.
+
+    Jobs run in the process that accepted them and are registered in the
+    TaskStore, which hands out ids and shares their progress and results
+    with the other workers, so a client can poll or cancel a job through
+    any of them. Without a store (tests, tools) jobs are only seen locally.
+
+    A submission with the same kind and key as a job that is still
+    pending or running, in any process, gets that job back instead of
+    starting another, so repeated clicks or retrying clients share one
+    sweep. Finished jobs are kept, oldest dropped first, up to ``history``.
+    """
+
+    def __init__(
+        self,
+        hub: Optional[BroadcastHub] = None,
+        store: Optional[TaskStore] = None,
+        history: int = JOB_HISTORY,
+    ):
+        self.hub = hub
+        self.store = store
+        self.history = history
+        self.jobs: "OrderedDict[int, Job]" = OrderedDict()
+        self.coalesced = 0
+        self._ids = itertools.count(1)
+
+    async def submit(
+        self,
+        kind: str,
+        total: int,
+        work: Callable[[Job], Awaitable[Any]],
+        key: Optional[Hashable] = None,
+    ) -> Tuple[dict, bool]:
+        """Start a job, or join a matching active one; returns (progress, started)."""
+        if key is not None:
+            for job in self.jobs.values():
+                if job.active and job.kind == kind and job.key == key:
+                    self.coalesced += 1
+                    return job.progress(), False
+            if self.store is not None:
+                running = await self.store.find_active(kind, key)
+                if running is not None:
+                    self.coalesced += 1
+                    return running, False
+        job_id = next(self._ids) if self.store is None else await self.store.create(kind, key)
+        job = Job(job_id, kind, total, work, key, self.hub)
+        self.jobs[job.id] = job
+        if self.store is not None:
+            self.store.track(job)
+        job.start()
+        self._trim()
+        return job.progress(), True
+
+    def _trim(self):
+        finished = [job_id for job_id, job in self.jobs.items() if not job.active]
+        for job_id in finished[:max(len(finished) - self.history, 0)]:
+            del self.jobs[job_id]
+
+    def get(self, job_id: int) -> Optional[Job]:
+        """A job of this process."""
+        return self.jobs.get(job_id)
+
+    async def progress(self, job_id: int, offset: Optional[int] = None, limit: int = JOB_RESULTS_PAGE) -> Optional[dict]:
+        job = self.jobs.get(job_id)
+        if job is not None:
+            return job.progress(offset, limit)
+        if self.store is None:
+            return None
+        progress = await self.store.get(job_id)
+        if progress is not None and offset is not None:
+            results = await self.store.results(job_id, offset, limit)
+            progress["results"] = results
+            progress["next_offset"] = offset + len(results)
+        return progress
+
+    async def stream(self, job_id: int, offset: int = 0) -> Optional[AsyncIterator]:
+        """NDJSON results from ``offset`` as they arrive, or None for an unknown job."""
+        job = self.jobs.get(job_id)
+        if job is not None:
+            return job.stream(offset)
+        if self.store is None or await self.store.get(job_id) is None:
+            return None
+        return self.store.stream(job_id, offset)
+
+    async def cancel(self, job_id: int) -> bool:
+        job = self.jobs.get(job_id)
+        if job is not None:
+            job.cancel()
+            return True
+        # Cancelled by its own process on its next sync
+        return self.store is not None and await self.store.request_cancel(job_id)
+
+    async def list(self) -> List[dict]:
+        if self.store is None:
+            return [job.progress() for job in self.jobs.values()]
+        # Jobs running here are fresher than their last sync
+        return [
+            self.jobs[record["id"]].progress() if record["id"] in self.jobs else record
+            for record in await self.store.list()
+        ]
+
+    def cancel_all(self):
+        for job in self.jobs.values():
+            job.cancel()
+
+    async def stats(self) -> dict:
+        counts: Dict[str, int] = {}
+        for job in await self.list():
+            counts[job["state"]] = counts.get(job["state"], 0) + 1
+        return {"jobs": counts, "coalesced": self.coalesced}
@@ -0,0 +1,145 @@
+import asyncio
+import os
+import socket
+import time
+import uuid
+from typing import Awaitable, Callable, Dict, Optional
+
+from config import LEASE_RENEW_INTERVAL, LEASE_TTL
+from db import Database
+
+
+def create_lease_schema(cursor, dialect: str = "sqlite"):
+    # PostgreSQL's REAL is single precision, far too coarse for a timestamp
+    cursor.execute(f'''
+    CREATE TABLE IF NOT EXISTS leases (
+        name TEXT PRIMARY KEY,
+        holder TEXT NOT NULL,
+        expires_at {'DOUBLE PRECISION' if dialect == 'postgres' else 'REAL'} NOT NULL
+    )
+    ''')
+
+
+def holder_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+class Lease:
+    """A named lease in SQLite, held by one process until it expires.
+
+    Acquiring and renewing are the same statement: the row is taken over
+    only if it is ours already or has expired, so two processes can never
+    both come out holding it. The writer's BEGIN IMMEDIATE serializes
+    attempts across processes.
+    """
+
+    def __init__(self, db: Database, name: str, holder: str, ttl: float = LEASE_TTL):
+        self.db = db
+        self.name = name
+        self.holder = holder
+        self.ttl = ttl
+
+    def _acquire(self, conn, now: float) -> bool:
+        conn.execute('''
+            INSERT INTO leases (name, holder, expires_at) VALUES (?, ?, ?)
+            ON CONFLICT (name) DO UPDATE SET holder = excluded.holder, expires_at = excluded.expires_at
+            WHERE leases.holder = excluded.holder OR leases.expires_at < ?
+        ''', (self.name, self.holder, now + self.ttl, now))
+        row = conn.execute('SELECT holder FROM leases WHERE name = ?', (self.name,)).fetchone()
+        return row is not None and row[0] == self.holder
+
+    async def acquire(self) -> bool:
+        """Take or renew the lease; False when another live holder has it."""
+        return await self.db.write(self._acquire, time.time())
+
+    async def release(self):
+        await self.db.write(
+            lambda conn: conn.execute('DELETE FROM leases WHERE name = ? AND holder = ?', (self.name, self.holder))
+        )
+
+
+class ShardElection:
+    """Runs ``work(shard)`` for every shard whose lease this process holds.
+
+    Shard leases are named ``{name}:{index}``. At start a process claims a
+    single shard, so processes starting together spread out; once it has
+    been up for a full lease TTL it also picks up any shard nobody holds,
+    which is how the shards of a dead process are taken over. Leases are
+    renewed every ``renew_interval``; a shard whose renewal fails stops
+    its work straight away, since another process may already own it.
+    """
+
+    def __init__(
+        self,
+        db: Database,
+        name: str,
+        shards: int,
+        work: Callable[[int], Awaitable],
+        ttl: float = LEASE_TTL,
+        renew_interval: float = LEASE_RENEW_INTERVAL,
+        holder: Optional[str] = None,
+    ):
+        self.db = db
+        self.name = name
+        self.shards = max(1, shards)
+        self.work = work
+        self.ttl = ttl
+        self.renew_interval = renew_interval
+        self.holder = holder or holder_id()
+        self._leases = [Lease(db, f"{name}:{index}", self.holder, ttl) for index in range(self.shards)]
+        self._tasks: Dict[int, asyncio.Task] = {}
+        self.takeovers = 0
+
+    @property
+    def held(self):
+        return sorted(self._tasks)
+
+    def _stop(self, shard: int):
+        task = self._tasks.pop(shard, None)
+        if task is not None:
+            task.cancel()
+
+    async def _tick(self, started: float):
+        for shard in list(self._tasks):
+            try:
+                kept = await self._leases[shard].acquire()
+            except Exception as e:
+                print(f"Error renewing lease {self._leases[shard].name}: {e}")
+                kept = False
+            if not kept or self._tasks[shard].done():
+                self._stop(shard)
+        settled = time.monotonic() - started >= self.ttl
+        for shard, lease in enumerate(self._leases):
+            if shard in self._tasks:
+                continue
+            if self._tasks and not settled:
+                break
+            if await lease.acquire():
+                if settled:
+                    self.takeovers += 1
+                self._tasks[shard] = asyncio.create_task(self.work(shard))
+
+    async def run(self):
+        started = time.monotonic()
+        try:
+            while True:
+                try:
+                    await self._tick(started)
+                except Exception as e:
+                    print(f"Error in {self.name} election: {e}")
+                await asyncio.sleep(self.renew_interval)
+        finally:
+            for shard in list(self._tasks):
+                self._stop(shard)
+                try:
+                    await self._leases[shard].release()
+                except Exception as e:
+                    print(f"Error releasing lease {self._leases[shard].name}: {e}")
+
+    def stats(self) -> dict:
+        return {
+            "holder": self.holder,
+            "shards": self.shards,
+            "held": self.held,
+            "takeovers": self.takeovers,
+        }
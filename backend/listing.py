@@ -0,0 +1,164 @@
+import base64
+import json
+from typing import Any, List, Optional, Sequence, Tuple
+
+import orjson
+from fastapi import HTTPException
+
+SERVER_COLUMNS = (
+    'id', 'name', 'description', 'type', 'status', 'shutdown_status', 'test_response',
+    'owner_name', 'owner_contact', 'hostname', 'port', 'application_id', 'shutdown_order', 'dependencies',
+    'row_version',
+)
+SERVER_SORTS = ('id', 'name', 'hostname', 'status', 'type', 'owner_name')
+
+APPLICATION_COLUMNS = ('id', 'name', 'description', 'status', 'test_response', 'row_version')
+APPLICATION_SORTS = ('id', 'name', 'status')
+
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 1000
+
+
+def encode_cursor(sort_value: Any, row_id: int) -> str:
+    raw = json.dumps([sort_value, row_id], separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str) -> Tuple[Any, int]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        sort_value, row_id = json.loads(raw)
+        return sort_value, int(row_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def parse_fields(fields: Optional[str], columns: Sequence[str]) -> List[str]:
+    if not fields:
+        return list(columns)
+    selected = [f.strip() for f in fields.split(',') if f.strip()]
+    unknown = [f for f in selected if f not in columns]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+    return selected
+
+
+def prefix_range(prefix: str) -> Tuple[str, str]:
+    # "abc" -> ["abc", "abd"), a range the index on the column can serve
+    return prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+def keyset_clause(sort: str, descending: bool, cursor: Optional[str]) -> Tuple[str, list]:
+    """WHERE fragment that continues after the cursor row.
+
+    NULLs sort first (see build_list_query), so NULL sort values need
+    their own branches.
+    """
+    if not cursor:
+        return '', []
+    value, row_id = decode_cursor(cursor)
+    if sort == 'id':
+        return ('id < ?' if descending else 'id > ?'), [row_id]
+    op = '<' if descending else '>'
+    if value is None:
+        if descending:
+            return f'({sort} IS NULL AND id < ?)', [row_id]
+        return f'(({sort} IS NULL AND id > ?) OR {sort} IS NOT NULL)', [row_id]
+    clause = f'({sort} {op} ? OR ({sort} = ? AND id {op} ?)'
+    if descending:
+        clause += f' OR {sort} IS NULL'
+    return clause + ')', [value, value, row_id]
+
+
+def build_list_query(
+    table: str,
+    fields: List[str],
+    conditions: List[str],
+    params: list,
+    sort: str,
+    order: str,
+    cursor: Optional[str],
+    limit: int,
+) -> Tuple[str, list, List[str]]:
+    """SELECT for one page; returns (sql, params, selected columns).
+
+    The sort column and id are always selected so the next cursor can be
+    built, even when the caller projected them away. They come after the
+    requested fields, so a row's leading values are exactly the fields.
+    """
+    descending = order == 'desc'
+    clause, clause_params = keyset_clause(sort, descending, cursor)
+    if clause:
+        conditions = conditions + [clause]
+        params = params + clause_params
+    selected = list(dict.fromkeys(fields + ['id', sort]))
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+    direction = 'DESC' if descending else 'ASC'
+    # SQLite's default NULL placement, spelled out because PostgreSQL's
+    # default is the opposite
+    nulls = 'NULLS LAST' if descending else 'NULLS FIRST'
+    order_by = f'id {direction}' if sort == 'id' else f'{sort} {direction} {nulls}, id {direction}'
+    # One extra row tells us whether another page exists
+    sql = f"SELECT {', '.join(selected)} FROM {table} {where} ORDER BY {order_by} LIMIT ?"
+    return sql, params + [limit + 1], selected
+
+
+def encode_json(value) -> bytes:
+    # orjson writes UTF-8 directly, with the compact separators and
+    # non-ASCII handling of FastAPI's own JSON responses, many times faster
+    return orjson.dumps(value)
+
+
+def encode_page(rows: list, selected: List[str], fields: List[str], sort: str, limit: int) -> bytes:
+    """One list page, encoded, built from the cursor rows of build_list_query.
+
+    Each item is made by zipping the requested fields over the row's
+    leading values, so there is one dict per row and no other copy.
+    """
+    more = len(rows) > limit
+    rows = rows[:limit]
+    items = [dict(zip(fields, row)) for row in rows]
+    next_cursor = None
+    if more and rows:
+        last = rows[-1]
+        next_cursor = encode_cursor(last[selected.index(sort)], last[selected.index('id')])
+    return encode_json({"items": items, "next_cursor": next_cursor, "limit": limit})
+
+
+def server_filters(
+    status: Optional[str] = None,
+    type: Optional[str] = None,
+    application_id: Optional[int] = None,
+    owner_name: Optional[str] = None,
+    hostname_prefix: Optional[str] = None,
+) -> Tuple[List[str], list]:
+    conditions = []
+    params = []
+    if status is not None:
+        conditions.append('status = ?')
+        params.append(status)
+    if type is not None:
+        conditions.append('type = ?')
+        params.append(type)
+    if application_id is not None:
+        conditions.append('application_id = ?')
+        params.append(application_id)
+    if owner_name is not None:
+        conditions.append('owner_name = ?')
+        params.append(owner_name)
+    if hostname_prefix:
+        conditions.append('hostname >= ? AND hostname < ?')
+        params.extend(prefix_range(hostname_prefix))
+    return conditions, params
+
+
+def check_choice(value: str, choices: Sequence[str], name: str) -> str:
+    if value not in choices:
+        raise HTTPException(status_code=400, detail=f"Invalid {name}: {value}")
+    return value
+
+
+def check_limit(limit: int) -> int:
+    if limit < 1 or limit > MAX_LIMIT:
+        raise HTTPException(status_code=400, detail=f"limit must be between 1 and {MAX_LIMIT}")
+    return limit
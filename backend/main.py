@@ -1,21 +1,77 @@
-from fastapi import FastAPI, HTTPException, UploadFile, File, Request
+from fastapi import FastAPI, HTTPException, UploadFile, File, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-import sqlite3
-import json
+from fastapi.responses import ORJSONResponse, PlainTextResponse, StreamingResponse
 import csv
-import io
+import math
 import os
-import subprocess
-import requests
 import asyncio
+import signal
+import sys
+import time
+from contextlib import asynccontextmanager
 from typing import List, Optional, Dict
-from pydantic import BaseModel
 from datetime import datetime
-import aiosqlite
-import socket
-import aiohttp
 
-app = FastAPI()
+from config import BULK_UPDATE_INLINE_IDS, HISTORY_DB_PATH, JOB_SWEEP_DEADLINE, INVENTORY_CACHE, PROBE_LOOP_ENABLED, PROBE_SHARDS, ROLE, SHARED_STATE
+from db import Database, db
+from debounce import StatusDebouncer
+from events import ChangeRelay, hub
+from export import EXPORT_FORMATS, MEDIA_TYPES, export_servers
+from history import HistoryStore, servers_selector
+from lease import ShardElection
+from importer import CsvImporter
+from inventory import ApplicationRecord, ServerRecord, TableCache
+from jobs import Job, JobManager
+from metrics import RequestMetricsMiddleware, registry
+from listing import (
+    APPLICATION_COLUMNS,
+    APPLICATION_SORTS,
+    DEFAULT_LIMIT,
+    SERVER_COLUMNS,
+    SERVER_SORTS,
+    check_choice,
+    check_limit,
+    encode_json,
+    encode_page,
+    parse_fields,
+    server_filters,
+)
+from migrations import ensure_schema
+from models import (
+    Application,
+    ApplicationCreate,
+    ApplicationPage,
+    ProbeRequest,
+    ProbeResult,
+    SearchResults,
+    Server,
+    ServerCreate,
+    ServerPage,
+    ServerUpdate,
+)
+from orchestrator import DIRECTIONS, SERVER_FIELDS, DependencyCycle, DependencyGraph, Orchestration
+from probe_loop import ProbeLoop
+from probes import ProbeTarget, check_server_status, close_http_session, probe_scheduler
+from repository import ID_CHUNK, PROBE_COLUMNS, ApplicationRepository, ServerRepository
+from resolver import resolver
+from search import search_servers
+from rollup import ApplicationRollup
+from status_writer import StatusWriter
+from sync import current_version, make_etag
+from task_store import TaskStore
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Importing this module has no side effects; the database is checked
+    # and opened here, once the server is about to take requests
+    await start_api()
+    try:
+        yield
+    finally:
+        await stop_background()
+
+# Responses not built by hand below are still encoded with orjson
+app = FastAPI(default_response_class=ORJSONResponse, lifespan=lifespan)
 
 # Configure CORS
 app.add_middleware(
@@ -24,607 +80,798 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag"],
 )
+app.add_middleware(RequestMetricsMiddleware)
 
-DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "servers.db")
+app_rollup = ApplicationRollup(shared=SHARED_STATE)
+# With several processes the change relay publishes status events instead,
+# so clients of every process see every change exactly once
+status_writer = StatusWriter(db, app_rollup, hub=None if SHARED_STATE else hub)
+csv_importer = CsvImporter(db)
+servers_repo = ServerRepository(db.dialect)
+applications_repo = ApplicationRepository(db.dialect)
+# Other processes' writes are only seen by checking the version on every read
+server_cache = TableCache(db, 'server', ServerRecord, shared=SHARED_STATE)
+application_cache = TableCache(db, 'application', ApplicationRecord, shared=SHARED_STATE)
+# Probe history is SQLite-only; next to a PostgreSQL store it gets a local file
+history_db = db if db.dialect == "sqlite" else Database(HISTORY_DB_PATH)
+history_store = HistoryStore(history_db)
+debouncer = StatusDebouncer()
 
-# Database connection management
-def get_db():
-    db = sqlite3.connect(DB_PATH, timeout=30.0, isolation_level=None)
-    db.execute('PRAGMA journal_mode=WAL')
-    db.row_factory = sqlite3.Row
-    return db
+def record_result(target: ProbeTarget, result: dict, previous):
+    # Every probe result, scheduled or manual, passes through here. History
+    # keeps the raw result; the servers table only sees confirmed changes.
+    history_store.record(target.id, result)
+    stored = debouncer.apply(target.id, result, previous[0] if previous else None)
+    if stored is not None:
+        status_writer.record_server(target.id, stored["status"], stored["message"], previous, target.application_id)
+    return stored
 
-def init_db():
-    with get_db() as conn:
-        cursor = conn.cursor()
-        
-        # Create servers table
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS servers (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT NOT NULL,
-            description TEXT,
-            type TEXT NOT NULL CHECK(type IN ('WEB', 'HTTPS', 'DB_MYSQL', 'DB_POSTGRES', 'DB_MONGO', 'DB_REDIS', 'APP_TOMCAT', 'APP_NODEJS', 'APP_PYTHON', 'MAIL', 'FTP', 'SSH', 'DNS', 'MONITORING', 'CUSTOM')),
-            status TEXT DEFAULT 'Unknown',
-            shutdown_status TEXT DEFAULT 'Not Started',
-            test_response TEXT,
-            owner_name TEXT,
-            owner_contact TEXT,
-            hostname TEXT,
-            port INTEGER,
-            application_id INTEGER,
-            FOREIGN KEY (application_id) REFERENCES applications (id)
-        )
-        ''')
-
-        # Create applications table
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS applications (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT NOT NULL,
-            description TEXT,
-            status TEXT DEFAULT 'Unknown',
-            test_response TEXT
+def confirm_failure(target: ProbeTarget, result: dict, attempts: int) -> bool:
+    # Failures of servers stored as up are retried within the same run
+    return debouncer.should_retry(target.id, result, attempts)
+
+# Background probing; application rollups are updated by the status writer.
+# One probe loop runs per shard whose lease this process holds.
+probe_loops: Dict[int, ProbeLoop] = {}
+
+async def run_shard(shard: int):
+    probe_loop = probe_loops.get(shard)
+    if probe_loop is None:
+        probe_loop = probe_loops[shard] = ProbeLoop(
+            db, probe_scheduler, record_result, retry=confirm_failure,
+            shard=(shard, PROBE_SHARDS) if PROBE_SHARDS > 1 else None,
         )
-        ''')
+    await probe_loop.run()
 
-        # Add test_response column if it doesn't exist
-        cursor.execute("PRAGMA table_info(servers)")
-        columns = [column[1] for column in cursor.fetchall()]
-        if 'test_response' not in columns:
-            cursor.execute('ALTER TABLE servers ADD COLUMN test_response TEXT')
-        
-        conn.commit()
+prober = ShardElection(db, "prober", PROBE_SHARDS, run_shard)
+
+def active_probe_loops():
+    return [probe_loops[shard] for shard in prober.held if shard in probe_loops]
+
+def record_probe(target: ProbeTarget, result: dict, previous):
+    # Results from outside the probe loop still reschedule the server
+    stored = record_result(target, result, previous)
+    for probe_loop in probe_loops.values():
+        probe_loop.observe(target.id, stored)
+    return stored
+
+# Jobs and orchestrations started by this process; every worker sees all
+# of them through their stores
+orchestrations: Dict[int, Orchestration] = {}
+orchestration_store = TaskStore(db, 'orchestration')
+job_store = TaskStore(db, 'job')
+jobs = JobManager(hub, job_store)
+
+def schedule_depth():
+    stats = [probe_loop.stats() for probe_loop in active_probe_loops()]
+    return {(state,): sum(s[key] for s in stats) for state, key in (
+        ("scheduled", "targets"), ("heap", "heap_size"), ("in_flight", "in_flight"), ("overdue", "overdue"),
+    )}
+
+registry.gauge(
+    'dcmon_schedule_targets', 'Probe loop queue depth: scheduled targets, heap entries, in flight and overdue.',
+    schedule_depth, ('state',),
+)
+registry.gauge('dcmon_schedule_max_lag_seconds', 'Largest dispatch delay seen by the probe loop.', lambda: max((probe_loop.max_lag for probe_loop in active_probe_loops()), default=0.0))
+registry.gauge(
+    'dcmon_write_buffer_rows', 'Results waiting to be written, by buffer.',
+    lambda: {("status",): status_writer.pending, ("history",): history_store.pending}, ('buffer',),
+)
+registry.gauge('dcmon_prober_shards_held', 'Probe shards whose lease this process holds.', lambda: len(prober.held))
+registry.gauge(
+    'dcmon_status_pending_changes', 'Servers with a status change awaiting confirmation.',
+    lambda: debouncer.stats()["pending"],
+)
+registry.gauge(
+    'dcmon_inventory_records', 'Rows held by the in-memory inventory, by table.',
+    lambda: {("server",): len(server_cache.records), ("application",): len(application_cache.records)}, ('kind',),
+)
+registry.gauge('dcmon_event_subscribers', 'Connected event stream clients.', lambda: hub.stats()["subscribers"])
+registry.gauge(
+    'dcmon_orchestrations_running', 'Shutdown or startup orchestrations in progress.',
+    lambda: sum(1 for orchestration in orchestrations.values() if orchestration.state == "running"),
+)
+registry.gauge(
+    'dcmon_jobs_running', 'Background jobs (sweeps, bulk updates) in progress.',
+    lambda: sum(1 for job in jobs.jobs.values() if job.active),
+)
+
+async def fetch_probe_targets(server_id: Optional[int] = None, application_id: Optional[int] = None, assigned: bool = False):
+    rows = await db.read(servers_repo.select, PROBE_COLUMNS, server_id, application_id, assigned)
+    targets = []
+    previous = {}
+    for row in rows:
+        targets.append(ProbeTarget(row[0], row[1], row[2], row[3], row[4]))
+        previous[row[0]] = (row[5], row[6])
+    return targets, previous
 
-init_db()
+async def refresh_rollups():
+    # Servers were added, removed or moved between applications
+    app_rollup.invalidate()
+    await status_writer.flush()
 
-async def check_server_status(hostname: str, port: int, server_type: str) -> dict:
+async def probe_and_record(targets, previous, on_result=None, deadline: Optional[float] = None) -> dict:
+    # Results stream into the status writer as probes finish
+    def record(target, result):
+        record_probe(target, result, previous.get(target.id))
+        if on_result is not None:
+            on_result(target, result)
+
+    results = await probe_scheduler.run(targets, on_result=record, deadline=deadline, retry=confirm_failure)
+    await status_writer.flush()
+    return results
+
+background_tasks = []
+
+def start_background(probing: bool, relay: bool):
+    # Every process brings the schema up to date before serving; once it
+    # is, this costs one version read
+    ensure_schema(db)
+    db.open()
+    history_db.open()
+    background_tasks.append(asyncio.create_task(history_store.run()))
+    if probing:
+        background_tasks.append(asyncio.create_task(prober.run()))
+    if relay:
+        background_tasks.append(asyncio.create_task(ChangeRelay(db, hub).run()))
+
+async def stop_background():
+    for orchestration in orchestrations.values():
+        orchestration.cancel()
+    jobs.cancel_all()
+    for task in background_tasks:
+        task.cancel()
+    # Waited for so the prober gives its leases back before the db closes
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+    background_tasks.clear()
+    # Cancelled jobs and orchestrations leave their final state to the other workers
+    await asyncio.gather(
+        *(task.task for task in [*orchestrations.values(), *jobs.jobs.values()] if task.task is not None),
+        return_exceptions=True,
+    )
+    for store in (job_store, orchestration_store):
+        await store.sync()
+    await close_http_session()
+    await status_writer.flush()
+    await history_store.flush()
+    history_db.close()
+    db.close()
+
+async def start_api():
+    start_background(PROBE_LOOP_ENABLED and ROLE == "all", SHARED_STATE)
+    for store in (job_store, orchestration_store):
+        background_tasks.append(asyncio.create_task(store.run()))
+    if INVENTORY_CACHE:
+        # Load the inventory before the first request needs it
+        background_tasks.append(asyncio.create_task(server_cache.sync()))
+        background_tasks.append(asyncio.create_task(application_cache.sync()))
+
+async def run_prober():
+    """Dedicated prober process: probe loops and result writers, no HTTP server."""
+    # API processes write statuses too, so rollups are recounted from the table
+    app_rollup.shared = True
+    start_background(True, False)
+    stopped = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, stopped.set)
     try:
-        if not hostname or not port:
-            return {"status": "offline", "message": "Invalid hostname or port"}
+        await stopped.wait()
+    finally:
+        await stop_background()
 
-        # Try to resolve the hostname first
-        try:
-            socket.gethostbyname(hostname)
-        except socket.gaierror:
-            return {"status": "offline", "message": f"Could not resolve hostname: {hostname}"}
-
-        if server_type.lower() == "http":
-            try:
-                async with aiohttp.ClientSession() as session:
-                    async with session.get(f"http://{hostname}:{port}", timeout=5) as response:
-                        return {"status": "online", "message": f"HTTP server responded with status {response.status}"}
-            except Exception as e:
-                return {"status": "offline", "message": f"HTTP connection failed: {str(e)}"}
-        else:
-            # Default TCP check
-            try:
-                reader, writer = await asyncio.wait_for(
-                    asyncio.open_connection(hostname, port),
-                    timeout=5
-                )
-                writer.close()
-                await writer.wait_closed()
-                return {"status": "online", "message": f"TCP connection successful on port {port}"}
-            except asyncio.TimeoutError:
-                return {"status": "offline", "message": f"Connection timeout on port {port}"}
-            except Exception as e:
-                return {"status": "offline", "message": f"Connection failed: {str(e)}"}
-    except Exception as e:
-        return {"status": "offline", "message": f"Test failed: {str(e)}"}
+@app.get("/resolver/stats")
+async def get_resolver_stats():
+    return resolver.stats()
 
-async def update_all_statuses():
-    while True:
-        try:
-            conn = get_db()
-            cursor = conn.cursor()
-            
-            # Update servers
-            cursor.execute('SELECT id, hostname, port, type FROM servers')
-            servers = cursor.fetchall()
-            
-            for server in servers:
-                result = await check_server_status(server[1], server[2], server[3])
-                cursor.execute(
-                    'UPDATE servers SET status = ?, test_response = ? WHERE id = ?',
-                    (result["status"], result["message"], server[0])
-                )
-            
-            # Update applications
-            cursor.execute('''
-                SELECT a.id, GROUP_CONCAT(s.status) as server_statuses 
-                FROM applications a 
-                LEFT JOIN servers s ON s.application_id = a.id 
-                GROUP BY a.id
-            ''')
-            apps = cursor.fetchall()
-            
-            for app in apps:
-                if not app[1]:  # No servers
-                    status = "Unknown"
-                    message = "No servers associated"
-                else:
-                    statuses = app[1].split(',')
-                    if all(s == "online" for s in statuses):
-                        status = "online"
-                        message = "All servers online"
-                    elif all(s == "offline" for s in statuses):
-                        status = "offline"
-                        message = "All servers offline"
-                    else:
-                        status = "partial"
-                        online = sum(1 for s in statuses if s == "online")
-                        total = len(statuses)
-                        message = f"{online}/{total} servers online"
-                
-                cursor.execute(
-                    'UPDATE applications SET status = ?, test_response = ? WHERE id = ?',
-                    (status, message, app[0])
-                )
-            
-            conn.commit()
-        except Exception as e:
-            print(f"Error updating statuses: {e}")
-        finally:
-            if conn:
-                conn.close()
-            await asyncio.sleep(30)
+@app.get("/metrics")
+async def get_metrics():
+    # Prometheus text exposition format
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
 
-@app.on_event("startup")
-async def startup_event():
-    asyncio.create_task(update_all_statuses())
+@app.get("/schedule/stats")
+async def get_schedule_stats():
+    return {
+        "role": ROLE,
+        "election": prober.stats(),
+        "shards": {shard: probe_loop.stats() for shard, probe_loop in probe_loops.items() if shard in prober.held},
+    }
 
-class ServerValidation(BaseModel):
-    hostname: str
-    port: int
-    type: str
+@app.get("/debounce/stats")
+async def get_debounce_stats():
+    return debouncer.stats()
 
-@app.post("/servers/test")
-async def test_server(server: dict):
+@app.get("/events")
+async def stream_events():
+    # Status transitions and inventory changes as Server-Sent Events
+    return StreamingResponse(
+        hub.stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.get("/events/stats")
+async def get_event_stats():
+    return hub.stats()
+
+@app.post("/servers/test", response_model=ProbeResult, response_model_exclude_none=True)
+async def test_server(server: ProbeRequest):
     try:
-        result = await check_server_status(server.get("hostname"), server.get("port"), server.get("type", "tcp"))
+        result = await check_server_status(server.hostname, server.port, server.type)
         return result
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.post("/servers/{server_id}/test")
+@app.post("/servers/{server_id}/test", response_model=ProbeResult, response_model_exclude_none=True)
 async def test_server_endpoint(server_id: int):
-    try:
-        conn = get_db()
-        cursor = conn.cursor()
-        cursor.execute('SELECT hostname, port, type FROM servers WHERE id = ?', (server_id,))
-        server = cursor.fetchone()
-        
-        if not server:
-            raise HTTPException(status_code=404, detail="Server not found")
-        
-        result = await check_server_status(server[0], server[1], server[2])
-        
-        cursor.execute(
-            'UPDATE servers SET status = ?, test_response = ? WHERE id = ?',
-            (result["status"], result["message"], server_id)
-        )
-        conn.commit()
-        
-        return result
-    finally:
-        if conn:
-            conn.close()
+    targets, previous = await fetch_probe_targets(server_id=server_id)
+    
+    if not targets:
+        raise HTTPException(status_code=404, detail="Server not found")
+    
+    results = await probe_and_record(targets, previous)
+    if server_id not in results:
+        raise HTTPException(status_code=504, detail="Probe did not finish in time")
+    
+    return results[server_id]
+
+def probe_job(targets, previous, summarize):
+    """Job work for a sweep: results as they come, then summarize(results).
+
+    The sweep runs to JOB_SWEEP_DEADLINE, not the probe loop's deadline; a
+    client is following it. Servers it did not get to are listed in the
+    summary and leave the job incomplete.
+    """
+    async def work(job: Job):
+        def collect(target, result):
+            job.add({"id": target.id, "result": result}, failed=result["status"] == "offline")
+
+        results = await probe_and_record(targets, previous, collect, JOB_SWEEP_DEADLINE or math.inf)
+        summary = summarize(results)
+        not_probed = [target.id for target in targets if target.id not in results]
+        if not_probed:
+            summary["not_probed"] = not_probed
+        return summary
+    return work
+
+def job_accepted(response: Response, job: dict, started: bool) -> dict:
+    response.status_code = 202
+    response.headers["Location"] = f"/jobs/{job['id']}"
+    return {**job, "coalesced": not started}
 
 @app.post("/servers/test-all")
-async def test_all_servers():
-    try:
-        db = get_db()
-        cursor = db.cursor()
-        
-        cursor.execute("SELECT * FROM servers")
-        servers = cursor.fetchall()
-        
-        for server in servers:
-            try:
-                test_response = await check_server_status(server[1], server[2], server[3])
-                cursor.execute(
-                    "UPDATE servers SET status = ?, test_response = ? WHERE id = ?",
-                    (test_response["status"], json.dumps(test_response), server[0])
-                )
-                db.commit()
-            except Exception as e:
-                print(f"Error testing server {server['id']}: {str(e)}")
-                continue
-        
-        cursor.execute("SELECT * FROM applications")
-        applications = cursor.fetchall()
-        
-        for app in applications:
-            try:
-                cursor.execute("SELECT status FROM servers WHERE application_id = ?", (app["id"],))
-                server_statuses = [row[0] for row in cursor.fetchall()]
-                
-                app_status = "online" if server_statuses and all(status == "online" for status in server_statuses) else "offline"
-                
-                cursor.execute(
-                    "UPDATE applications SET status = ? WHERE id = ?",
-                    (app_status, app["id"])
-                )
-                db.commit()
-            except Exception as e:
-                print(f"Error updating application {app['id']}: {str(e)}")
-                continue
-        
-        return {"message": "All servers and applications tested successfully"}
-        
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        db.close()
+async def test_all_servers(response: Response):
+    targets, previous = await fetch_probe_targets()
+    
+    def summarize(results):
+        return {"message": f"Tested {len(results)}/{len(targets)} servers"}
+    
+    # A sweep over the same servers already running is joined, not repeated
+    job, started = await jobs.submit(
+        "servers-test-all", len(targets), probe_job(targets, previous, summarize),
+        key=frozenset(target.id for target in targets),
+    )
+    return job_accepted(response, job, started)
+
+async def not_modified(request: Request, response: Response, kind: str, version: Optional[int] = None) -> Optional[Response]:
+    """304 if the client's ETag still matches, otherwise set the ETag on response."""
+    if version is None:
+        version = await db.read(current_version, kind)
+    etag = make_etag(version, request.url.query)
+    if etag in [tag.strip() for tag in request.headers.get('if-none-match', '').split(',')]:
+        return Response(status_code=304, headers={"ETag": etag})
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = "no-cache"
+    return None
+
+def json_body(body: bytes, response: Optional[Response] = None) -> Response:
+    """Already encoded JSON, with any headers set on the injected response."""
+    headers = None
+    if response is not None:
+        headers = {name: response.headers[name] for name in ("ETag", "Cache-Control") if name in response.headers}
+    return Response(body, media_type="application/json", headers=headers)
+
+async def cached_list(request: Request, response: Response, cache: TableCache, *page_args, **page_kwargs) -> Response:
+    # The cache's version doubles as the ETag version, so one check covers both
+    cached = await not_modified(request, response, cache.kind, await cache.sync())
+    if cached:
+        return cached
+    return json_body(cache.page(*page_args, **page_kwargs), response)
+
+@app.get("/inventory/stats")
+async def get_inventory_stats():
+    return {"enabled": INVENTORY_CACHE, "servers": server_cache.stats(), "applications": application_cache.stats()}
 
 # Application endpoints
-@app.get("/applications")
-async def get_applications():
-    async with aiosqlite.connect(DB_PATH) as db:
-        db.row_factory = sqlite3.Row
-        cursor = await db.execute('SELECT * FROM applications')
-        rows = await cursor.fetchall()
-        return [dict(row) for row in rows]
-
-@app.post("/applications")
-async def create_application(app_data: dict):
-    conn = None
-    try:
-        conn = get_db()
-        cursor = conn.cursor()
-        cursor.execute('INSERT INTO applications (name, description) VALUES (?, ?)',
-                      (app_data["name"], app_data["description"]))
-        app_id = cursor.lastrowid
-        return {"id": app_id, **app_data}
-    finally:
-        if conn:
-            conn.close()
+@app.get("/applications", response_model=ApplicationPage)
+async def get_applications(
+    request: Request,
+    response: Response,
+    since: Optional[int] = None,
+    limit: int = DEFAULT_LIMIT,
+    cursor: Optional[str] = None,
+    sort: str = 'id',
+    order: str = 'asc',
+    fields: Optional[str] = None,
+    status: Optional[str] = None,
+):
+    check_limit(limit)
+    check_choice(sort, APPLICATION_SORTS, 'sort')
+    check_choice(order, ('asc', 'desc'), 'order')
+    selected_fields = parse_fields(fields, APPLICATION_COLUMNS)
+    if INVENTORY_CACHE and since is None:
+        return await cached_list(
+            request, response, application_cache, selected_fields, {'status': status}, sort, order, cursor, limit
+        )
+    conditions, params = ([], []) if status is None else (['status = ?'], [status])
+    
+    cached = await not_modified(request, response, 'application')
+    if cached:
+        return cached
+    if since is not None:
+        changes = await db.read(applications_repo.changes, selected_fields, since, conditions, params, limit)
+        return json_body(encode_json(changes), response)
+    
+    rows, selected = await db.read(
+        applications_repo.page, selected_fields, conditions, params, sort, order, cursor, limit
+    )
+    return json_body(encode_page(rows, selected, selected_fields, sort, limit), response)
+
+@app.post("/applications", response_model=Application)
+async def create_application(app_data: ApplicationCreate):
+    app_id = await db.write(applications_repo.insert, app_data.model_dump())
+    await refresh_rollups()
+    hub.publish("application", {"action": "created", "id": app_id})
+    return {"id": app_id, **app_data.model_dump()}
+
+@app.post("/applications/upsert")
+async def upsert_applications(rows: List[dict]):
+    summary = await upsert_rows(applications_repo, rows)
+    await refresh_rollups()
+    hub.publish("application", {"action": "changed"})
+    return summary
 
 @app.put("/applications/{app_id}")
-async def update_application(app_id: int, app_data: dict):
-    conn = None
+async def update_application(app_id: int, app_data: ApplicationCreate):
     try:
-        conn = get_db()
-        cursor = conn.cursor()
-        cursor.execute('''
-            UPDATE applications 
-            SET name = ?, description = ?
-            WHERE id = ?
-        ''', (app_data["name"], app_data["description"], app_id))
-        
-        if cursor.rowcount == 0:
-            raise HTTPException(status_code=404, detail="Application not found")
-        
-        conn.commit()
-        return {"status": "success"}
-    except sqlite3.Error as e:
-        if conn:
-            conn.rollback()
+        updated = await db.write(applications_repo.update, app_id, app_data.model_dump())
+    except db.Error as e:
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        if conn:
-            conn.close()
+    
+    if not updated:
+        raise HTTPException(status_code=404, detail="Application not found")
+    
+    hub.publish("application", {"action": "updated", "id": app_id})
+    return {"status": "success"}
 
 @app.delete("/applications/{app_id}")
 async def delete_application(app_id: int):
-    conn = None
-    try:
-        conn = get_db()
-        cursor = conn.cursor()
-        
-        # First update any servers that reference this application
-        cursor.execute('UPDATE servers SET application_id = NULL WHERE application_id = ?', (app_id,))
-        
-        # Then delete the application
-        cursor.execute('DELETE FROM applications WHERE id = ?', (app_id,))
-        
-        if cursor.rowcount == 0:
+    def delete(conn):
+        # Raising rolls back the detached servers too
+        if not applications_repo.delete(conn, app_id):
             raise HTTPException(status_code=404, detail="Application not found")
-        
-        conn.commit()
-        return {"status": "success", "message": "Application deleted successfully"}
-    except sqlite3.Error as e:
-        if conn:
-            conn.rollback()
+    
+    try:
+        await db.write(delete)
+    except db.Error as e:
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        if conn:
-            conn.close()
-
-@app.get("/servers")
-async def get_servers():
-    async with aiosqlite.connect(DB_PATH) as db:
-        db.row_factory = sqlite3.Row
-        cursor = await db.execute('SELECT * FROM servers')
-        rows = await cursor.fetchall()
-        return [dict(row) for row in rows]
-
-@app.post("/servers")
-async def create_server(server_data: dict):
-    conn = None
+    
+    await refresh_rollups()
+    hub.publish("application", {"action": "deleted", "id": app_id})
+    # Its servers were detached
+    hub.publish("servers", {"action": "updated"})
+    return {"status": "success", "message": "Application deleted successfully"}
+
+@app.get("/servers", response_model=ServerPage)
+async def get_servers(
+    request: Request,
+    response: Response,
+    since: Optional[int] = None,
+    limit: int = DEFAULT_LIMIT,
+    cursor: Optional[str] = None,
+    sort: str = 'id',
+    order: str = 'asc',
+    fields: Optional[str] = None,
+    status: Optional[str] = None,
+    type: Optional[str] = None,
+    application_id: Optional[int] = None,
+    owner_name: Optional[str] = None,
+    hostname_prefix: Optional[str] = None,
+):
+    check_limit(limit)
+    check_choice(sort, SERVER_SORTS, 'sort')
+    check_choice(order, ('asc', 'desc'), 'order')
+    selected_fields = parse_fields(fields, SERVER_COLUMNS)
+    if INVENTORY_CACHE and since is None:
+        filters = {'status': status, 'type': type, 'application_id': application_id, 'owner_name': owner_name}
+        return await cached_list(
+            request, response, server_cache, selected_fields, filters, sort, order, cursor, limit,
+            prefix=('hostname', hostname_prefix) if hostname_prefix else None,
+        )
+    conditions, params = server_filters(status, type, application_id, owner_name, hostname_prefix)
+    
+    cached = await not_modified(request, response, 'server')
+    if cached:
+        return cached
+    if since is not None:
+        # Delta sync: rows changed and ids deleted after the given version
+        changes = await db.read(servers_repo.changes, selected_fields, since, conditions, params, limit)
+        return json_body(encode_json(changes), response)
+    
+    rows, selected = await db.read(
+        servers_repo.page, selected_fields, conditions, params, sort, order, cursor, limit
+    )
+    return json_body(encode_page(rows, selected, selected_fields, sort, limit), response)
+
+@app.get("/search", response_model=SearchResults)
+async def search(q: str, limit: int = 20):
+    # Ranked substring search over name, hostname, owner and application
+    check_limit(limit)
+    items = await db.read(search_servers, q, limit, db.dialect)
+    return json_body(encode_json({"query": q, "items": items, "limit": limit}))
+
+@app.get("/servers/summary")
+async def get_servers_summary(request: Request, response: Response):
+    version = await server_cache.sync() if INVENTORY_CACHE else None
+    cached = await not_modified(request, response, 'server', version)
+    if cached:
+        return cached
+    if INVENTORY_CACHE:
+        by_status = server_cache.counts('status')
+    else:
+        by_status = await db.read(servers_repo.count_by, 'status')
+    return {"total": sum(by_status.values()), "by_status": by_status}
+
+@app.get("/servers/export")
+async def export_servers_file(
+    format: str = 'csv',
+    status: Optional[str] = None,
+    type: Optional[str] = None,
+    application_id: Optional[int] = None,
+    owner_name: Optional[str] = None,
+    hostname_prefix: Optional[str] = None,
+):
+    # Streamed from a database cursor; the CSV imports back through /servers/import-csv
+    check_choice(format, EXPORT_FORMATS, 'format')
+    conditions, params = server_filters(status, type, application_id, owner_name, hostname_prefix)
+    filename = f"servers-{datetime.now().strftime('%Y%m%d-%H%M%S')}.{format}"
+    return StreamingResponse(
+        export_servers(db, format, conditions, params),
+        media_type=MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+@app.post("/servers", response_model=Server)
+async def create_server(server_data: ServerCreate):
+    row = {**server_data.model_dump(), "status": "Pending", "shutdown_status": "Not Started"}
+    server_id = await db.write(servers_repo.insert, row)
+    await refresh_rollups()
+    hub.publish("server", {"action": "created", "id": server_id})
+    return {"id": server_id, **row}
+
+async def upsert_rows(repository, rows: List[dict]) -> dict:
+    # Rows with an id replace or create that row, rows without one are added
+    for index, row in enumerate(rows):
+        unknown = repository.check_fields(row, ('id',))
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Row {index}: unknown fields: {', '.join(unknown)}")
+        if row.get('id') is not None and not isinstance(row['id'], int):
+            raise HTTPException(status_code=400, detail=f"Row {index}: id must be an integer")
     try:
-        conn = get_db()
-        cursor = conn.cursor()
-        cursor.execute('''
-            INSERT INTO servers (name, type, status, shutdown_status, owner_name, owner_contact, hostname, port, application_id)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (
-            server_data["name"],
-            server_data["type"],
-            "Pending",
-            "Not Started",
-            server_data["owner_name"],
-            server_data["owner_contact"],
-            server_data.get("hostname", ""),
-            server_data.get("port", 80),
-            server_data.get("application_id")
-        ))
-        server_id = cursor.lastrowid
-        return {"id": server_id, **server_data}
-    finally:
-        if conn:
-            conn.close()
+        return await db.write(repository.upsert_many, rows)
+    except db.Error as e:
+        # Missing required columns on new rows, bad types and the like
+        raise HTTPException(status_code=400, detail=f"Upsert failed: {e}")
+
+@app.post("/servers/upsert")
+async def upsert_servers(rows: List[dict]):
+    summary = await upsert_rows(servers_repo, rows)
+    await refresh_rollups()
+    hub.publish("servers", {"action": "updated"})
+    return summary
+
+async def after_bulk_update(updates: dict):
+    if 'status' in updates or 'application_id' in updates:
+        await refresh_rollups()
+    hub.publish("servers", {"action": "updated"})
 
-@app.put("/servers/{server_id}")
-async def update_server(server_id: int, server_data: dict):
-    conn = None
+def bulk_update_job(server_ids: List[int], updates: dict):
+    async def work(job: Job):
+        # One transaction per chunk, so the writer is never held for long
+        # and progress shows as chunks commit
+        updated = 0
+        try:
+            for start in range(0, len(server_ids), ID_CHUNK):
+                chunk = server_ids[start:start + ID_CHUNK]
+                updated += await db.write(servers_repo.update_many, chunk, updates)
+                job.advance(len(chunk))
+        finally:
+            await after_bulk_update(updates)
+        return {"message": "Servers updated successfully", "updated": updated}
+    return work
+
+# Declared before PUT /servers/{server_id}, which would otherwise match it
+@app.put("/servers/bulk-update")
+async def bulk_update_servers(request: Request, response: Response):
+    data = await request.json()
+    server_ids = data.get('server_ids', [])
+    updates = data.get('updates', {})
+    
+    # Remove None values from updates
+    updates = {k: v for k, v in updates.items() if v is not None}
+    
+    if not server_ids or not updates:
+        raise HTTPException(status_code=400, detail="No servers or updates specified")
+    
+    if not all(isinstance(server_id, int) for server_id in server_ids):
+        raise HTTPException(status_code=400, detail="server_ids must be integers")
+    
+    unknown = servers_repo.check_fields(updates)
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+    
+    if len(server_ids) > BULK_UPDATE_INLINE_IDS:
+        job, started = await jobs.submit("servers-bulk-update", len(server_ids), bulk_update_job(server_ids, updates))
+        return job_accepted(response, job, started)
+    
     try:
-        conn = get_db()
-        cursor = conn.cursor()
-        
-        # Build update query dynamically based on provided fields
-        update_fields = []
-        params = []
-        for field in ['name', 'type', 'status', 'shutdown_status', 'owner_name', 
-                     'owner_contact', 'hostname', 'port', 'application_id']:
-            if field in server_data:
-                update_fields.append(f"{field} = ?")
-                params.append(server_data[field])
-        
-        if not update_fields:
-            raise HTTPException(status_code=400, detail="No fields to update")
-            
-        query = f'''UPDATE servers SET {", ".join(update_fields)} WHERE id = ?'''
-        params.append(server_id)
-        
-        cursor.execute(query, params)
-        conn.commit()
-        
-        if cursor.rowcount == 0:
+        updated = await db.write(servers_repo.update_many, server_ids, updates)
+    except db.Error as e:
+        raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
+    
+    await after_bulk_update(updates)
+    return {"message": "Servers updated successfully", "updated": updated}
+
+@app.put("/servers/{server_id}", response_model=Server)
+async def update_server(server_id: int, server_data: ServerUpdate):
+    # Only the columns provided are updated; an explicit null clears one
+    updates = server_data.model_dump(exclude_unset=True)
+    if not updates:
+        raise HTTPException(status_code=400, detail="No fields to update")
+    
+    def update(conn):
+        if not servers_repo.update(conn, server_id, updates):
             raise HTTPException(status_code=404, detail="Server not found")
-            
+        
         # Return updated server data
-        cursor.execute('SELECT * FROM servers WHERE id = ?', (server_id,))
-        columns = [col[0] for col in cursor.description]
-        server = dict(zip(columns, cursor.fetchone()))
-        return server
-    finally:
-        if conn:
-            conn.close()
+        return servers_repo.get(conn, server_id)
+    
+    server = await db.write(update)
+    
+    if 'status' in updates or 'application_id' in updates:
+        await refresh_rollups()
+    
+    hub.publish("server", {"action": "updated", "id": server_id})
+    return server
 
 @app.delete("/servers/{server_id}")
 async def delete_server(server_id: int):
-    conn = None
-    try:
-        conn = get_db()
-        cursor = conn.cursor()
-        
-        # First check if server exists
-        cursor.execute('SELECT id FROM servers WHERE id = ?', (server_id,))
-        if not cursor.fetchone():
+    def delete(conn):
+        if not servers_repo.delete(conn, server_id):
             raise HTTPException(status_code=404, detail="Server not found")
-            
-        # Delete the server
-        cursor.execute('DELETE FROM servers WHERE id = ?', (server_id,))
-        conn.commit()
-        
-        return {"message": "Server deleted successfully", "id": server_id}
-    except sqlite3.Error as e:
-        if conn:
-            conn.rollback()
+    
+    try:
+        await db.write(delete)
+    except HTTPException:
+        raise
+    except db.Error as e:
         raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
     except Exception as e:
-        if conn:
-            conn.rollback()
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        if conn:
-            conn.close()
+    
+    debouncer.forget(server_id)
+    await refresh_rollups()
+    hub.publish("server", {"action": "deleted", "id": server_id})
+    return {"message": "Server deleted successfully", "id": server_id}
 
 @app.post("/servers/import-csv")
 async def import_csv(file: UploadFile = File(...)):
-    content = await file.read()
-    csv_data = csv.DictReader(io.StringIO(content.decode()))
-    
-    response = {"success": [], "errors": []}
-    applications = {}
-    
-    with get_db() as conn:
-        cursor = conn.cursor()
-        
-        for row in csv_data:
-            try:
-                # Get or create application based on name
-                app_name = row.get('name', '').split('_')[0]  # Get application name from server name prefix
-                if app_name not in applications:
-                    # Check if application exists
-                    cursor.execute('SELECT id FROM applications WHERE name = ?', (app_name,))
-                    app_result = cursor.fetchone()
-                    
-                    if app_result:
-                        applications[app_name] = app_result[0]
-                    else:
-                        # Create new application
-                        cursor.execute(
-                            'INSERT INTO applications (name, description) VALUES (?, ?)',
-                            (app_name, f"Application for {app_name} services")
-                        )
-                        applications[app_name] = cursor.lastrowid
-                
-                # Insert server with application reference
-                port = int(row.get('port', 80))
-                server_data = {
-                    'name': row['name'],
-                    'type': row.get('type', 'CUSTOM'),
-                    'owner_name': row.get('team', 'Unknown'),
-                    'hostname': row.get('host', ''),
-                    'port': port,
-                    'application_id': applications[app_name]
-                }
-                
-                cursor.execute('''
-                    INSERT INTO servers (name, type, owner_name, hostname, port, application_id)
-                    VALUES (:name, :type, :owner_name, :hostname, :port, :application_id)
-                ''', server_data)
-                
-                response["success"].append({
-                    "name": row['name'],
-                    "message": "Server created successfully"
-                })
-                
-            except Exception as e:
-                response["errors"].append({
-                    "name": row.get('name', 'Unknown'),
-                    "error": str(e)
-                })
-        
-        conn.commit()
-    
-    return response
-
-@app.put("/servers/bulk-update")
-async def bulk_update_servers(request: Request):
     try:
-        data = await request.json()
-        server_ids = data.get('server_ids', [])
-        updates = data.get('updates', {})
-        
-        # Remove None values from updates
-        updates = {k: v for k, v in updates.items() if v is not None}
-        
-        if not server_ids or not updates:
-            raise HTTPException(status_code=400, detail="No servers or updates specified")
-        
-        # Update servers in database
-        async with aiosqlite.connect(DB_PATH) as db:
-            update_fields = ', '.join([f"{k} = ?" for k in updates.keys()])
-            update_values = list(updates.values())
-            
-            # Convert server_ids to string for SQL IN clause
-            servers_str = ','.join('?' * len(server_ids))
-            
-            query = f"""
-                UPDATE servers 
-                SET {update_fields}
-                WHERE id IN ({servers_str})
-            """
-            
-            # Combine update values with server IDs for the query
-            all_params = update_values + server_ids
-            await db.execute(query, all_params)
-            await db.commit()
-        
-        return {"message": "Servers updated successfully"}
-        
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        summary = await csv_importer.run(file.file)
+    except (csv.Error, UnicodeDecodeError) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid CSV: {e}")
+    except db.Error as e:
+        raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
+    finally:
+        # Earlier chunks are committed even when a later one fails
+        await refresh_rollups()
+        hub.publish("servers", {"action": "imported"})
+    
+    return summary.as_dict()
 
 @app.post("/applications/{app_id}/test")
 async def test_application(app_id: int):
     try:
-        db = get_db()
-        cursor = db.cursor()
-        
         # Get all servers for this application
-        cursor.execute('SELECT id, hostname, port, type FROM servers WHERE application_id = ?', (app_id,))
-        servers = cursor.fetchall()
+        targets, previous = await fetch_probe_targets(application_id=app_id)
         
-        if not servers:
+        if not targets:
             return {"status": "Unknown", "message": "No servers associated"}
         
-        results = []
-        for server in servers:
-            try:
-                test_response = await check_server_status(server[1], server[2], server[3])
-                cursor.execute(
-                    'UPDATE servers SET status = ?, test_response = ? WHERE id = ?',
-                    (test_response["status"], json.dumps(test_response), server[0])
-                )
-                db.commit()
-                results.append(test_response)
-            except Exception as e:
-                print(f"Error testing server {server['id']}: {str(e)}")
-                continue
+        tested = await probe_and_record(targets, previous)
+        results = [tested[target.id] for target in targets if target.id in tested]
         
-        # Calculate overall application status
-        if all(r["status"] == "online" for r in results):
-            status = "online"
-            message = "All servers online"
-        elif all(r["status"] == "offline" for r in results):
-            status = "offline"
-            message = "All servers offline"
-        else:
-            status = "partial"
-            online = sum(1 for r in results if r["status"] == "online")
-            message = f"{online}/{len(results)} servers online"
-        
-        cursor.execute(
-            'UPDATE applications SET status = ? WHERE id = ?',
-            (status, app_id)
-        )
-        db.commit()
+        # Overall status comes from the same rollup the background sweep uses
+        status, message = app_rollup.status_of(app_id)
         
         return {"status": status, "message": message, "server_results": results}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        db.close()
 
 @app.post("/applications/test-all")
-async def test_all_applications():
+async def test_all_applications(response: Response):
+    # Probe every server that belongs to an application in one sweep
+    targets, previous = await fetch_probe_targets(assigned=True)
+    
+    def summarize(results):
+        return {
+            "message": "All applications tested successfully",
+            "results": [
+                {"id": app_id, "result": {"status": status, "message": message}}
+                for app_id, (status, message) in app_rollup.snapshot().items()
+            ],
+        }
+    
+    job, started = await jobs.submit(
+        "applications-test-all", len(targets), probe_job(targets, previous, summarize),
+        key=frozenset(target.id for target in targets),
+    )
+    return job_accepted(response, job, started)
+
+# Background jobs
+@app.get("/jobs")
+async def list_jobs():
+    return await jobs.list()
+
+@app.get("/jobs/stats")
+async def get_job_stats():
+    return await jobs.stats()
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: int, offset: Optional[int] = None):
+    # With offset, results from there on; poll again from next_offset
+    if offset is not None and offset < 0:
+        raise HTTPException(status_code=400, detail="offset must not be negative")
+    progress = await jobs.progress(job_id, offset)
+    if progress is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return progress
+
+@app.get("/jobs/{job_id}/results")
+async def stream_job_results(job_id: int, offset: int = 0):
+    # Results as NDJSON, as they arrive, until the job ends
+    results = await jobs.stream(job_id, max(offset, 0))
+    if results is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return StreamingResponse(results, media_type="application/x-ndjson")
+
+@app.post("/jobs/{job_id}/cancel")
+async def cancel_job(job_id: int):
+    if not await jobs.cancel(job_id):
+        raise HTTPException(status_code=404, detail="Job not found")
+    return {"id": job_id, "message": "Cancellation requested"}
+
+# Probe history
+@app.get("/history/servers/{server_id}")
+async def get_server_history(server_id: int, start: Optional[float] = None, end: Optional[float] = None):
+    if not await db.read(servers_repo.exists, server_id):
+        raise HTTPException(status_code=404, detail="Server not found")
+    summary = await history_store.query('server_id = ?', (server_id,), start, end)
+    return {"server_id": server_id, **summary}
+
+@app.get("/history/applications/{app_id}")
+async def get_application_history(app_id: int, start: Optional[float] = None, end: Optional[float] = None):
+    if not await db.read(applications_repo.exists, app_id):
+        raise HTTPException(status_code=404, detail="Application not found")
+    if history_db is db:
+        selector, params = 'server_id IN (SELECT id FROM servers WHERE application_id = ?)', (app_id,)
+    else:
+        # History lives in its own SQLite file, apart from the inventory
+        selector, params = servers_selector(await db.read(applications_repo.server_ids, app_id))
+    summary = await history_store.query(selector, params, start, end)
+    return {"application_id": app_id, **summary}
+
+# Shutdown / startup orchestration
+@app.post("/orchestrations")
+async def start_orchestration(request: dict, response: Response):
+    direction = check_choice(request.get("direction", "shutdown"), DIRECTIONS, 'direction')
+    rows = [
+        dict(row) for row in
+        await db.read(servers_repo.select, SERVER_FIELDS, None, request.get("application_id"))
+    ]
+    if request.get("server_ids"):
+        wanted = set(request["server_ids"])
+        rows = [row for row in rows if row['id'] in wanted]
+    
     try:
-        db = get_db()
-        cursor = db.cursor()
-        
-        cursor.execute("SELECT * FROM applications")
-        applications = cursor.fetchall()
-        
-        for app in applications:
-            try:
-                cursor.execute("SELECT * FROM servers WHERE application_id = ?", (app["id"],))
-                servers = cursor.fetchall()
-                
-                for server in servers:
-                    test_response = await check_server_status(server[1], server[2], server[3])
-                    cursor.execute(
-                        'UPDATE servers SET status = ?, test_response = ? WHERE id = ?',
-                        (test_response["status"], json.dumps(test_response), server[0])
-                    )
-                    db.commit()
-                
-                cursor.execute("SELECT status FROM servers WHERE application_id = ?", (app["id"],))
-                server_statuses = [row[0] for row in cursor.fetchall()]
-                
-                app_status = "online" if server_statuses and all(status == "online" for status in server_statuses) else "offline"
-                
-                cursor.execute(
-                    "UPDATE applications SET status = ? WHERE id = ?",
-                    (app_status, app["id"])
-                )
-                db.commit()
-                
-            except Exception as e:
-                print(f"Error testing application {app['id']}: {str(e)}")
-                continue
-        
-        return {"message": "All applications tested successfully"}
-        
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        orchestration = Orchestration(DependencyGraph(rows, direction), db, probe_scheduler, record_probe, hub)
+    except DependencyCycle as e:
+        raise HTTPException(status_code=409, detail={"message": str(e), "cycle": e.cycle})
+    
+    if request.get("dry_run"):
+        return orchestration.plan()
+    
+    # One at a time across all workers
+    if (
+        any(o.state in ('pending', 'running') for o in orchestrations.values())
+        or await orchestration_store.find_active() is not None
+    ):
+        raise HTTPException(status_code=409, detail="An orchestration is already running")
+    
+    orchestration.id = await orchestration_store.create(direction)
+    orchestrations[orchestration.id] = orchestration
+    orchestration_store.track(orchestration)
+    orchestration.start()
+    response.status_code = 202
+    return {**orchestration.progress(), "plan": orchestration.plan()}
+
+@app.get("/orchestrations")
+async def list_orchestrations():
+    # Runs of this process are fresher than their last sync
+    return [
+        orchestrations[record["id"]].progress() if record["id"] in orchestrations else record
+        for record in await orchestration_store.list()
+    ]
+
+@app.get("/orchestrations/{orchestration_id}")
+async def get_orchestration(orchestration_id: int):
+    orchestration = orchestrations.get(orchestration_id)
+    if orchestration is not None:
+        return orchestration.progress()
+    progress = await orchestration_store.get(orchestration_id)
+    if progress is None:
+        raise HTTPException(status_code=404, detail="Orchestration not found")
+    return progress
+
+@app.post("/orchestrations/{orchestration_id}/cancel")
+async def cancel_orchestration(orchestration_id: int):
+    orchestration = orchestrations.get(orchestration_id)
+    if orchestration is not None:
+        orchestration.cancel()
+    elif not await orchestration_store.request_cancel(orchestration_id):
+        raise HTTPException(status_code=404, detail="Orchestration not found")
+    return {"id": orchestration_id, "message": "Cancellation requested"}
+
+def supervise(args):
+    """Production mode: API workers plus optional dedicated probers, as child processes.
+
+    Role and shared-state flags reach the children through their
+    environment, since config is read at import. A child that dies is
+    started again; the shards it held are picked up by the other probers
+    once its leases expire, or by its replacement.
+    """
+    import subprocess
+
+    backend_dir = os.path.dirname(os.path.abspath(__file__))
+    api_role = "api" if args.probers or args.role == "api" else "all"
+    env = dict(os.environ, DCMON_SHARED_STATE="1")
+    commands = [(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", args.host, "--port", str(args.port),
+         "--workers", str(args.workers)],
+        dict(env, DCMON_ROLE=api_role),
+    )]
+    commands += [
+        ([sys.executable, os.path.abspath(__file__), "--role", "prober"], dict(env, DCMON_ROLE="prober"))
+    ] * args.probers
+    processes = [subprocess.Popen(command, cwd=backend_dir, env=child_env) for command, child_env in commands]
+    try:
+        while True:
+            time.sleep(1)
+            for index, process in enumerate(processes):
+                if process.poll() is not None:
+                    command, child_env = commands[index]
+                    print(f"{' '.join(command[1:])} exited with {process.returncode}, restarting")
+                    processes[index] = subprocess.Popen(command, cwd=backend_dir, env=child_env)
+    except KeyboardInterrupt:
+        pass
     finally:
-        db.close()
+        for process in processes:
+            if process.poll() is None:
+                process.terminate()
+        for process in processes:
+            process.wait()
 
 if __name__ == "__main__":
     import uvicorn
@@ -632,6 +879,28 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--host", default="0.0.0.0", help="Host to bind to")
     parser.add_argument("--port", type=int, default=3000, help="Port to bind to")
+    parser.add_argument("--workers", type=int, default=1, help="API worker processes")
+    parser.add_argument(
+        "--role", choices=("all", "api", "prober"), default=ROLE,
+        help="all: API plus the elected prober; api: API only; prober: probe loop only, no HTTP server",
+    )
+    parser.add_argument("--reload", action="store_true", help="Development: restart on code changes")
+    parser.add_argument(
+        "--probers", type=int, default=0,
+        help="Dedicated prober processes to start; API workers then never probe. "
+             "Set DCMON_PROBE_SHARDS to split servers between them",
+    )
     args = parser.parse_args()
     
-    uvicorn.run("main:app", host=args.host, port=args.port, reload=True)
+    if args.role == "prober":
+        asyncio.run(run_prober())
+    elif args.workers > 1 or args.probers or args.role == "api":
+        supervise(args)
+    elif args.reload:
+        # The reloader watches files from a parent process and imports the
+        # app afresh in a child
+        uvicorn.run("main:app", host=args.host, port=args.port, reload=True)
+    else:
+        # This module is already imported as __main__; passing the app
+        # object spares uvicorn importing it again as main
+        uvicorn.run(app, host=args.host, port=args.port)
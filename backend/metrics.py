@@ -0,0 +1,206 @@
+import bisect
+import threading
+import time
+from typing import Callable, Dict, Optional, Sequence, Tuple
+
+# Seconds; wide enough for sub-millisecond DB calls and multi-second probes
+DEFAULT_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0,
+)
+
+
+def _format_labels(names: Sequence[str], values: Sequence, extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    type = 'untyped'
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        # Observed from the event loop and from database threads
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> Tuple:
+        return tuple(labels.get(name, '') for name in self.labels)
+
+    def samples(self):
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.type}']
+        for suffix, names, values, extra, value in self.samples():
+            lines.append(f'{self.name}{suffix}{_format_labels(names, values, extra)} {_format_value(value)}')
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        super().__init__(name, help, labels)
+        self._values: Dict[Tuple, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = list(self._values.items())
+        for key, value in values:
+            yield '', self.labels, key, '', value
+
+
+class Gauge(Metric):
+    """A gauge read from a callback at scrape time.
+
+    The callback returns a number, or for labelled gauges a dict of label
+    value tuples to numbers.
+    """
+
+    type = 'gauge'
+
+    def __init__(self, name: str, help: str, callback: Callable, labels: Sequence[str] = ()):
+        super().__init__(name, help, labels)
+        self.callback = callback
+
+    def samples(self):
+        value = self.callback()
+        if isinstance(value, dict):
+            for key, number in value.items():
+                yield '', self.labels, key if isinstance(key, tuple) else (key,), '', number
+        elif value is not None:
+            yield '', (), (), '', value
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+        # key -> [per-bucket counts (+Inf last), sum]
+        self._values: Dict[Tuple, list] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    def time(self, **labels):
+        return _Timer(self, labels)
+
+    def samples(self):
+        with self._lock:
+            values = [(key, list(counts), total) for key, (counts, total) in self._values.items()]
+        for key, counts, total in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                yield '_bucket', self.labels, key, f'le="{_format_value(bound)}"', cumulative
+            yield '_sum', self.labels, key, '', total
+            yield '_count', self.labels, key, '', cumulative
+
+
+class _Timer:
+    def __init__(self, histogram: Histogram, labels: dict):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.started, **self.labels)
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labels: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, help, labels))
+
+    def histogram(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help, labels, buckets))
+
+    def gauge(self, name: str, help: str, callback: Callable, labels: Sequence[str] = ()) -> Gauge:
+        return self.register(Gauge(name, help, callback, labels))
+
+    def render(self) -> str:
+        parts = []
+        for metric in self._metrics.values():
+            try:
+                parts.append(metric.render())
+            except Exception as e:
+                print(f"Error rendering metric {metric.name}: {e}")
+        return '\n'.join(parts) + '\n'
+
+
+registry = Registry()
+
+REQUEST_SECONDS = registry.histogram(
+    'dcmon_http_request_duration_seconds',
+    'API request latency until the response starts, by route template.',
+    ('method', 'route', 'status'),
+)
+
+
+class RequestMetricsMiddleware:
+    """Times every HTTP request at the ASGI level.
+
+    The route label is the matched path template, so /servers/1 and
+    /servers/2 share one series; unmatched paths are grouped together.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        started = time.perf_counter()
+        observed = False
+
+        async def send_wrapper(message):
+            nonlocal observed
+            if message['type'] == 'http.response.start' and not observed:
+                observed = True
+                route = scope.get('route')
+                REQUEST_SECONDS.observe(
+                    time.perf_counter() - started,
+                    method=scope['method'],
+                    route=getattr(route, 'path', 'unmatched'),
+                    status=message['status'],
+                )
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
@@ -0,0 +1,246 @@
+import time
+from typing import Callable, Dict, Optional, Tuple
+
+from db import Database
+from lease import create_lease_schema
+from search import create_prefix_indexes, create_search_indexes, create_search_schema
+from sync import VERSIONED_TABLES, create_sync_schema, create_sync_schema_postgres, version_existing_rows
+from task_store import create_task_schema
+
+SERVER_TYPES_SQL = (
+    "'WEB', 'HTTPS', 'DB_MYSQL', 'DB_POSTGRES', 'DB_MONGO', 'DB_REDIS', 'APP_TOMCAT', 'APP_NODEJS', "
+    "'APP_PYTHON', 'MAIL', 'FTP', 'SSH', 'DNS', 'MONITORING', 'CUSTOM'"
+)
+
+# Serializes migrating processes on PostgreSQL; any constant will do as
+# long as nothing else in the database uses it
+ADVISORY_LOCK_ID = 7305218
+
+
+class SchemaTooNew(RuntimeError):
+    """The database was migrated by a newer release than this one."""
+
+
+def _id_column(dialect: str) -> str:
+    if dialect == "postgres":
+        return 'id INTEGER GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY'
+    return 'id INTEGER PRIMARY KEY AUTOINCREMENT'
+
+
+def _create_inventory(conn, dialect: str):
+    # applications first: PostgreSQL checks the foreign key's target exists
+    conn.execute(f'''
+    CREATE TABLE applications (
+        {_id_column(dialect)},
+        name TEXT NOT NULL,
+        description TEXT,
+        status TEXT DEFAULT 'Unknown',
+        test_response TEXT
+    )
+    ''')
+    conn.execute(f'''
+    CREATE TABLE servers (
+        {_id_column(dialect)},
+        name TEXT NOT NULL,
+        description TEXT,
+        type TEXT NOT NULL CHECK(type IN ({SERVER_TYPES_SQL})),
+        status TEXT DEFAULT 'Unknown',
+        shutdown_status TEXT DEFAULT 'Not Started',
+        test_response TEXT,
+        owner_name TEXT,
+        owner_contact TEXT,
+        hostname TEXT,
+        port INTEGER,
+        application_id INTEGER,
+        FOREIGN KEY (application_id) REFERENCES applications (id)
+    )
+    ''')
+
+
+def _add_shutdown_columns(conn, dialect: str):
+    # Inputs to shutdown orchestration
+    conn.execute('ALTER TABLE servers ADD COLUMN shutdown_order INTEGER')
+    conn.execute('ALTER TABLE servers ADD COLUMN dependencies TEXT')
+
+
+def _create_list_indexes(conn, dialect: str):
+    # Indexes behind the list filters and keyset sort orders. Listings put
+    # NULLs first; PostgreSQL only walks an index in that order (or its
+    # reverse) when the index was built so.
+    nulls = ' NULLS FIRST' if dialect == "postgres" else ''
+    for column in ('application_id', 'status', 'type', 'owner_name', 'hostname', 'name'):
+        conn.execute(f'CREATE INDEX IF NOT EXISTS idx_servers_{column} ON servers ({column}{nulls})')
+    conn.execute(f'CREATE INDEX IF NOT EXISTS idx_applications_name ON applications (name{nulls})')
+    conn.execute(f'CREATE INDEX IF NOT EXISTS idx_applications_status ON applications (status{nulls})')
+
+
+def _create_sync(conn, dialect: str):
+    if dialect == "postgres":
+        create_sync_schema_postgres(conn)
+    else:
+        create_sync_schema(conn)
+
+
+def _version_existing_rows(conn, dialect: str):
+    # Databases upgraded by 4 before it numbered their existing rows
+    for kind in VERSIONED_TABLES:
+        version_existing_rows(conn, kind)
+
+
+def _create_leases(conn, dialect: str):
+    create_lease_schema(conn, dialect)
+
+
+def _create_search(conn, dialect: str):
+    create_search_schema(conn, dialect)
+
+
+def _create_prefix_indexes(conn, dialect: str):
+    create_prefix_indexes(conn)
+
+
+# Append only: a released migration is never edited, a change to it is a
+# new entry. Each runs once per database, inside the migrating transaction.
+MIGRATIONS: Tuple[Tuple[int, str, Callable], ...] = (
+    (1, "servers and applications", _create_inventory),
+    (2, "shutdown order and dependencies", _add_shutdown_columns),
+    (3, "list filter and sort indexes", _create_list_indexes),
+    (4, "row versions and deletion tombstones", _create_sync),
+    (5, "leases", _create_leases),
+    (6, "server search index", _create_search),
+    (7, "versions for rows left at version 0", _version_existing_rows),
+    (8, "shared job and orchestration state", create_task_schema),
+    (9, "case-insensitive search prefix indexes", _create_prefix_indexes),
+)
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def _sqlite_columns(conn, table: str) -> set:
+    return {row[1] for row in conn.execute(f'PRAGMA table_info({table})')}
+
+
+def _legacy_version(conn) -> int:
+    """How far a SQLite database from before schema versioning had got.
+
+    Those databases were brought up to date by checks on every start, so
+    what they hold shows which migrations they already have.
+    """
+    tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    if 'servers' not in tables:
+        return 0
+    columns = _sqlite_columns(conn, 'servers')
+    if 'test_response' not in columns:
+        # The oldest layout predates the column
+        conn.execute('ALTER TABLE servers ADD COLUMN test_response TEXT')
+    if 'shutdown_order' not in columns:
+        return 1
+    if 'row_version' not in columns:
+        # Indexes are created with IF NOT EXISTS, so 3 can run again safely
+        return 2
+    return 5 if 'leases' in tables else 4
+
+
+def _lock(conn, dialect: str):
+    if dialect == "postgres":
+        conn.execute('BEGIN')
+        conn.execute('SELECT pg_advisory_xact_lock(?)', (ADVISORY_LOCK_ID,))
+    else:
+        conn.execute('BEGIN IMMEDIATE')
+
+
+def migrate(db: Database) -> Dict[str, int]:
+    """Bring the database schema up to LATEST_VERSION.
+
+    Every process runs this at start. All pending migrations apply in one
+    transaction, under a lock that makes concurrent starters wait, so the
+    schema moves from one recorded version to the next or not at all.
+    """
+    conn = db.connect()
+    try:
+        _lock(conn, db.dialect)
+        try:
+            conn.execute(f'''
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version INTEGER PRIMARY KEY,
+                description TEXT NOT NULL,
+                applied_at {'DOUBLE PRECISION' if db.dialect == 'postgres' else 'REAL'} NOT NULL
+            )
+            ''')
+            recorded = conn.execute('SELECT MAX(version) FROM schema_version').fetchone()[0]
+            start = recorded
+            if recorded is None:
+                recorded = 0
+                start = _legacy_version(conn) if db.dialect == "sqlite" else 0
+            if start > LATEST_VERSION:
+                raise SchemaTooNew(
+                    f"Database schema is at version {start}, this release knows up to {LATEST_VERSION}"
+                )
+            for version, description, apply in MIGRATIONS:
+                if version <= recorded:
+                    continue
+                # What an adopted legacy database already had is recorded, not applied
+                if version > start:
+                    apply(conn, db.dialect)
+                conn.execute(
+                    'INSERT INTO schema_version (version, description, applied_at) VALUES (?, ?, ?)',
+                    (version, description, time.time())
+                )
+        except BaseException:
+            conn.rollback()
+            raise
+        conn.execute('COMMIT')
+    finally:
+        conn.close()
+    return {"from": start, "to": LATEST_VERSION}
+
+
+def stored_version(db: Database) -> Optional[int]:
+    """The schema version recorded in the database; None before the first migrate()."""
+    conn = db.connect()
+    try:
+        return conn.execute('SELECT MAX(version) FROM schema_version').fetchone()[0]
+    except db.Error:
+        # No schema_version table: a new or a legacy database
+        return None
+    finally:
+        conn.close()
+
+
+def restore_indexes(db: Database):
+    """Create any of the secondary indexes that are missing.
+
+    CsvImporter drops them for a large import and rebuilds them at the
+    end; a process that dies in between leaves the tables without them.
+    Every index here is created IF NOT EXISTS, so when none is missing
+    this only takes and releases the migration lock.
+    """
+    conn = db.connect()
+    try:
+        _lock(conn, db.dialect)
+        try:
+            _create_list_indexes(conn, db.dialect)
+            create_prefix_indexes(conn)
+            if db.dialect == "postgres" and conn.execute(
+                "SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'"
+            ).fetchone():
+                create_search_indexes(conn)
+        except BaseException:
+            conn.rollback()
+            raise
+        conn.execute('COMMIT')
+    finally:
+        conn.close()
+
+
+def ensure_schema(db: Database) -> Optional[Dict[str, int]]:
+    """migrate() unless the database already records LATEST_VERSION.
+
+    Every start after the first one on a release finds the schema current,
+    so it skips the migrations and only restores indexes an interrupted
+    import left missing.
+    """
+    if stored_version(db) == LATEST_VERSION:
+        restore_indexes(db)
+        return None
+    return migrate(db)
@@ -0,0 +1,129 @@
+from typing import List, Optional
+
+from pydantic import BaseModel, ConfigDict, field_validator
+
+from importer import SERVER_TYPES
+
+
+def _check_type(value: Optional[str]) -> Optional[str]:
+    if value is not None and value not in SERVER_TYPES:
+        raise ValueError(f"Invalid server type: {value}")
+    return value
+
+
+def _check_not_null(value):
+    # Validators only run on values the client sent, so this rejects an
+    # explicit null while leaving the field optional
+    if value is None:
+        raise ValueError("may not be null")
+    return value
+
+
+class ServerCreate(BaseModel):
+    name: str
+    type: str
+    description: Optional[str] = None
+    owner_name: str
+    owner_contact: str
+    hostname: str = ""
+    port: int = 80
+    application_id: Optional[int] = None
+    shutdown_order: Optional[int] = None
+    dependencies: Optional[str] = None
+
+    _type = field_validator('type')(_check_type)
+
+
+class ServerUpdate(BaseModel):
+    """Columns to change; only the ones sent are written."""
+
+    name: Optional[str] = None
+    type: Optional[str] = None
+    status: Optional[str] = None
+    shutdown_status: Optional[str] = None
+    owner_name: Optional[str] = None
+    owner_contact: Optional[str] = None
+    hostname: Optional[str] = None
+    port: Optional[int] = None
+    application_id: Optional[int] = None
+    shutdown_order: Optional[int] = None
+    dependencies: Optional[str] = None
+
+    _type = field_validator('type')(_check_type)
+    # NOT NULL columns
+    _not_null = field_validator('name', 'type')(_check_not_null)
+
+
+class Server(BaseModel):
+    # Every field is optional: list endpoints can project with ?fields=.
+    # The list endpoints return pages already encoded (listing.encode_page)
+    # in this shape; the models document them without being run over them.
+    id: Optional[int] = None
+    name: Optional[str] = None
+    description: Optional[str] = None
+    type: Optional[str] = None
+    status: Optional[str] = None
+    shutdown_status: Optional[str] = None
+    test_response: Optional[str] = None
+    owner_name: Optional[str] = None
+    owner_contact: Optional[str] = None
+    hostname: Optional[str] = None
+    port: Optional[int] = None
+    application_id: Optional[int] = None
+    shutdown_order: Optional[int] = None
+    dependencies: Optional[str] = None
+    row_version: Optional[int] = None
+
+
+class ServerPage(BaseModel):
+    items: List[Server]
+    next_cursor: Optional[str] = None
+    limit: int
+
+
+class SearchHit(Server):
+    application_name: Optional[str] = None
+    score: float
+
+
+class SearchResults(BaseModel):
+    query: str
+    items: List[SearchHit]
+    limit: int
+
+
+class ApplicationCreate(BaseModel):
+    name: str
+    description: Optional[str] = ""
+
+
+class Application(BaseModel):
+    id: Optional[int] = None
+    name: Optional[str] = None
+    description: Optional[str] = None
+    status: Optional[str] = None
+    test_response: Optional[str] = None
+    row_version: Optional[int] = None
+
+
+class ApplicationPage(BaseModel):
+    items: List[Application]
+    next_cursor: Optional[str] = None
+    limit: int
+
+
+class ProbeRequest(BaseModel):
+    hostname: str
+    port: int
+    type: str = "tcp"
+
+
+class ProbeResult(BaseModel):
+    # Plugins add their own details (certificate expiry, attempts, ...)
+    model_config = ConfigDict(extra='allow')
+
+    status: str
+    message: str
+    latency_ms: Optional[float] = None
+    error: Optional[str] = None
+    attempts: Optional[int] = None
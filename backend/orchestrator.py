@@ -0,0 +1,326 @@
+import asyncio
+import time
+from typing import Callable, Dict, List, Optional, Sequence
+
+from config import ORCHESTRATION_NODE_TIMEOUT, ORCHESTRATION_POLL_INTERVAL
+from db import Database
+from events import BroadcastHub
+from probes import ProbeScheduler, ProbeTarget
+from rollup import UP_STATUSES
+
+DIRECTIONS = ('shutdown', 'startup')
+
+# shutdown_status written as a node moves through a run
+NODE_STATUSES = {
+    'shutdown': {'in_progress': 'In Progress', 'done': 'Completed', 'failed': 'Failed'},
+    'startup': {'in_progress': 'Starting', 'done': 'Not Started', 'failed': 'Failed'},
+}
+
+SERVER_FIELDS = (
+    'id', 'name', 'hostname', 'port', 'type', 'application_id', 'status', 'test_response',
+    'shutdown_order', 'dependencies',
+)
+
+
+class DependencyCycle(ValueError):
+    def __init__(self, cycle: List[str]):
+        super().__init__(f"Dependency cycle: {' -> '.join(cycle)}")
+        self.cycle = cycle
+
+
+def split_dependencies(value: Optional[str]) -> List[str]:
+    return [token.strip() for token in (value or '').replace(',', ';').split(';') if token.strip()]
+
+
+class DependencyGraph:
+    """Shutdown DAG over a set of servers.
+
+    A server's ``dependencies`` lists the servers that have to be down
+    before it goes down; entries may be "host:port", a hostname or a server
+    name. Servers with a ``shutdown_order`` go down in descending order:
+    every group waits for all servers with a higher order, through one
+    barrier node per group rather than an edge per pair. Servers without
+    an order are only held back by their dependencies. Startup runs the
+    same graph with every edge reversed.
+
+    Nodes 0..n-1 are the servers, nodes from n up are barriers.
+    """
+
+    def __init__(self, servers: Sequence[dict], direction: str = 'shutdown'):
+        self.servers = list(servers)
+        self.direction = direction
+        count = len(self.servers)
+        index = {server['id']: i for i, server in enumerate(self.servers)}
+        lookup: Dict[str, List[int]] = {}
+        for i, server in enumerate(self.servers):
+            keys = {server['name'], server['hostname'], f"{server['hostname']}:{server['port']}"}
+            for key in keys:
+                if key:
+                    lookup.setdefault(key, []).append(i)
+
+        edges = []
+        self.unresolved = []
+        for i, server in enumerate(self.servers):
+            for token in split_dependencies(server.get('dependencies')):
+                matches = lookup.get(token)
+                if not matches:
+                    self.unresolved.append({"id": server['id'], "dependency": token})
+                    continue
+                edges.extend((j, i) for j in matches if j != i)
+
+        groups: Dict[int, List[int]] = {}
+        for i, server in enumerate(self.servers):
+            if server.get('shutdown_order') is not None:
+                groups.setdefault(server['shutdown_order'], []).append(i)
+        self.orders = sorted(groups, reverse=True)
+        for barrier, (order, lower) in enumerate(zip(self.orders, self.orders[1:]), start=count):
+            edges.extend((i, barrier) for i in groups[order])
+            edges.extend((barrier, j) for j in groups[lower])
+
+        self.size = count + max(0, len(self.orders) - 1)
+        self.successors: List[List[int]] = [[] for _ in range(self.size)]
+        for a, b in set(edges):
+            if direction == 'startup':
+                a, b = b, a
+            self.successors[a].append(b)
+        self.index = index
+
+    def label(self, node: int) -> str:
+        if node < len(self.servers):
+            return self.servers[node]['name']
+        position = node - len(self.servers)
+        return f"<shutdown_order {self.orders[position]} before {self.orders[position + 1]}>"
+
+    def indegrees(self) -> List[int]:
+        degrees = [0] * self.size
+        for successors in self.successors:
+            for node in successors:
+                degrees[node] += 1
+        return degrees
+
+    def waves(self) -> List[List[int]]:
+        """Server indexes grouped by topological level; raises DependencyCycle."""
+        degrees = self.indegrees()
+        level = [0] * self.size
+        ready = [node for node in range(self.size) if not degrees[node]]
+        seen = 0
+        count = len(self.servers)
+        while ready:
+            node = ready.pop()
+            seen += 1
+            # Barriers take no time of their own
+            step = 1 if node < count else 0
+            for successor in self.successors[node]:
+                level[successor] = max(level[successor], level[node] + step)
+                degrees[successor] -= 1
+                if not degrees[successor]:
+                    ready.append(successor)
+        if seen < self.size:
+            raise DependencyCycle(self._find_cycle(degrees))
+        waves: Dict[int, List[int]] = {}
+        for node in range(count):
+            waves.setdefault(level[node], []).append(node)
+        return [waves[wave] for wave in sorted(waves)]
+
+    def _find_cycle(self, degrees: List[int]) -> List[str]:
+        # Every node left with a non-zero in-degree is on or behind a cycle;
+        # walking predecessors among them must revisit a node
+        predecessors: Dict[int, int] = {}
+        for node, successors in enumerate(self.successors):
+            if degrees[node]:
+                for successor in successors:
+                    if degrees[successor]:
+                        predecessors.setdefault(successor, node)
+        node = next(n for n in range(self.size) if degrees[n])
+        path = []
+        positions = {}
+        while node not in positions:
+            positions[node] = len(path)
+            path.append(node)
+            node = predecessors[node]
+        cycle = path[positions[node]:] + [node]
+        return [self.label(n) for n in reversed(cycle)]
+
+
+class Orchestration:
+    """One shutdown or startup run over a dependency graph.
+
+    A server is released as soon as everything before it has been
+    verified, not when its whole wave is done, so the run takes as long as
+    its critical path. Released servers are marked in progress and probed
+    every ``poll_interval`` seconds until they are verified down (or up
+    for startup). A server not verified within ``node_timeout`` fails, and
+    everything that depends on it stays blocked while independent
+    branches carry on.
+    """
+
+    def __init__(
+        self,
+        graph: DependencyGraph,
+        db: Database,
+        scheduler: ProbeScheduler,
+        record: Optional[Callable] = None,
+        hub: Optional[BroadcastHub] = None,
+        poll_interval: float = ORCHESTRATION_POLL_INTERVAL,
+        node_timeout: float = ORCHESTRATION_NODE_TIMEOUT,
+    ):
+        # Given when the run is registered (main.orchestration_store)
+        self.id: Optional[int] = None
+        self.graph = graph
+        self.direction = graph.direction
+        self.db = db
+        self.scheduler = scheduler
+        # record(target, result, previous) stores a probe result and returns it
+        # as stored, or None while a status change awaits confirmation
+        self.record = record
+        self.hub = hub
+        self.poll_interval = poll_interval
+        self.node_timeout = node_timeout
+        self.waves = graph.waves()
+        self.state = 'pending'
+        self.node_states = ['waiting'] * len(graph.servers)
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.task: Optional[asyncio.Task] = None
+        self._previous = {server['id']: (server['status'], server['test_response']) for server in graph.servers}
+
+    def plan(self) -> dict:
+        servers = self.graph.servers
+        return {
+            "direction": self.direction,
+            "servers": len(servers),
+            "critical_path": len(self.waves),
+            "waves": [[servers[node]['id'] for node in wave] for wave in self.waves],
+            "unresolved_dependencies": self.graph.unresolved,
+        }
+
+    def progress(self) -> dict:
+        counts: Dict[str, int] = {}
+        for state in self.node_states:
+            counts[state] = counts.get(state, 0) + 1
+        servers = self.graph.servers
+        return {
+            "id": self.id,
+            "direction": self.direction,
+            "state": self.state,
+            "counts": counts,
+            "in_progress": [servers[i]['id'] for i, s in enumerate(self.node_states) if s == 'in_progress'],
+            "failed": [servers[i]['id'] for i, s in enumerate(self.node_states) if s == 'failed'],
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "critical_path": len(self.waves),
+        }
+
+    def start(self):
+        self.task = asyncio.create_task(self.run())
+        return self.task
+
+    def cancel(self):
+        if self.task is not None and not self.task.done():
+            self.task.cancel()
+
+    def _on_result(self, target: ProbeTarget, result: dict):
+        stored = result
+        if self.record is not None:
+            stored = self.record(target, result, self._previous.get(target.id))
+        if stored is not None:
+            self._previous[target.id] = (stored["status"], stored["message"])
+
+    def _verified(self, result: dict) -> bool:
+        if self.direction == 'shutdown':
+            return result["status"] == "offline"
+        return result["status"] in UP_STATUSES
+
+    async def _set_states(self, nodes: List[int], state: str):
+        if not nodes:
+            return
+        for node in nodes:
+            self.node_states[node] = state
+        status = NODE_STATUSES[self.direction].get(state)
+        if status is not None:
+            ids = [self.graph.servers[node]['id'] for node in nodes]
+            await self.db.write(
+                lambda conn: conn.executemany(
+                    'UPDATE servers SET shutdown_status = ? WHERE id = ?', [(status, i) for i in ids]
+                )
+            )
+        if self.hub is not None:
+            self.hub.publish("orchestration", {
+                "id": self.id,
+                "state": self.state,
+                "servers": [self.graph.servers[node]['id'] for node in nodes],
+                "server_state": state,
+            })
+
+    async def run(self):
+        graph = self.graph
+        count = len(graph.servers)
+        degrees = graph.indegrees()
+        released: Dict[int, float] = {}
+        self.state = 'running'
+        self.started_at = time.time()
+        loop = asyncio.get_running_loop()
+
+        def finish(node: int, ready: List[int]):
+            # Barriers complete as soon as they are reached
+            for successor in graph.successors[node]:
+                degrees[successor] -= 1
+                if not degrees[successor]:
+                    if successor < count:
+                        ready.append(successor)
+                    else:
+                        finish(successor, ready)
+
+        ready: List[int] = []
+        for node in range(graph.size):
+            if not degrees[node]:
+                if node < count:
+                    ready.append(node)
+                else:
+                    finish(node, ready)
+        try:
+            while ready or released:
+                now = loop.time()
+                for node in ready:
+                    released[node] = now
+                await self._set_states(ready, 'in_progress')
+                ready = []
+
+                nodes = list(released)
+                targets = [
+                    ProbeTarget(*(graph.servers[node][f] for f in ('id', 'hostname', 'port', 'type', 'application_id')))
+                    for node in nodes
+                ]
+                results = await self.scheduler.run(targets, on_result=self._on_result)
+
+                done, failed = [], []
+                now = loop.time()
+                for node in nodes:
+                    result = results.get(graph.servers[node]['id'])
+                    if result is not None and self._verified(result):
+                        done.append(node)
+                    elif now - released[node] >= self.node_timeout:
+                        failed.append(node)
+                for node in done + failed:
+                    del released[node]
+                for node in done:
+                    finish(node, ready)
+                await self._set_states(done, 'done')
+                await self._set_states(failed, 'failed')
+
+                if released and not ready:
+                    await asyncio.sleep(self.poll_interval)
+
+            blocked = [node for node, state in enumerate(self.node_states) if state == 'waiting']
+            self.state = 'failed' if blocked or 'failed' in self.node_states else 'completed'
+            await self._set_states(blocked, 'blocked')
+        except asyncio.CancelledError:
+            self.state = 'cancelled'
+            raise
+        except Exception as e:
+            print(f"Error running {self.direction} orchestration {self.id}: {e}")
+            self.state = 'failed'
+        finally:
+            self.finished_at = time.time()
+            if self.hub is not None:
+                self.hub.publish("orchestration", {"id": self.id, "state": self.state})
@@ -0,0 +1,102 @@
+import functools
+import re
+
+import psycopg2
+import psycopg2.extensions
+import psycopg2.extras
+
+from config import DB_READERS, DB_WRITERS
+from db import Database
+
+# Quoted literals and identifiers are copied as they are; everything else
+# has its qmark placeholders rewritten
+_SQL_TOKENS = re.compile(r"('(?:[^']|'')*'|\"(?:[^\"]|\"\")*\")|(\?)|(%)")
+
+
+@functools.lru_cache(maxsize=1024)
+def translate(sql: str) -> str:
+    """SQLite-style ``?`` placeholders to psycopg2's ``%s``.
+
+    psycopg2 treats every ``%`` in a statement with parameters as a format
+    character, so literal ones (the modulo operator, LIKE patterns) are
+    doubled, inside quotes too.
+    """
+    def replace(match):
+        quoted, mark, percent = match.groups()
+        if quoted is not None:
+            return quoted.replace('%', '%%')
+        return '%s' if mark else '%%'
+    return _SQL_TOKENS.sub(replace, sql)
+
+
+class PgConnection:
+    """The part of the sqlite3.Connection API the stores use, over psycopg2.
+
+    The connection is in autocommit mode so transactions are opened and
+    closed with explicit BEGIN / COMMIT statements, as on SQLite. Rows are
+    DictRows, which index by position and convert with dict() like
+    sqlite3.Row.
+    """
+
+    def __init__(self, raw):
+        self.raw = raw
+
+    def execute(self, sql: str, params=None):
+        cursor = self.raw.cursor()
+        if params:
+            cursor.execute(translate(sql), params)
+        else:
+            cursor.execute(sql)
+        return cursor
+
+    def executemany(self, sql: str, rows):
+        # execute_batch sends many statements per round trip, unlike
+        # cursor.executemany; rowcount is not summed across them
+        cursor = self.raw.cursor()
+        psycopg2.extras.execute_batch(cursor, translate(sql), rows, page_size=500)
+        return cursor
+
+    @property
+    def in_transaction(self) -> bool:
+        return self.raw.info.transaction_status != psycopg2.extensions.TRANSACTION_STATUS_IDLE
+
+    def rollback(self):
+        self.raw.cursor().execute('ROLLBACK')
+
+    def close(self):
+        self.raw.close()
+
+
+class PostgresDatabase(Database):
+    """Database over a PostgreSQL server.
+
+    Unlike SQLite it runs ``writers`` write transactions at once, each on
+    its own connection. Reader connections default to REPEATABLE READ so
+    a read spanning several statements (changes_since) sees one snapshot,
+    as an SQLite read transaction does.
+    """
+
+    dialect = "postgres"
+    Error = psycopg2.Error
+    begin = 'BEGIN'
+
+    def __init__(self, url: str, readers: int = DB_READERS, writers: int = DB_WRITERS):
+        super().__init__(url, readers, max(1, writers))
+
+    def connect(self, reader: bool = False) -> PgConnection:
+        raw = psycopg2.connect(self.path, cursor_factory=psycopg2.extras.DictCursor)
+        raw.autocommit = True
+        if reader:
+            raw.cursor().execute('SET SESSION CHARACTERISTICS AS TRANSACTION ISOLATION LEVEL REPEATABLE READ')
+        return PgConnection(raw)
+
+    def _prepare(self, conn):
+        pass
+
+    def _open_cursor(self, conn: PgConnection, sql: str, params: tuple):
+        # A named cursor leaves the result on the server and fetches it in
+        # batches; psycopg2 only allows one inside a transaction it began
+        conn.raw.autocommit = False
+        cursor = conn.raw.cursor(name='dcmon_stream')
+        cursor.execute(translate(sql), params or None)
+        return cursor
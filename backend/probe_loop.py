@@ -0,0 +1,272 @@
+import asyncio
+import heapq
+import random
+from typing import Callable, Dict, List, Optional, Tuple
+
+from config import (
+    SCHEDULE_BACKOFF,
+    SCHEDULE_BATCH_WINDOW,
+    SCHEDULE_FAILED_MAX_INTERVAL,
+    SCHEDULE_JITTER,
+    SCHEDULE_MAX_INTERVAL,
+    SCHEDULE_MIN_INTERVAL,
+    SCHEDULE_SYNC_INTERVAL,
+    SWEEP_INTERVAL,
+)
+from db import Database
+from probes import ProbeScheduler, ProbeTarget
+from rollup import PROBED_STATUSES, UP_STATUSES
+from sync import changes_since
+
+TARGET_FIELDS = ['id', 'hostname', 'port', 'type', 'application_id', 'status', 'test_response']
+
+
+class TargetState:
+    __slots__ = ('target', 'previous', 'interval', 'due', 'generation', 'in_flight')
+
+    def __init__(self, target: ProbeTarget, previous: Tuple[str, str], interval: float):
+        self.target = target
+        self.previous = previous
+        self.interval = interval
+        self.due = 0.0
+        # Bumped on every reschedule; heap entries from older generations
+        # are stale and skipped when popped
+        self.generation = 0
+        self.in_flight = False
+
+
+class ProbeLoop:
+    """Probes each server on its own schedule instead of in fixed sweeps.
+
+    Targets sit in a heap keyed on their next due time. Hosts that stay up
+    back off by ``backoff`` per probe up to ``max_interval``; hosts that
+    are down back off only up to ``failed_max_interval``; a status change
+    drops the host back to ``min_interval``. Every due time is jittered
+    so targets spread out instead of moving in lockstep.
+
+    Due targets are collected every ``batch_window`` seconds and handed to
+    the shared ProbeScheduler as one batch, which keeps the per-target
+    cost on the event loop to a heap push and pop. Inventory changes are
+    picked up from the row_version change feed every ``sync_interval``
+    seconds. With ``shard`` set to (index, count) only servers whose id
+    modulo count equals index are probed.
+    """
+
+    def __init__(
+        self,
+        db: Database,
+        scheduler: ProbeScheduler,
+        record: Callable,
+        min_interval: float = SCHEDULE_MIN_INTERVAL,
+        max_interval: float = SCHEDULE_MAX_INTERVAL,
+        failed_max_interval: float = SCHEDULE_FAILED_MAX_INTERVAL,
+        initial_interval: float = SWEEP_INTERVAL,
+        backoff: float = SCHEDULE_BACKOFF,
+        jitter: float = SCHEDULE_JITTER,
+        batch_window: float = SCHEDULE_BATCH_WINDOW,
+        sync_interval: float = SCHEDULE_SYNC_INTERVAL,
+        retry: Optional[Callable] = None,
+        shard: Optional[Tuple[int, int]] = None,
+    ):
+        self.db = db
+        self.scheduler = scheduler
+        # record(target, result, previous) stores a probe result and returns
+        # it as stored, or None while a status change awaits confirmation
+        self.record = record
+        # Passed on to ProbeScheduler.run() for fast retries
+        self.retry = retry
+        self.shard = shard
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.failed_max_interval = failed_max_interval
+        self.initial_interval = initial_interval
+        self.backoff = backoff
+        self.jitter = jitter
+        self.batch_window = batch_window
+        self.sync_interval = sync_interval
+        self._states: Dict[int, TargetState] = {}
+        self._heap: List[Tuple[float, int, int]] = []
+        self._wake: Optional[asyncio.Event] = None
+        self._version = 0
+        self._loaded = False
+        self._batches = set()
+        self.dispatched = 0
+        self.max_lag = 0.0
+
+    def _now(self) -> float:
+        return asyncio.get_running_loop().time()
+
+    def _push(self, state: TargetState, due: float):
+        state.generation += 1
+        state.due = due
+        heapq.heappush(self._heap, (due, state.target.id, state.generation))
+        if self._wake is not None and self._heap[0][1] == state.target.id:
+            self._wake.set()
+
+    def _jittered(self, interval: float) -> float:
+        return interval * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def _next_interval(self, state: TargetState, status: str) -> float:
+        if state.previous[0] not in PROBED_STATUSES:
+            # First result after "Unknown" or "Pending" is not a flap
+            return state.interval
+        if status != state.previous[0]:
+            return self.min_interval
+        limit = self.max_interval if status in UP_STATUSES else self.failed_max_interval
+        return min(limit, max(self.min_interval, state.interval * self.backoff))
+
+    def observe(self, target_id: int, result: Optional[dict]):
+        """Reschedule a target from a stored probe result, wherever it came from.
+
+        None means the result was held back pending confirmation; the
+        target is then probed again soon.
+        """
+        state = self._states.get(target_id)
+        if state is None:
+            return
+        if result is None:
+            state.interval = self.min_interval
+        else:
+            state.interval = self._next_interval(state, result["status"])
+            state.previous = (result["status"], result["message"])
+        if not state.in_flight:
+            self._push(state, self._now() + self._jittered(state.interval))
+
+    # Inventory
+
+    def _upsert(self, row: dict, first_load: bool):
+        target = ProbeTarget(row['id'], row['hostname'], row['port'], row['type'], row['application_id'])
+        previous = (row['status'], row['test_response'])
+        state = self._states.get(target.id)
+        if state is None:
+            state = self._states[target.id] = TargetState(target, previous, self.initial_interval)
+            # Spread the initial load over one interval; later additions
+            # are probed straight away
+            delay = random.uniform(0, self.initial_interval) if first_load else 0
+            self._push(state, self._now() + delay)
+            return
+        state.previous = previous
+        if target != state.target:
+            state.target = target
+            state.interval = self.min_interval
+            if not state.in_flight:
+                self._push(state, self._now())
+
+    async def sync(self):
+        """Apply inventory changes since the last sync."""
+        first_load = not self._loaded
+        conditions, params = [], []
+        if self.shard is not None:
+            conditions, params = ['id % ? = ?'], [self.shard[1], self.shard[0]]
+        more = True
+        while more:
+            changes = await self.db.read(
+                changes_since, 'server', TARGET_FIELDS, self._version, conditions, params, 5000
+            )
+            for row in changes["items"]:
+                self._upsert(row, first_load)
+            for server_id in changes["deleted"]:
+                # Its heap entries go stale and are skipped
+                state = self._states.pop(server_id, None)
+                if state is not None:
+                    state.generation += 1
+            self._version = changes["version"]
+            more = changes["more"]
+        self._loaded = True
+        self._compact()
+
+    def _compact(self):
+        # Stale entries are normally popped lazily; rebuild if they pile up
+        if len(self._heap) > 2 * len(self._states) + 1024:
+            self._heap = [
+                (state.due, server_id, state.generation)
+                for server_id, state in self._states.items() if not state.in_flight
+            ]
+            heapq.heapify(self._heap)
+
+    # Dispatch
+
+    def _take_due(self, now: float) -> List[TargetState]:
+        due = []
+        horizon = now + self.batch_window
+        while self._heap and self._heap[0][0] <= horizon:
+            when, server_id, generation = heapq.heappop(self._heap)
+            state = self._states.get(server_id)
+            if state is None or state.generation != generation or state.in_flight:
+                continue
+            state.in_flight = True
+            self.max_lag = max(self.max_lag, now - when)
+            due.append(state)
+        return due
+
+    async def _run_batch(self, states: List[TargetState]):
+        def on_result(target, result):
+            state = self._states.get(target.id)
+            if state is None:
+                return
+            stored = self.record(target, result, state.previous)
+            state.in_flight = False
+            self.observe(target.id, stored)
+
+        try:
+            await self.scheduler.run([state.target for state in states], on_result=on_result, retry=self.retry)
+        finally:
+            # Probes cut off by the deadline or a failure are retried soon
+            for state in states:
+                if state.in_flight:
+                    state.in_flight = False
+                    if state.target.id in self._states:
+                        self._push(state, self._now() + self._jittered(self.min_interval))
+
+    async def run(self):
+        self._wake = asyncio.Event()
+        next_sync = 0.0
+        try:
+            while True:
+                now = self._now()
+                if now >= next_sync:
+                    try:
+                        await self.sync()
+                    except Exception as e:
+                        print(f"Error loading probe targets: {e}")
+                    next_sync = now + self.sync_interval
+                due = self._take_due(now)
+                if due:
+                    self.dispatched += len(due)
+                    task = asyncio.create_task(self._run_batch(due))
+                    self._batches.add(task)
+                    task.add_done_callback(self._batches.discard)
+                # Sleep until the next target is due, the next sync, or a
+                # reschedule moves something to the front
+                wake_at = min(next_sync, self._heap[0][0] if self._heap else next_sync)
+                self._wake.clear()
+                try:
+                    await asyncio.wait_for(self._wake.wait(), max(self.batch_window, wake_at - self._now()))
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            # Stopped, e.g. after losing the shard lease: probes in flight
+            # are abandoned and their targets rescheduled for a later run
+            for task in list(self._batches):
+                task.cancel()
+
+    def stats(self) -> dict:
+        now = self._now()
+        intervals = sorted(state.interval for state in self._states.values())
+        return {
+            "targets": len(self._states),
+            "heap_size": len(self._heap),
+            "in_flight": sum(1 for state in self._states.values() if state.in_flight),
+            "overdue": sum(
+                1 for state in self._states.values()
+                if not state.in_flight and state.due < now - self.batch_window
+            ),
+            "batches_running": len(self._batches),
+            "dispatched": self.dispatched,
+            "max_lag_s": round(self.max_lag, 3),
+            "interval_s": {
+                "min": intervals[0] if intervals else None,
+                "median": intervals[len(intervals) // 2] if intervals else None,
+                "max": intervals[-1] if intervals else None,
+            },
+        }
@@ -0,0 +1,293 @@
+import asyncio
+import contextlib
+import random
+import ssl
+import struct
+import time
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, Dict, NamedTuple, Optional
+
+from config import PROBE_PLUGIN_TIMEOUTS, PROBE_TIMEOUT, TLS_EXPIRY_WARN_DAYS
+from metrics import registry
+
+PROBE_PHASE_SECONDS = registry.histogram(
+    'dcmon_probe_phase_seconds',
+    'Probe time by phase: dns lookup, tcp connect (including any TLS handshake), '
+    'protocol handshake, and http request until the response headers.',
+    ('phase',),
+)
+
+
+class ProtocolError(Exception):
+    """The port answered, but not with the protocol the server type declares."""
+
+
+class ProbePlugin(NamedTuple):
+    name: str
+    label: str
+    # check(hostname, address, port) -> result dict
+    check: Callable[[str, str, int], Awaitable[dict]]
+    timeout: float
+
+
+# Lowercased server type -> plugin; types without one get a bare TCP connect
+PLUGINS: Dict[str, ProbePlugin] = {}
+
+
+def plugin(name: str, label: str, *server_types: str):
+    """Registers a check for the given server types under ``name``.
+
+    The timeout comes from PROBE_PLUGIN_TIMEOUTS (DCMON_PROBE_TIMEOUT_<NAME>)
+    and covers the whole check, connect included.
+    """
+    def register(check):
+        entry = ProbePlugin(name, label, check, PROBE_PLUGIN_TIMEOUTS.get(name, PROBE_TIMEOUT))
+        for server_type in server_types:
+            PLUGINS[server_type.lower()] = entry
+        return check
+    return register
+
+
+def plugin_for(server_type: Optional[str]) -> Optional[ProbePlugin]:
+    return PLUGINS.get((server_type or "").lower())
+
+
+async def run_plugin(entry: ProbePlugin, hostname: str, address: str, port: int) -> dict:
+    try:
+        return await asyncio.wait_for(entry.check(hostname, address, port), entry.timeout)
+    except asyncio.TimeoutError:
+        return {"status": "offline", "message": f"{entry.label} probe timed out on port {port}", "error": "timeout"}
+    except ProtocolError as e:
+        return {"status": "offline", "message": f"{entry.label} probe failed: {e}", "error": "protocol"}
+    except (asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+        return {
+            "status": "offline",
+            "message": f"{entry.label} probe failed: connection closed before a complete reply",
+            "error": "protocol",
+        }
+    except OSError as e:
+        return {"status": "offline", "message": f"Connection failed: {str(e)}", "error": "connect"}
+
+
+def online(message: str, **extra) -> dict:
+    return {"status": "online", "message": message, **extra}
+
+
+@contextlib.asynccontextmanager
+async def tcp_connection(address: str, port: int, **kwargs):
+    """Open a stream connection, timing the connect and handshake phases."""
+    started = time.perf_counter()
+    reader, writer = await asyncio.open_connection(address, port, **kwargs)
+    connected = time.perf_counter()
+    PROBE_PHASE_SECONDS.observe(connected - started, phase="connect")
+    try:
+        yield reader, writer
+        PROBE_PHASE_SECONDS.observe(time.perf_counter() - connected, phase="handshake")
+    finally:
+        writer.close()
+        with contextlib.suppress(Exception):
+            await writer.wait_closed()
+
+
+async def read_line(reader: asyncio.StreamReader) -> str:
+    return (await reader.readuntil(b"\n")).decode("latin-1").strip()
+
+
+@plugin("ssh", "SSH", "SSH")
+async def check_ssh(hostname: str, address: str, port: int) -> dict:
+    async with tcp_connection(address, port) as (reader, writer):
+        # Servers may send other lines before the identification string
+        for _ in range(5):
+            line = await read_line(reader)
+            if line.startswith("SSH-"):
+                return online(f"SSH server identified as {line[:100]}")
+    raise ProtocolError("no SSH identification string")
+
+
+@plugin("smtp", "SMTP", "MAIL")
+async def check_smtp(hostname: str, address: str, port: int) -> dict:
+    return await check_greeting(address, port, "SMTP")
+
+
+@plugin("ftp", "FTP", "FTP")
+async def check_ftp(hostname: str, address: str, port: int) -> dict:
+    return await check_greeting(address, port, "FTP")
+
+
+async def check_greeting(address: str, port: int, protocol: str) -> dict:
+    # SMTP and FTP both greet with a 220 line; multi-line greetings
+    # continue with "220-" until the final "220 "
+    async with tcp_connection(address, port) as (reader, writer):
+        line = await read_line(reader)
+        first = line
+        while len(line) > 3 and line[3] == "-":
+            line = await read_line(reader)
+    if not first.startswith("220"):
+        raise ProtocolError(f"unexpected {protocol} greeting: {first[:100]}")
+    return online(f"{protocol} server ready: {first[:100]}")
+
+
+@plugin("redis", "Redis", "DB_REDIS")
+async def check_redis(hostname: str, address: str, port: int) -> dict:
+    async with tcp_connection(address, port) as (reader, writer):
+        writer.write(b"PING\r\n")
+        await writer.drain()
+        line = await read_line(reader)
+    if line.startswith("+"):
+        return online(f"Redis responded {line[1:][:100]}")
+    if line.startswith("-"):
+        # An auth or protected-mode error still comes from a live server
+        return online(f"Redis responded with error: {line[1:][:100]}")
+    raise ProtocolError(f"unexpected reply to PING: {line[:100]}")
+
+
+# SSLRequest: message length 8, then the magic request code of the
+# PostgreSQL frontend/backend protocol
+POSTGRES_SSL_REQUEST = struct.pack("!II", 8, 80877103)
+
+
+@plugin("postgres", "PostgreSQL", "DB_POSTGRES")
+async def check_postgres(hostname: str, address: str, port: int) -> dict:
+    # One byte back ('S' or 'N') without authenticating or starting a session
+    async with tcp_connection(address, port) as (reader, writer):
+        writer.write(POSTGRES_SSL_REQUEST)
+        await writer.drain()
+        reply = await reader.readexactly(1)
+    if reply == b"S":
+        return online("PostgreSQL server accepts SSL connections")
+    if reply == b"N":
+        return online("PostgreSQL server responded (SSL not enabled)")
+    if reply == b"E":
+        return online("PostgreSQL server responded with an error to SSLRequest")
+    raise ProtocolError(f"unexpected reply to SSLRequest: {reply!r}")
+
+
+@plugin("mysql", "MySQL", "DB_MYSQL")
+async def check_mysql(hostname: str, address: str, port: int) -> dict:
+    # The server speaks first with its handshake packet
+    async with tcp_connection(address, port) as (reader, writer):
+        header = await reader.readexactly(4)
+        length = int.from_bytes(header[:3], "little")
+        payload = await reader.readexactly(min(length, 256))
+    if payload[:1] == b"\x0a":
+        version = payload[1:].split(b"\0", 1)[0].decode("latin-1")
+        return online(f"MySQL server version {version[:60]}")
+    if payload[:1] == b"\xff":
+        # Error packet, e.g. host not allowed to connect: code, then the text
+        text = payload[3:].decode("latin-1")
+        return online(f"MySQL server refused the connection: {text[:100]}")
+    raise ProtocolError("unexpected handshake packet")
+
+
+DNS_RCODES = ("NOERROR", "FORMERR", "SERVFAIL", "NXDOMAIN", "NOTIMP", "REFUSED")
+
+
+class _DnsReply(asyncio.DatagramProtocol):
+    def __init__(self, query_id: bytes):
+        self.query_id = query_id
+        self.reply = asyncio.get_running_loop().create_future()
+
+    def datagram_received(self, data, addr):
+        # Replies must echo the query id and have the QR bit set
+        if len(data) >= 12 and data[:2] == self.query_id and data[2] & 0x80 and not self.reply.done():
+            self.reply.set_result(data)
+
+    def error_received(self, exc):
+        if not self.reply.done():
+            self.reply.set_exception(exc)
+
+
+@plugin("dns", "DNS", "DNS")
+async def check_dns(hostname: str, address: str, port: int) -> dict:
+    # Non-recursive NS query for the root zone over UDP; any well-formed
+    # answer, REFUSED included, shows the server is serving DNS
+    query_id = random.getrandbits(16).to_bytes(2, "big")
+    query = query_id + b"\x00\x00\x00\x01\x00\x00\x00\x00\x00\x00" + b"\x00\x00\x02\x00\x01"
+    loop = asyncio.get_running_loop()
+    started = time.perf_counter()
+    transport, protocol = await loop.create_datagram_endpoint(
+        lambda: _DnsReply(query_id), remote_addr=(address, port)
+    )
+    try:
+        transport.sendto(query)
+        reply = await protocol.reply
+    finally:
+        transport.close()
+    PROBE_PHASE_SECONDS.observe(time.perf_counter() - started, phase="handshake")
+    rcode = reply[3] & 0x0F
+    name = DNS_RCODES[rcode] if rcode < len(DNS_RCODES) else str(rcode)
+    return online(f"DNS server answered ({name})")
+
+
+_tls_context: Optional[ssl.SSLContext] = None
+
+
+def tls_context() -> ssl.SSLContext:
+    # Reachability probe: the certificate is inspected, not verified, as
+    # internal services commonly use self-signed certs
+    global _tls_context
+    if _tls_context is None:
+        _tls_context = ssl.create_default_context()
+        _tls_context.check_hostname = False
+        _tls_context.verify_mode = ssl.CERT_NONE
+    return _tls_context
+
+
+def _der_element(data: bytes, offset: int):
+    """(tag, content start, content end) of the DER element at offset."""
+    tag = data[offset]
+    length = data[offset + 1]
+    offset += 2
+    if length & 0x80:
+        size = length & 0x7F
+        length = int.from_bytes(data[offset:offset + size], "big")
+        offset += size
+    return tag, offset, offset + length
+
+
+def certificate_not_after(der: bytes) -> datetime:
+    """Expiry of a DER X.509 certificate, read without a crypto library."""
+    _, start, _ = _der_element(der, 0)
+    # tbsCertificate: [0] version (optional), serial, signature, issuer, validity, ...
+    _, offset, end = _der_element(der, start)
+    fields = []
+    while offset < end and len(fields) < 4:
+        tag, content, offset = _der_element(der, offset)
+        if tag != 0xA0:
+            fields.append(content)
+    validity = fields[3]
+    _, _, not_before_end = _der_element(der, validity)
+    tag, content, content_end = _der_element(der, not_before_end)
+    text = der[content:content_end].decode("ascii")
+    # UTCTime (0x17) has a two digit year, GeneralizedTime four
+    fmt = "%y%m%d%H%M%SZ" if tag == 0x17 else "%Y%m%d%H%M%SZ"
+    return datetime.strptime(text, fmt).replace(tzinfo=timezone.utc)
+
+
+@plugin("tls", "TLS", "HTTPS")
+async def check_tls(hostname: str, address: str, port: int) -> dict:
+    async with tcp_connection(
+        address, port, ssl=tls_context(), server_hostname=hostname or address
+    ) as (reader, writer):
+        ssl_object = writer.get_extra_info("ssl_object")
+        version = ssl_object.version()
+        der = ssl_object.getpeercert(binary_form=True)
+    if not der:
+        return online(f"TLS handshake completed ({version}), no certificate presented")
+    try:
+        expires = certificate_not_after(der)
+    except (IndexError, ValueError):
+        return online(f"TLS handshake completed ({version}), certificate expiry unreadable")
+    days = (expires - datetime.now(timezone.utc)).total_seconds() / 86400
+    extra = {"certificate_expires": expires.isoformat(), "certificate_days_left": round(days, 1)}
+    if days < 0:
+        return {
+            "status": "offline",
+            "message": f"TLS certificate expired on {expires:%Y-%m-%d}",
+            "error": "protocol",
+            **extra,
+        }
+    message = f"TLS handshake completed ({version}), certificate expires {expires:%Y-%m-%d}"
+    if days < TLS_EXPIRY_WARN_DAYS:
+        message += f" (in {int(days)} days)"
+    return online(message, **extra)
@@ -0,0 +1,293 @@
+import asyncio
+import contextlib
+import ipaddress
+import math
+import socket
+import sys
+import time
+from typing import Callable, Dict, Iterable, NamedTuple, Optional
+
+from config import (
+    HTTP_PROBE_METHOD,
+    HTTP_PROBE_PATH,
+    PROBE_PLUGIN_TIMEOUTS,
+    PROBE_CONCURRENCY,
+    PROBE_PER_HOST_LIMIT,
+    PROBE_PER_SUBNET_LIMIT,
+    PROBE_SUBNET_PREFIX,
+    PROBE_TIMEOUT,
+    STATUS_RETRY_DELAY,
+    SWEEP_DEADLINE,
+)
+from metrics import registry
+from probe_plugins import PROBE_PHASE_SECONDS, plugin, plugin_for, run_plugin
+from resolver import resolver
+
+PROBE_SECONDS = registry.histogram(
+    'dcmon_probe_duration_seconds', 'Total time per probe by check kind.', ('kind',),
+)
+PROBES_TOTAL = registry.counter(
+    'dcmon_probes_total', 'Probes run, by check kind and result (online or the error class).', ('kind', 'result'),
+)
+PROBE_RUN_SECONDS = registry.histogram(
+    'dcmon_probe_run_seconds', 'Wall time of each scheduler run (a sweep or a probe loop batch).',
+)
+PROBE_RUN_TARGETS = registry.counter('dcmon_probe_run_targets_total', 'Targets handed to the probe scheduler.')
+PROBE_CANCELLED = registry.counter(
+    'dcmon_probe_cancelled_total', 'Probes cancelled because a run passed its deadline.',
+)
+
+
+class ProbeTarget(NamedTuple):
+    id: int
+    hostname: str
+    port: int
+    type: str
+    application_id: Optional[int] = None
+
+
+async def close_http_session():
+    # Nothing to close unless an HTTP probe loaded the client
+    http_client = sys.modules.get('http_client')
+    if http_client is not None:
+        await http_client.close_http_session()
+
+
+def unresolved(hostname: str) -> dict:
+    return {"status": "offline", "message": f"Could not resolve hostname: {hostname}", "error": "dns"}
+
+
+async def resolve_address(hostname: str) -> str:
+    """First address for hostname, timed as the probe's dns phase."""
+    started = time.perf_counter()
+    try:
+        return (await resolver.resolve(hostname))[0]
+    finally:
+        PROBE_PHASE_SECONDS.observe(time.perf_counter() - started, phase="dns")
+
+
+async def check_server_status(hostname: str, port: int, server_type: str, address: Optional[str] = None) -> dict:
+    """Probe one server; the result carries status, message, latency_ms and, on failure, an error class."""
+    started = time.perf_counter()
+    result = await _check_server_status(hostname, port, server_type, address)
+    elapsed = time.perf_counter() - started
+    result["latency_ms"] = round(elapsed * 1000, 3)
+    kind = probe_kind(server_type)
+    PROBE_SECONDS.observe(elapsed, kind=kind)
+    PROBES_TOTAL.inc(kind=kind, result=result.get("error") or result["status"])
+    return result
+
+
+def probe_kind(server_type: Optional[str]) -> str:
+    entry = plugin_for(server_type)
+    return entry.name if entry else "tcp"
+
+
+@plugin("http", "HTTP", "WEB", "HTTP")
+async def check_http(hostname: str, address: str, port: int) -> dict:
+    # Loaded with the first HTTP probe, see http_client
+    import aiohttp
+    from http_client import get_http_session
+
+    try:
+        # Only the status line is needed, the body is never read
+        session = get_http_session()
+        url = f"http://{hostname}:{port}{HTTP_PROBE_PATH}"
+        timeout = aiohttp.ClientTimeout(total=PROBE_PLUGIN_TIMEOUTS["http"])
+        async with session.request(HTTP_PROBE_METHOD, url, allow_redirects=False, timeout=timeout) as response:
+            return {"status": "online", "message": f"HTTP server responded with status {response.status}"}
+    except Exception as e:
+        error = "timeout" if isinstance(e, asyncio.TimeoutError) else "http"
+        return {"status": "offline", "message": f"HTTP connection failed: {str(e)}", "error": error}
+
+
+async def _check_server_status(hostname: str, port: int, server_type: str, address: Optional[str] = None) -> dict:
+    try:
+        if not hostname or not port:
+            return {"status": "offline", "message": "Invalid hostname or port", "error": "invalid"}
+
+        # Try to resolve the hostname first
+        if address is None:
+            try:
+                address = await resolve_address(hostname)
+            except socket.gaierror:
+                return unresolved(hostname)
+
+        entry = plugin_for(server_type)
+        if entry is not None:
+            return await run_plugin(entry, hostname, address, port)
+        else:
+            # Default TCP check
+            try:
+                connect_started = time.perf_counter()
+                reader, writer = await asyncio.wait_for(
+                    asyncio.open_connection(address, port),
+                    timeout=PROBE_TIMEOUT
+                )
+                PROBE_PHASE_SECONDS.observe(time.perf_counter() - connect_started, phase="connect")
+                writer.close()
+                await writer.wait_closed()
+                return {"status": "online", "message": f"TCP connection successful on port {port}"}
+            except asyncio.TimeoutError:
+                return {"status": "offline", "message": f"Connection timeout on port {port}", "error": "timeout"}
+            except Exception as e:
+                return {"status": "offline", "message": f"Connection failed: {str(e)}", "error": "connect"}
+    except Exception as e:
+        return {"status": "offline", "message": f"Test failed: {str(e)}", "error": "other"}
+
+
+def subnet_key(address: Optional[str], prefix: int = PROBE_SUBNET_PREFIX) -> Optional[str]:
+    try:
+        ip = ipaddress.ip_address(address)
+    except (TypeError, ValueError):
+        return None
+    if ip.version == 6:
+        prefix = max(prefix, 64)
+    return str(ipaddress.ip_network(f"{ip}/{prefix}", strict=False))
+
+
+class KeyedLimiter:
+    """Per-key semaphores that are dropped again once nobody holds them."""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self._slots: Dict[str, list] = {}
+
+    @contextlib.asynccontextmanager
+    async def hold(self, key: Optional[str]):
+        if key is None or self.limit <= 0:
+            yield
+            return
+        entry = self._slots.get(key)
+        if entry is None:
+            entry = self._slots[key] = [asyncio.Semaphore(self.limit), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._slots[key]
+
+
+class ProbeScheduler:
+    """Runs probes concurrently under global, per-host and per-subnet limits.
+
+    One instance is shared by the background sweep and the test endpoints so
+    the global limit applies to all probe traffic leaving the process.
+    """
+
+    def __init__(
+        self,
+        concurrency: int = PROBE_CONCURRENCY,
+        per_host: int = PROBE_PER_HOST_LIMIT,
+        per_subnet: int = PROBE_PER_SUBNET_LIMIT,
+        sweep_deadline: float = SWEEP_DEADLINE,
+        probe: Callable = check_server_status,
+        retry_delay: float = STATUS_RETRY_DELAY,
+    ):
+        self.concurrency = concurrency
+        self.sweep_deadline = sweep_deadline
+        self.retry_delay = retry_delay
+        self.probe = probe
+        self.in_flight = 0
+        self._global: Optional[asyncio.Semaphore] = None
+        self._hosts = KeyedLimiter(per_host)
+        self._subnets = KeyedLimiter(per_subnet)
+
+    async def _attempt(self, target: ProbeTarget, address: Optional[str]) -> dict:
+        self.in_flight += 1
+        try:
+            return await self.probe(target.hostname, target.port, target.type or "", address=address)
+        finally:
+            self.in_flight -= 1
+
+    async def _probe_one(
+        self, target: ProbeTarget, results: dict, on_result: Optional[Callable], retry: Optional[Callable]
+    ):
+        async with self._hosts.hold(target.hostname):
+            # Resolve up front so the subnet limit sees the real address
+            started = time.perf_counter()
+            try:
+                address = await resolve_address(target.hostname) if target.hostname else None
+            except socket.gaierror:
+                result = unresolved(target.hostname)
+                result["latency_ms"] = round((time.perf_counter() - started) * 1000, 3)
+                PROBES_TOTAL.inc(kind=probe_kind(target.type), result="dns")
+            else:
+                async with self._subnets.hold(subnet_key(address)):
+                    attempts = 1
+                    result = await self._attempt(target, address)
+                    while retry is not None and retry(target, result, attempts):
+                        await asyncio.sleep(self.retry_delay)
+                        attempts += 1
+                        result = await self._attempt(target, address)
+                    if attempts > 1:
+                        result["attempts"] = attempts
+        results[target.id] = result
+        if on_result:
+            on_result(target, result)
+
+    async def run(
+        self,
+        targets: Iterable[ProbeTarget],
+        on_result: Optional[Callable] = None,
+        deadline: Optional[float] = None,
+        retry: Optional[Callable] = None,
+    ) -> Dict[int, dict]:
+        """Probe all targets and return {target id: result}.
+
+        While retry(target, result, attempts) is true a target is probed
+        again after ``retry_delay``, inside the same run, and the final
+        result reports how many attempts it took.
+
+        Targets still queued or in flight when the deadline passes are
+        cancelled and left out of the result, so callers keep their previous
+        status instead of recording a false "offline". ``deadline`` defaults
+        to ``sweep_deadline``; math.inf runs until every target is probed.
+        """
+        if self._global is None:
+            self._global = asyncio.Semaphore(self.concurrency)
+        started = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        expires = loop.time() + (self.sweep_deadline if deadline is None else deadline)
+
+        def remaining() -> Optional[float]:
+            return None if expires == math.inf else max(0.0, expires - loop.time())
+
+        results: Dict[int, dict] = {}
+        tasks = set()
+        try:
+            for target in targets:
+                if remaining() == 0:
+                    break
+                try:
+                    await asyncio.wait_for(self._global.acquire(), remaining())
+                except asyncio.TimeoutError:
+                    break
+                PROBE_RUN_TARGETS.inc()
+                task = asyncio.create_task(self._probe_one(target, results, on_result, retry))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+                # Released from the callback so a task cancelled before it
+                # ever ran still gives its slot back
+                task.add_done_callback(lambda _: self._global.release())
+            if tasks:
+                await asyncio.wait(set(tasks), timeout=remaining())
+        finally:
+            for task in list(tasks):
+                task.cancel()
+        PROBE_RUN_SECONDS.observe(time.perf_counter() - started)
+        if tasks:
+            PROBE_CANCELLED.inc(len(tasks))
+        return results
+
+
+probe_scheduler = ProbeScheduler()
+
+registry.gauge('dcmon_probe_in_flight', 'Probes currently running.', lambda: probe_scheduler.in_flight)
+registry.gauge('dcmon_probe_concurrency_limit', 'Global probe concurrency limit.', lambda: probe_scheduler.concurrency)
+registry.gauge(
+    'dcmon_resolver_cache_entries', 'Hostnames held in the resolver cache.', lambda: resolver.stats()["size"]
+)
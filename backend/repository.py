@@ -0,0 +1,199 @@
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from listing import build_list_query
+from sync import changes_since
+
+# Ids per IN (...) list, well under SQLite's bound parameter limit
+ID_CHUNK = 500
+
+# What a probe needs of a server, then its stored status and response
+PROBE_COLUMNS = ('id', 'hostname', 'port', 'type', 'application_id', 'status', 'test_response')
+
+
+def _chunks(ids: Sequence[int]) -> Iterable[Sequence[int]]:
+    for start in range(0, len(ids), ID_CHUNK):
+        yield ids[start:start + ID_CHUNK]
+
+
+class TableRepository:
+    """Writes and lookups for one inventory table.
+
+    Methods take the connection as their first argument and run on the
+    database threads, called as ``await db.write(repository.update, ...)``,
+    so several calls can share one transaction. Only SQL that SQLite and
+    PostgreSQL both accept is used; the few differences are keyed on
+    ``dialect``. Column names are checked against ``fields`` before they
+    reach a statement.
+    """
+
+    table = ''
+    # Name of the table in the change feed (sync.VERSIONED_TABLES)
+    kind = ''
+    fields: Sequence[str] = ()
+
+    def __init__(self, dialect: str = "sqlite"):
+        self.dialect = dialect
+
+    def check_fields(self, data: dict, allowed: Sequence[str] = ()) -> List[str]:
+        """Unknown keys in ``data``; ``allowed`` names extra keys to accept."""
+        return [key for key in data if key not in self.fields and key not in allowed]
+
+    def exists(self, conn, row_id: int) -> bool:
+        return conn.execute(f'SELECT 1 FROM {self.table} WHERE id = ?', (row_id,)).fetchone() is not None
+
+    def get(self, conn, row_id: int) -> Optional[dict]:
+        row = conn.execute(f'SELECT * FROM {self.table} WHERE id = ?', (row_id,)).fetchone()
+        return dict(row) if row else None
+
+    def insert(self, conn, data: dict) -> int:
+        columns = [field for field in self.fields if field in data]
+        return conn.execute(
+            f"INSERT INTO {self.table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))}) RETURNING id",
+            [data[column] for column in columns]
+        ).fetchone()[0]
+
+    def update(self, conn, row_id: int, data: dict) -> bool:
+        """Set the given columns on one row; False if there is no such row."""
+        columns = [field for field in self.fields if field in data]
+        cursor = conn.execute(
+            f"UPDATE {self.table} SET {', '.join(f'{column} = ?' for column in columns)} WHERE id = ?",
+            [data[column] for column in columns] + [row_id]
+        )
+        return cursor.rowcount > 0
+
+    def update_many(self, conn, row_ids: Sequence[int], data: dict) -> int:
+        columns = [field for field in self.fields if field in data]
+        assignments = ', '.join(f'{column} = ?' for column in columns)
+        values = [data[column] for column in columns]
+        updated = 0
+        for chunk in _chunks(list(row_ids)):
+            updated += conn.execute(
+                f"UPDATE {self.table} SET {assignments} WHERE id IN ({', '.join('?' * len(chunk))})",
+                values + list(chunk)
+            ).rowcount
+        return updated
+
+    def delete(self, conn, row_id: int) -> bool:
+        return conn.execute(f'DELETE FROM {self.table} WHERE id = ?', (row_id,)).rowcount > 0
+
+    def page(
+        self,
+        conn,
+        fields: List[str],
+        conditions: List[str],
+        params: list,
+        sort: str,
+        order: str,
+        cursor: Optional[str],
+        limit: int,
+    ) -> Tuple[list, List[str]]:
+        """Rows of one list page and their columns, for listing.encode_page()."""
+        sql, params, selected = build_list_query(self.table, fields, conditions, params, sort, order, cursor, limit)
+        return conn.execute(sql, params).fetchall(), selected
+
+    def changes(self, conn, fields: List[str], since: int, conditions: List[str], params: list, limit: int) -> dict:
+        return changes_since(conn, self.kind, fields, since, conditions, params, limit)
+
+    def count_by(self, conn, column: str) -> Dict[object, int]:
+        if column not in self.fields:
+            raise ValueError(f"Unknown column: {column}")
+        return {row[0]: row[1] for row in conn.execute(f'SELECT {column}, COUNT(*) FROM {self.table} GROUP BY {column}')}
+
+    def upsert_many(self, conn, rows: List[dict]) -> dict:
+        """Insert rows without an id; insert or update rows with one.
+
+        An update only touches the columns the row carries, so existing
+        rows are updated with UPDATE: an INSERT of a partial row would
+        fail its NOT NULL checks before ON CONFLICT is considered. Rows are
+        grouped by kind and column set so each group is one executemany.
+        """
+        ids = list({row['id'] for row in rows if row.get('id') is not None})
+        existing = set()
+        for chunk in _chunks(ids):
+            existing.update(
+                row[0] for row in conn.execute(
+                    f"SELECT id FROM {self.table} WHERE id IN ({', '.join('?' * len(chunk))})", chunk
+                )
+            )
+
+        groups = {}
+        for row in rows:
+            columns = tuple(field for field in self.fields if field in row)
+            if row.get('id') in existing:
+                kind = 'update'
+            else:
+                kind = 'insert' if row.get('id') is None else 'insert_id'
+            groups.setdefault((kind, columns), []).append(row)
+        for (kind, columns), group in groups.items():
+            if kind == 'update':
+                if columns:
+                    conn.executemany(
+                        f"UPDATE {self.table} SET {', '.join(f'{column} = ?' for column in columns)} WHERE id = ?",
+                        [[row[column] for column in columns] + [row['id']] for row in group]
+                    )
+                continue
+            if kind == 'insert_id':
+                columns = ('id',) + columns
+            sql = f"INSERT INTO {self.table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
+            if kind == 'insert_id':
+                # Covers a row another writer inserted since the lookup above
+                updates = ', '.join(f'{column} = excluded.{column}' for column in columns[1:])
+                sql += f' ON CONFLICT (id) DO UPDATE SET {updates}' if updates else ' ON CONFLICT (id) DO NOTHING'
+            conn.executemany(sql, [[row[column] for column in columns] for row in group])
+
+        if ids and self.dialect == "postgres":
+            # Rows inserted with explicit ids do not move the identity
+            # sequence on, so the next plain insert would collide with them
+            conn.execute(
+                f"SELECT setval(pg_get_serial_sequence('{self.table}', 'id'), "
+                f"(SELECT COALESCE(MAX(id), 1) FROM {self.table}))"
+            )
+        updated = sum(1 for row in rows if row.get('id') in existing)
+        return {"inserted": len(rows) - updated, "updated": updated}
+
+
+class ApplicationRepository(TableRepository):
+    table = 'applications'
+    kind = 'application'
+    fields = ('name', 'description')
+
+    def delete(self, conn, row_id: int) -> bool:
+        # Servers that reference the application are detached first
+        conn.execute('UPDATE servers SET application_id = NULL WHERE application_id = ?', (row_id,))
+        return super().delete(conn, row_id)
+
+    def server_ids(self, conn, app_id: int) -> List[int]:
+        return [row[0] for row in conn.execute('SELECT id FROM servers WHERE application_id = ?', (app_id,))]
+
+
+class ServerRepository(TableRepository):
+    table = 'servers'
+    kind = 'server'
+    fields = (
+        'name', 'type', 'status', 'shutdown_status', 'owner_name', 'owner_contact', 'hostname', 'port',
+        'application_id', 'shutdown_order', 'dependencies',
+    )
+
+    def select(
+        self,
+        conn,
+        columns: Sequence[str],
+        server_id: Optional[int] = None,
+        application_id: Optional[int] = None,
+        assigned: bool = False,
+    ) -> list:
+        """``columns`` of every server, or of those matching the filters.
+
+        ``assigned`` keeps only servers that belong to an application.
+        """
+        conditions, params = [], []
+        if server_id is not None:
+            conditions.append('id = ?')
+            params.append(server_id)
+        if application_id is not None:
+            conditions.append('application_id = ?')
+            params.append(application_id)
+        if assigned:
+            conditions.append('application_id IS NOT NULL')
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+        return conn.execute(f"SELECT {', '.join(columns)} FROM servers {where} ORDER BY id", params).fetchall()
@@ -0,0 +1,134 @@
+import asyncio
+import ipaddress
+import socket
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+from config import (
+    RESOLVER_CACHE_SIZE,
+    RESOLVER_NEGATIVE_TTL,
+    RESOLVER_TIMEOUT,
+    RESOLVER_TTL,
+)
+
+
+class AsyncResolver:
+    """Caching hostname resolver that never blocks the event loop.
+
+    Lookups go through the loop's getaddrinfo (a worker thread), successful
+    answers are kept for ``ttl`` seconds and failures for ``negative_ttl``.
+    The cache is bounded and evicts the least recently used name first.
+    Concurrent lookups of the same name share a single getaddrinfo call.
+    """
+
+    def __init__(
+        self,
+        ttl: float = RESOLVER_TTL,
+        negative_ttl: float = RESOLVER_NEGATIVE_TTL,
+        timeout: float = RESOLVER_TIMEOUT,
+        max_size: int = RESOLVER_CACHE_SIZE,
+    ):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.timeout = timeout
+        self.max_size = max_size
+        # hostname -> (expires_at, addresses, error message)
+        self._cache: "OrderedDict[str, tuple]" = OrderedDict()
+        self._pending: Dict[str, asyncio.Task] = {}
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.failures = 0
+
+    async def resolve(self, hostname: str) -> List[str]:
+        """Return the addresses for hostname, raising socket.gaierror on failure."""
+        if _is_address(hostname):
+            return [hostname]
+
+        entry = self._cache.get(hostname)
+        if entry is not None:
+            expires, addresses, error = entry
+            if expires > time.monotonic():
+                self._cache.move_to_end(hostname)
+                if error is not None:
+                    self.negative_hits += 1
+                    raise socket.gaierror(error)
+                self.hits += 1
+                return addresses
+            del self._cache[hostname]
+
+        task = self._pending.get(hostname)
+        if task is None:
+            self.misses += 1
+            task = asyncio.ensure_future(self._lookup(hostname))
+            self._pending[hostname] = task
+            task.add_done_callback(lambda _: self._pending.pop(hostname, None))
+        else:
+            self.coalesced += 1
+        # Shielded so one cancelled caller does not abort the shared lookup
+        return await asyncio.shield(task)
+
+    async def _lookup(self, hostname: str) -> List[str]:
+        loop = asyncio.get_running_loop()
+        try:
+            infos = await asyncio.wait_for(
+                loop.getaddrinfo(hostname, None, type=socket.SOCK_STREAM),
+                self.timeout,
+            )
+        except asyncio.TimeoutError:
+            error = f"Resolver timeout for {hostname}"
+        except (socket.gaierror, UnicodeError, OSError) as e:
+            error = str(e)
+        else:
+            addresses = list(dict.fromkeys(info[4][0] for info in infos))
+            self._store(hostname, self.ttl, addresses, None)
+            return addresses
+        self.failures += 1
+        self._store(hostname, self.negative_ttl, None, error)
+        raise socket.gaierror(error)
+
+    def _store(self, hostname: str, ttl: float, addresses: Optional[List[str]], error: Optional[str]):
+        self._cache[hostname] = (time.monotonic() + ttl, addresses, error)
+        self._cache.move_to_end(hostname)
+        while len(self._cache) > self.max_size:
+            self._cache.popitem(last=False)
+            self.evictions += 1
+
+    def peek(self, hostname: str) -> Optional[List[str]]:
+        """Cached addresses for hostname, without a lookup or touching counters."""
+        if _is_address(hostname):
+            return [hostname]
+        entry = self._cache.get(hostname)
+        if entry is None or entry[0] <= time.monotonic():
+            return None
+        return entry[1]
+
+    def clear(self):
+        self._cache.clear()
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._cache),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "negative_hits": self.negative_hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "failures": self.failures,
+            "evictions": self.evictions,
+            "in_flight": len(self._pending),
+        }
+
+
+def _is_address(hostname: str) -> bool:
+    try:
+        ipaddress.ip_address(hostname)
+    except ValueError:
+        return False
+    return True
+
+
+resolver = AsyncResolver()
@@ -0,0 +1,159 @@
+import threading
+from typing import Dict, List, Optional, Tuple
+
+# Server statuses that count as up when rolling up an application
+UP_STATUSES = {"online", "degraded"}
+
+# Statuses a probe can report; anything else was set before probing began
+PROBED_STATUSES = UP_STATUSES | {"offline"}
+
+_UP_SQL = ', '.join(f"'{status}'" for status in sorted(UP_STATUSES))
+# Counting with CASE rather than summing the comparison, which PostgreSQL
+# does not allow on booleans
+_COUNT_UP = f"SUM(CASE WHEN s.status IN ({_UP_SQL}) THEN 1 ELSE 0 END)"
+_COUNT_OFFLINE = "SUM(CASE WHEN s.status = 'offline' THEN 1 ELSE 0 END)"
+
+
+def derive_status(online: int, offline: int, total: int) -> Tuple[str, str]:
+    """The one rule used everywhere an application status is derived."""
+    if not total:
+        return "Unknown", "No servers associated"
+    if online == total:
+        return "online", "All servers online"
+    if offline == total:
+        return "offline", "All servers offline"
+    return "partial", f"{online}/{total} servers online"
+
+
+class ApplicationRollup:
+    """Per-application online/offline/total counters kept up to date incrementally.
+
+    Counters are loaded with one grouped query and then adjusted as server
+    statuses change. Only applications whose derived status or message
+    differs from what is stored come out of collect(). Anything that moves
+    servers between applications, or adds and removes them, calls
+    invalidate() and the counters are reloaded on next use.
+
+    load() and collect() run on the database writer thread while probe
+    results keep arriving on the event loop, so all access is locked.
+    Changes that arrive while the counters are not loaded are queued:
+    load() counts the table, and results still buffered in the status
+    writer are not in it yet. The writer takes a mark() when it takes a
+    batch, and load() applies the changes queued after that mark.
+
+    With ``shared`` set, other processes write server statuses too, so the
+    counters can go stale; collect() then recounts the dirty applications
+    from the table before deciding what to write.
+    """
+
+    def __init__(self, shared: bool = False):
+        self.shared = shared
+        # app_id -> [online, offline, total]
+        self._counts: Dict[int, List[int]] = {}
+        # app_id -> (status, message) currently stored in the table
+        self._stored: Dict[int, Tuple[str, str]] = {}
+        self._dirty = set()
+        # (app_id, old status, new status) seen while not loaded
+        self._queued: List[Tuple[int, Optional[str], str]] = []
+        self._lock = threading.Lock()
+        self.loaded = False
+
+    def invalidate(self):
+        self.loaded = False
+
+    def mark(self) -> int:
+        """Position in the queued changes; those before it are in the table once the batch is written."""
+        with self._lock:
+            return len(self._queued)
+
+    def load(self, conn, mark: int):
+        with self._lock:
+            self._load(conn)
+            for change in self._queued[mark:]:
+                self._apply(*change)
+            self._queued = []
+
+    def _load(self, conn):
+        rows = conn.execute(f'''
+            SELECT a.id, a.status, a.test_response, COUNT(s.id),
+                   COALESCE({_COUNT_UP}, 0), COALESCE({_COUNT_OFFLINE}, 0)
+            FROM applications a
+            LEFT JOIN servers s ON s.application_id = a.id
+            GROUP BY a.id
+        ''').fetchall()
+        self._counts = {}
+        self._stored = {}
+        for app_id, status, message, total, online, offline in rows:
+            self._counts[app_id] = [online, offline, total]
+            self._stored[app_id] = (status, message)
+        # Anything whose stored status disagrees with the counts is written
+        # on the next collect()
+        self._dirty = set(self._counts)
+        self.loaded = True
+
+    def server_changed(self, app_id: Optional[int], old_status: Optional[str], new_status: str):
+        if app_id is None or old_status == new_status:
+            return
+        with self._lock:
+            if self.loaded:
+                self._apply(app_id, old_status, new_status)
+            else:
+                self._queued.append((app_id, old_status, new_status))
+
+    def _apply(self, app_id: int, old_status: Optional[str], new_status: str):
+        counts = self._counts.get(app_id)
+        if counts is None:
+            return
+        if old_status in UP_STATUSES:
+            counts[0] -= 1
+        elif old_status == "offline":
+            counts[1] -= 1
+        if new_status in UP_STATUSES:
+            counts[0] += 1
+        elif new_status == "offline":
+            counts[1] += 1
+        self._dirty.add(app_id)
+
+    def status_of(self, app_id: int) -> Tuple[str, str]:
+        counts = self._counts.get(app_id)
+        if counts is None:
+            return derive_status(0, 0, 0)
+        return derive_status(*counts)
+
+    def _recount(self, conn, app_ids: List[int]):
+        for start in range(0, len(app_ids), 500):
+            chunk = app_ids[start:start + 500]
+            marks = ', '.join('?' * len(chunk))
+            for app_id in chunk:
+                self._counts.pop(app_id, None)
+                self._stored.pop(app_id, None)
+            for app_id, status, message in conn.execute(
+                f'SELECT id, status, test_response FROM applications WHERE id IN ({marks})', chunk
+            ):
+                self._counts[app_id] = [0, 0, 0]
+                self._stored[app_id] = (status, message)
+            for app_id, total, online, offline in conn.execute(f'''
+                SELECT s.application_id, COUNT(*), {_COUNT_UP}, {_COUNT_OFFLINE}
+                FROM servers s WHERE s.application_id IN ({marks})
+                GROUP BY s.application_id
+            ''', chunk):
+                if app_id in self._counts:
+                    self._counts[app_id] = [online, offline, total]
+
+    def collect(self, conn=None) -> List[Tuple[int, str, str]]:
+        """(app_id, status, message) for every application that needs a write."""
+        changes = []
+        with self._lock:
+            if self.shared and conn is not None and self._dirty:
+                self._recount(conn, list(self._dirty))
+            for app_id in self._dirty:
+                derived = self.status_of(app_id)
+                if self._stored.get(app_id) != derived:
+                    self._stored[app_id] = derived
+                    changes.append((app_id, *derived))
+            self._dirty.clear()
+        return changes
+
+    def snapshot(self) -> Dict[int, Tuple[str, str]]:
+        with self._lock:
+            return {app_id: self.status_of(app_id) for app_id in self._counts}
@@ -0,0 +1,214 @@
+from typing import List, Tuple
+
+from config import SEARCH_CANDIDATES
+from listing import SERVER_COLUMNS, prefix_range
+
+# Shortest term the trigram index can look up; shorter queries fall back
+# to a prefix match on name and hostname
+MIN_TRIGRAM_TERM = 3
+MAX_TERMS = 8
+
+# Columns whose lowercased prefix finds candidates, through lower() indexes
+PREFIX_COLUMNS = ('name', 'hostname')
+
+# Searchable server text: the columns plus the application's name
+SEARCH_COLUMNS = ('s.name', 's.hostname', 's.owner_name', 's.owner_contact', 'a.name')
+
+SQLITE_SEARCH_SCHEMA = '''
+CREATE VIRTUAL TABLE servers_search USING fts5(
+    name, hostname, owner_name, owner_contact, application, tokenize = 'trigram'
+);
+
+INSERT INTO servers_search (rowid, name, hostname, owner_name, owner_contact, application)
+SELECT s.id, s.name, s.hostname, s.owner_name, s.owner_contact, a.name
+FROM servers s LEFT JOIN applications a ON a.id = s.application_id;
+
+-- Bulk inserts that reserve their row versions skip this trigger, as
+-- they skip the version stamp, and call index_servers_after() instead
+CREATE TRIGGER servers_search_insert AFTER INSERT ON servers
+WHEN new.row_version = 0
+BEGIN
+    INSERT INTO servers_search (rowid, name, hostname, owner_name, owner_contact, application)
+    VALUES (
+        new.id, new.name, new.hostname, new.owner_name, new.owner_contact,
+        (SELECT name FROM applications WHERE id = new.application_id)
+    );
+END;
+
+-- Status writes, by far the most frequent update, leave the index alone
+CREATE TRIGGER servers_search_update
+AFTER UPDATE OF name, hostname, owner_name, owner_contact, application_id ON servers BEGIN
+    UPDATE servers_search SET
+        name = new.name, hostname = new.hostname, owner_name = new.owner_name,
+        owner_contact = new.owner_contact,
+        application = (SELECT name FROM applications WHERE id = new.application_id)
+    WHERE rowid = old.id;
+END;
+
+CREATE TRIGGER servers_search_delete AFTER DELETE ON servers BEGIN
+    DELETE FROM servers_search WHERE rowid = old.id;
+END;
+
+CREATE TRIGGER applications_search_rename AFTER UPDATE OF name ON applications BEGIN
+    UPDATE servers_search SET application = new.name
+    WHERE rowid IN (SELECT id FROM servers WHERE application_id = new.id);
+END;
+'''
+
+
+def create_search_schema(conn, dialect: str):
+    """Index server text for /search.
+
+    SQLite gets an FTS5 trigram table kept current by triggers. PostgreSQL
+    maintains its own indexes, so it gets pg_trgm GIN indexes that serve
+    the same ILIKE '%term%' lookups; where the extension is not available
+    or may not be installed, search still works by scanning.
+    """
+    if dialect != "postgres":
+        for statement in SQLITE_SEARCH_SCHEMA.split(';\n\n'):
+            conn.execute(statement)
+        return
+    if not conn.execute("SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'").fetchone():
+        print("pg_trgm is not available, /search will scan the servers table")
+        return
+    conn.execute('SAVEPOINT search_extension')
+    try:
+        conn.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    except Exception as e:
+        # Typically a role without CREATE on the database
+        conn.execute('ROLLBACK TO SAVEPOINT search_extension')
+        print(f"Could not create pg_trgm, /search will scan the servers table: {e}")
+        return
+    conn.execute('RELEASE SAVEPOINT search_extension')
+    create_search_indexes(conn)
+
+
+def create_search_indexes(conn):
+    """The pg_trgm GIN indexes (PostgreSQL, with the extension installed)."""
+    for column in ('name', 'hostname', 'owner_name', 'owner_contact'):
+        conn.execute(
+            f'CREATE INDEX IF NOT EXISTS idx_servers_search_{column} ON servers USING gin ({column} gin_trgm_ops)'
+        )
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_applications_search_name ON applications USING gin (name gin_trgm_ops)')
+
+
+def create_prefix_indexes(conn):
+    # Terms are lowercased, so the prefix ranges are compared with lower()
+    for column in PREFIX_COLUMNS:
+        conn.execute(f'CREATE INDEX IF NOT EXISTS idx_servers_lower_{column} ON servers (lower({column}))')
+
+
+def index_servers_after(conn, last_id: int):
+    """Index servers with ids above ``last_id`` in one statement (SQLite).
+
+    For bulk inserts that bypass the insert trigger: tokenizing the rows
+    together costs a fraction of doing it row by row.
+    """
+    conn.execute('''
+        INSERT INTO servers_search (rowid, name, hostname, owner_name, owner_contact, application)
+        SELECT s.id, s.name, s.hostname, s.owner_name, s.owner_contact, a.name
+        FROM servers s LEFT JOIN applications a ON a.id = s.application_id
+        WHERE s.id > ?
+    ''', (last_id,))
+
+
+def search_terms(query: str) -> List[str]:
+    return query.lower().split()[:MAX_TERMS]
+
+
+def _like_escape(term: str) -> str:
+    return term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def _contains(column: str, dialect: str) -> str:
+    # ILIKE on the bare column is what the PostgreSQL trigram indexes serve
+    if dialect == "postgres":
+        return f"{column} ILIKE ? ESCAPE '\\'"
+    return f"{column} LIKE ? ESCAPE '\\'"
+
+
+def _score(term: str) -> Tuple[str, list]:
+    """Relevance of one term: exact, then prefix, then substring, by column weight."""
+    contains = f'%{_like_escape(term)}%'
+    prefix = f'{_like_escape(term)}%'
+    parts, params = [], []
+    for column, weight in (('s.name', 10), ('s.hostname', 8)):
+        parts.append(
+            f"CASE WHEN lower({column}) = ? THEN {weight * 10} "
+            f"WHEN lower({column}) LIKE ? ESCAPE '\\' THEN {weight * 5} "
+            f"WHEN lower({column}) LIKE ? ESCAPE '\\' THEN {weight * 2} ELSE 0 END"
+        )
+        params += [term, prefix, contains]
+    for column, weight in (('a.name', 6), ('s.owner_name', 4), ('s.owner_contact', 2)):
+        parts.append(f"CASE WHEN lower({column}) LIKE ? ESCAPE '\\' THEN {weight} ELSE 0 END")
+        params.append(contains)
+    return ' + '.join(parts), params
+
+
+def build_search_query(
+    terms: List[str], limit: int, dialect: str, candidates: int = SEARCH_CANDIDATES
+) -> Tuple[str, list]:
+    """Ranked server search: every term has to appear in one of SEARCH_COLUMNS.
+
+    Scoring every match would make a broad query ("example.com") cost a
+    pass over the table, so the ranking runs over a bounded candidate
+    set instead: up to ``candidates`` servers whose name or hostname
+    starts with the first term in any case, found through lower()
+    indexes, plus
+    up to ``candidates`` substring matches of the longer terms from the
+    trigram index. Exact and prefix hits, which score highest, are always
+    in the set; for a very broad query the substring-only matches ranked
+    are the first ones found.
+    """
+    long_terms = [term for term in terms if len(term) >= MIN_TRIGRAM_TERM]
+    start, end = prefix_range(terms[0])
+    sources = [
+        f'SELECT id FROM (SELECT id FROM servers WHERE lower({column}) >= ? AND lower({column}) < ? LIMIT ?) '
+        f'AS by_{column}'
+        for column in PREFIX_COLUMNS
+    ]
+    params = [start, end, candidates] * len(PREFIX_COLUMNS)
+    if long_terms and dialect == "postgres":
+        matches = ' AND '.join(
+            '(' + ' OR '.join(_contains(column, dialect) for column in SEARCH_COLUMNS) + ')' for _ in long_terms
+        )
+        sources.append(
+            'SELECT id FROM (SELECT s.id FROM servers s LEFT JOIN applications a ON a.id = s.application_id '
+            f'WHERE {matches} LIMIT ?) AS by_text'
+        )
+        for term in long_terms:
+            params += [f'%{_like_escape(term)}%'] * len(SEARCH_COLUMNS)
+        params.append(candidates)
+    elif long_terms:
+        # Trigram phrases: substring matches, case-insensitive
+        sources.append(
+            'SELECT id FROM (SELECT rowid AS id FROM servers_search WHERE servers_search MATCH ? LIMIT ?) AS by_text'
+        )
+        params += [' AND '.join('"' + term.replace('"', '""') + '"' for term in long_terms), candidates]
+
+    conditions = []
+    for term in terms:
+        conditions.append('(' + ' OR '.join(_contains(column, dialect) for column in SEARCH_COLUMNS) + ')')
+        params += [f'%{_like_escape(term)}%'] * len(SEARCH_COLUMNS)
+    scores, score_params = [], []
+    for term in terms:
+        sql, term_params = _score(term)
+        scores.append(sql)
+        score_params += term_params
+    columns = ', '.join(f's.{column}' for column in SERVER_COLUMNS)
+    sql = (
+        f"SELECT {columns}, a.name AS application_name, {' + '.join(scores)} AS score "
+        f"FROM ({' UNION '.join(sources)}) AS candidates JOIN servers s ON s.id = candidates.id "
+        f"LEFT JOIN applications a ON a.id = s.application_id "
+        f"WHERE {' AND '.join(conditions)} ORDER BY score DESC, s.id LIMIT ?"
+    )
+    # Score expressions come first in the statement
+    return sql, score_params + params + [limit]
+
+
+def search_servers(conn, query: str, limit: int, dialect: str = "sqlite") -> List[dict]:
+    terms = search_terms(query)
+    if not terms:
+        return []
+    sql, params = build_search_query(terms, limit, dialect)
+    return [dict(row) for row in conn.execute(sql, params)]
@@ -0,0 +1,132 @@
+import asyncio
+from typing import Dict, Optional, Tuple
+
+from config import STATUS_FLUSH_INTERVAL, STATUS_FLUSH_ROWS
+from db import Database
+from events import BroadcastHub
+from rollup import ApplicationRollup
+
+
+class StatusWriter:
+    """Buffers server status updates and writes them in batches.
+
+    Results whose status and message match the stored row are dropped
+    without touching the database. Everything else is flushed with
+    executemany in a single transaction once ``max_rows`` updates are
+    pending, ``max_delay`` seconds after the first one arrived, or when a
+    sweep calls flush() explicitly. Status transitions are fed to the
+    application rollup, and the applications it reports as changed are
+    written in the same transaction. Once committed, every flush is
+    published on the event hub as one "status" event.
+    """
+
+    def __init__(
+        self,
+        db: Database,
+        rollup: ApplicationRollup,
+        max_rows: int = STATUS_FLUSH_ROWS,
+        max_delay: float = STATUS_FLUSH_INTERVAL,
+        hub: Optional[BroadcastHub] = None,
+    ):
+        self.db = db
+        self.rollup = rollup
+        self.hub = hub
+        self.max_rows = max_rows
+        self.max_delay = max_delay
+        self._servers: Dict[int, Tuple[str, str]] = {}
+        self._lock: Optional[asyncio.Lock] = None
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self.written = 0
+        self.skipped = 0
+        self.flushes = 0
+
+    @property
+    def pending(self) -> int:
+        return len(self._servers)
+
+    def record_server(
+        self,
+        server_id: int,
+        status: str,
+        message: str,
+        previous: Optional[tuple] = None,
+        app_id: Optional[int] = None,
+    ):
+        if previous is not None and tuple(previous) == (status, message):
+            self.skipped += 1
+            return
+        self._servers[server_id] = (status, message)
+        self.rollup.server_changed(app_id, previous[0] if previous else None, status)
+        self._schedule()
+
+    def _schedule(self):
+        if self.pending >= self.max_rows:
+            self._cancel_timer()
+            asyncio.ensure_future(self.flush())
+        elif self._timer is None:
+            loop = asyncio.get_running_loop()
+            self._timer = loop.call_later(self.max_delay, lambda: asyncio.ensure_future(self.flush()))
+
+    def _cancel_timer(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+    async def flush(self):
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            self._cancel_timer()
+            if not self.pending and self.rollup.loaded:
+                return
+            servers, self._servers = self._servers, {}
+            mark = self.rollup.mark()
+            try:
+                applications = await self.db.write(self._write, servers, mark)
+            except Exception as e:
+                # Dropped rows are rewritten by the next sweep, which still
+                # sees the old values in the table
+                print(f"Error flushing status updates: {e}")
+                self.rollup.invalidate()
+                return
+            if servers or applications:
+                self.written += len(servers) + len(applications)
+                self.flushes += 1
+                if self.hub is not None:
+                    self.hub.publish("status", {
+                        "servers": [
+                            {"id": server_id, "status": status, "test_response": message}
+                            for server_id, (status, message) in servers.items()
+                        ],
+                        "applications": [
+                            {"id": app_id, "status": status, "test_response": message}
+                            for app_id, status, message in applications
+                        ],
+                    })
+
+    def _write(self, conn, servers: Dict[int, Tuple[str, str]], mark: int) -> list:
+        # Runs on the database writer thread inside one transaction
+        if servers:
+            conn.executemany(
+                'UPDATE servers SET status = ?, test_response = ? WHERE id = ?',
+                [(status, message, server_id) for server_id, (status, message) in servers.items()]
+            )
+        if not self.rollup.loaded:
+            # Counted after the server rows above so they are included;
+            # results recorded since the batch was taken are not
+            self.rollup.load(conn, mark)
+        applications = self.rollup.collect(conn)
+        if applications:
+            conn.executemany(
+                'UPDATE applications SET status = ?, test_response = ? WHERE id = ?',
+                [(status, message, app_id) for app_id, status, message in applications]
+            )
+        return applications
+
+    def stats(self) -> dict:
+        return {
+            "pending": self.pending,
+            "written": self.written,
+            "skipped": self.skipped,
+            "flushes": self.flushes,
+        }
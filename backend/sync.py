@@ -0,0 +1,198 @@
+import zlib
+from typing import List, Optional
+
+# Tables that carry a row_version, keyed by the kind recorded for deletions
+VERSIONED_TABLES = {'server': 'servers', 'application': 'applications'}
+
+
+def _create_version_tables(cursor):
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS sync_versions (
+        kind TEXT PRIMARY KEY,
+        value INTEGER NOT NULL
+    )
+    ''')
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS deleted_rows (
+        kind TEXT NOT NULL,
+        row_id INTEGER NOT NULL,
+        row_version INTEGER NOT NULL
+    )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_deleted_rows_version ON deleted_rows (kind, row_version)')
+    for kind, table in VERSIONED_TABLES.items():
+        cursor.execute(f'ALTER TABLE {table} ADD COLUMN row_version INTEGER NOT NULL DEFAULT 0')
+        cursor.execute(f'CREATE INDEX IF NOT EXISTS idx_{table}_row_version ON {table} (row_version)')
+        cursor.execute('INSERT INTO sync_versions (kind, value) VALUES (?, 0)', (kind,))
+        # Rows of an upgraded database would otherwise all sit at version
+        # 0, which no changes_since() ever returns
+        version_existing_rows(cursor, kind)
+
+
+def version_existing_rows(conn, kind: str):
+    """Give every row still at version 0 a version of its own, in id order.
+
+    Versions come from reserve_versions(), one per id in the range, so they
+    are unique and above anything a client has seen. Run before the
+    version triggers exist, or with rows the triggers leave alone: the
+    update changes row_version, which they skip.
+    """
+    table = VERSIONED_TABLES[kind]
+    low, high = conn.execute(f'SELECT MIN(id), MAX(id) FROM {table} WHERE row_version = 0').fetchone()
+    if low is None:
+        return
+    first = reserve_versions(conn, kind, high - low + 1)
+    conn.execute(f'UPDATE {table} SET row_version = id + ? WHERE row_version = 0', (first - low,))
+
+
+def create_sync_schema(cursor):
+    """Row versions, a per-table version counter and deletion tombstones.
+
+    Every insert and update stamps the row with the next value of its
+    table's counter, and every delete leaves a tombstone with its own
+    version, so clients can ask for everything after the version they
+    last saw. Bulk inserts can skip the per-row trigger by taking a block
+    of versions from reserve_versions() and inserting them directly.
+    """
+    _create_version_tables(cursor)
+    for kind, table in VERSIONED_TABLES.items():
+        bump = f"UPDATE sync_versions SET value = value + 1 WHERE kind = '{kind}';"
+        stamp = (
+            f"UPDATE {table} SET row_version = (SELECT value FROM sync_versions WHERE kind = '{kind}') "
+            f"WHERE id = NEW.id;"
+        )
+        cursor.execute(f'''
+        CREATE TRIGGER {table}_version_insert AFTER INSERT ON {table}
+        WHEN NEW.row_version = 0
+        BEGIN
+            {bump}
+            {stamp}
+        END
+        ''')
+        # The WHEN clause keeps the trigger's own row_version stamp from
+        # counting as another change
+        cursor.execute(f'''
+        CREATE TRIGGER {table}_version_update AFTER UPDATE ON {table}
+        WHEN NEW.row_version = OLD.row_version
+        BEGIN
+            {bump}
+            {stamp}
+        END
+        ''')
+        cursor.execute(f'''
+        CREATE TRIGGER {table}_version_delete AFTER DELETE ON {table}
+        BEGIN
+            {bump}
+            INSERT INTO deleted_rows (kind, row_id, row_version)
+            SELECT '{kind}', OLD.id, value FROM sync_versions WHERE kind = '{kind}';
+        END
+        ''')
+
+
+def create_sync_schema_postgres(cursor):
+    """create_sync_schema() for PostgreSQL, with PL/pgSQL trigger functions.
+
+    The counter row is locked by the UPDATE until the transaction commits,
+    so with several writers versions still become visible in order and a
+    client can never skip past a version that commits later.
+    """
+    _create_version_tables(cursor)
+    for kind, table in VERSIONED_TABLES.items():
+        # A BEFORE trigger stamps the row being written, so unlike SQLite
+        # no second UPDATE is needed
+        cursor.execute(f'''
+        CREATE FUNCTION {table}_version_stamp() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP = 'INSERT' AND NEW.row_version <> 0 THEN
+                RETURN NEW;
+            END IF;
+            IF TG_OP = 'UPDATE' AND NEW.row_version <> OLD.row_version THEN
+                RETURN NEW;
+            END IF;
+            UPDATE sync_versions SET value = value + 1 WHERE kind = '{kind}' RETURNING value INTO NEW.row_version;
+            RETURN NEW;
+        END
+        $$ LANGUAGE plpgsql
+        ''')
+        cursor.execute(f'''
+        CREATE FUNCTION {table}_version_delete() RETURNS trigger AS $$
+        BEGIN
+            WITH bumped AS (
+                UPDATE sync_versions SET value = value + 1 WHERE kind = '{kind}' RETURNING value
+            )
+            INSERT INTO deleted_rows (kind, row_id, row_version)
+            SELECT '{kind}', OLD.id, value FROM bumped;
+            RETURN OLD;
+        END
+        $$ LANGUAGE plpgsql
+        ''')
+        cursor.execute(f'''
+        CREATE TRIGGER {table}_version_stamp BEFORE INSERT OR UPDATE ON {table}
+        FOR EACH ROW EXECUTE FUNCTION {table}_version_stamp()
+        ''')
+        cursor.execute(f'''
+        CREATE TRIGGER {table}_version_delete AFTER DELETE ON {table}
+        FOR EACH ROW EXECUTE FUNCTION {table}_version_delete()
+        ''')
+
+
+def current_version(conn, kind: str) -> int:
+    row = conn.execute('SELECT value FROM sync_versions WHERE kind = ?', (kind,)).fetchone()
+    return row[0] if row else 0
+
+
+def reserve_versions(conn, kind: str, count: int) -> int:
+    """Take ``count`` consecutive versions for rows inserted in this transaction; returns the first."""
+    conn.execute('UPDATE sync_versions SET value = value + ? WHERE kind = ?', (count, kind))
+    return current_version(conn, kind) - count + 1
+
+
+def changes_since(
+    conn,
+    kind: str,
+    fields: List[str],
+    since: int,
+    conditions: List[str],
+    params: list,
+    limit: int,
+) -> dict:
+    """Rows changed and ids deleted after ``since``, oldest change first.
+
+    At most ``limit`` changed rows are returned. When more are waiting,
+    ``version`` stops at the last row returned and ``more`` is set, so the
+    client continues with since=version.
+    """
+    table = VERSIONED_TABLES[kind]
+    selected = list(dict.fromkeys(['id', 'row_version'] + fields))
+    where = ' AND '.join(['row_version > ?'] + conditions)
+    # One read transaction so the counter, rows and tombstones agree
+    conn.execute('BEGIN')
+    try:
+        version = current_version(conn, kind)
+        rows = conn.execute(
+            f"SELECT {', '.join(selected)} FROM {table} WHERE {where} ORDER BY row_version LIMIT ?",
+            [since] + params + [limit + 1]
+        ).fetchall()
+        more = len(rows) > limit
+        rows = rows[:limit]
+        if more:
+            version = rows[-1][1]
+        deleted = [
+            row[0] for row in conn.execute(
+                'SELECT row_id FROM deleted_rows WHERE kind = ? AND row_version > ? AND row_version <= ? '
+                'ORDER BY row_version',
+                (kind, since, version)
+            )
+        ]
+    finally:
+        conn.execute('COMMIT')
+    items = []
+    for row in rows:
+        record = dict(zip(selected, row))
+        items.append({field: record[field] for field in fields})
+    return {"items": items, "deleted": deleted, "version": version, "more": more}
+
+
+def make_etag(version: int, query: Optional[str]) -> str:
+    # The same version serves different pages, so the query is part of the tag
+    return f'W/"{version}-{zlib.crc32((query or "").encode()):08x}"'
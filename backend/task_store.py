@@ -0,0 +1,230 @@
+import asyncio
+import hashlib
+import os
+import socket
+import time
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Dict, Hashable, List, Optional
+
+import orjson
+
+from config import JOB_HISTORY, JOB_STALE_AFTER, JOB_SYNC_INTERVAL
+from db import Database
+
+ACTIVE_STATES = ('pending', 'running')
+
+
+def create_task_schema(conn, dialect: str):
+    id_column = (
+        'id INTEGER GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY' if dialect == "postgres"
+        else 'id INTEGER PRIMARY KEY AUTOINCREMENT'
+    )
+    real = 'DOUBLE PRECISION' if dialect == "postgres" else 'REAL'
+    conn.execute(f'''
+    CREATE TABLE task_states (
+        {id_column},
+        category TEXT NOT NULL,
+        kind TEXT NOT NULL,
+        task_key TEXT,
+        state TEXT NOT NULL,
+        progress TEXT NOT NULL,
+        owner TEXT NOT NULL,
+        cancel_requested INTEGER NOT NULL DEFAULT 0,
+        created_at {real} NOT NULL,
+        updated_at {real} NOT NULL
+    )
+    ''')
+    conn.execute('CREATE INDEX idx_task_states_category ON task_states (category, state)')
+    conn.execute('''
+    CREATE TABLE task_results (
+        task_id INTEGER NOT NULL,
+        seq INTEGER NOT NULL,
+        item TEXT NOT NULL,
+        PRIMARY KEY (task_id, seq)
+    )
+    ''')
+
+
+def key_digest(key: Optional[Hashable]) -> Optional[str]:
+    """A stable text form of a coalescing key, the same in every process."""
+    if key is None:
+        return None
+    if isinstance(key, (set, frozenset)):
+        key = sorted(key)
+    return hashlib.sha1(repr(key).encode()).hexdigest()
+
+
+class TaskStore:
+    """Long-running tasks of one category (jobs, orchestrations) in the shared database.
+
+    A task runs in the process that accepted it, but with several API
+    workers the client's next request can land on any of them. So the
+    owning process registers each task here, which gives it an id unique
+    across processes, and every ``interval`` writes the progress of its
+    running tasks and their new results. Any worker can then answer for a
+    task from the table and request its cancellation; the owner picks the
+    request up on its next sync.
+
+    Syncs double as heartbeats: a task still pending or running whose row
+    has not been written for ``stale_after`` seconds belonged to a process
+    that stopped, and is reported as 'lost'.
+    """
+
+    def __init__(
+        self,
+        db: Database,
+        category: str,
+        interval: float = JOB_SYNC_INTERVAL,
+        stale_after: float = JOB_STALE_AFTER,
+        history: int = JOB_HISTORY,
+    ):
+        self.db = db
+        self.category = category
+        self.interval = interval
+        self.stale_after = stale_after
+        self.history = history
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        # id -> task; tasks have id, state, progress() and cancel(), and
+        # may have a results list
+        self.local: "OrderedDict[int, Any]" = OrderedDict()
+        self._saved_results: Dict[int, int] = {}
+
+    # Owning process
+
+    async def create(self, kind: str, key: Optional[Hashable] = None) -> int:
+        return await self.db.write(self._create, kind, key_digest(key))
+
+    def _create(self, conn, kind: str, digest: Optional[str]) -> int:
+        now = time.time()
+        return conn.execute(
+            'INSERT INTO task_states (category, kind, task_key, state, progress, owner, created_at, updated_at) '
+            "VALUES (?, ?, ?, 'pending', '{}', ?, ?, ?) RETURNING id",
+            (self.category, kind, digest, self.owner, now, now)
+        ).fetchone()[0]
+
+    def track(self, task):
+        self.local[task.id] = task
+        self._saved_results[task.id] = 0
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.sync()
+            except Exception as e:
+                print(f"Error saving {self.category} progress: {e}")
+
+    async def sync(self):
+        """Write the tracked tasks' progress; cancel those another worker asked to stop."""
+        if not self.local:
+            return
+        snapshots = []
+        for task_id, task in list(self.local.items()):
+            results = getattr(task, 'results', None) or []
+            saved = self._saved_results[task_id]
+            items = [(task_id, saved + offset, orjson.dumps(item).decode()) for offset, item in enumerate(results[saved:])]
+            snapshots.append((task_id, task.state, orjson.dumps(task.progress()).decode(), items))
+        cancelled = await self.db.write(self._save, snapshots)
+        for task_id, state, _, items in snapshots:
+            self._saved_results[task_id] += len(items)
+            if state not in ACTIVE_STATES:
+                # Its final state is written; the table answers from now on
+                del self.local[task_id]
+                del self._saved_results[task_id]
+            elif task_id in cancelled:
+                self.local[task_id].cancel()
+
+    def _save(self, conn, snapshots: list) -> set:
+        now = time.time()
+        for task_id, state, progress, items in snapshots:
+            conn.execute(
+                'UPDATE task_states SET state = ?, progress = ?, updated_at = ? WHERE id = ?',
+                (state, progress, now, task_id)
+            )
+            if items:
+                conn.executemany('INSERT INTO task_results (task_id, seq, item) VALUES (?, ?, ?)', items)
+        ids = [snapshot[0] for snapshot in snapshots]
+        cancelled = {
+            row[0] for row in conn.execute(
+                f"SELECT id FROM task_states WHERE cancel_requested = 1 AND id IN ({', '.join('?' * len(ids))})",
+                ids
+            )
+        }
+        self._trim(conn)
+        return cancelled
+
+    def _trim(self, conn):
+        # Finished tasks beyond the history, oldest first, with their results
+        finished = [
+            row[0] for row in conn.execute(
+                "SELECT id FROM task_states WHERE category = ? AND state NOT IN ('pending', 'running') "
+                'ORDER BY id DESC',
+                (self.category,)
+            )
+        ]
+        for task_id in finished[self.history:]:
+            conn.execute('DELETE FROM task_results WHERE task_id = ?', (task_id,))
+            conn.execute('DELETE FROM task_states WHERE id = ?', (task_id,))
+
+    # Any process
+
+    def _record(self, row) -> dict:
+        progress = orjson.loads(row['progress']) if row['progress'] != '{}' else {}
+        state = row['state']
+        error = progress.get('error')
+        if state in ACTIVE_STATES and time.time() - row['updated_at'] > self.stale_after:
+            state = 'lost'
+            error = "The process running this task stopped"
+        return {**progress, "id": row['id'], "kind": row['kind'], "state": state, "error": error}
+
+    async def get(self, task_id: int) -> Optional[dict]:
+        row = await self.db.fetchone(
+            'SELECT * FROM task_states WHERE id = ? AND category = ?', (task_id, self.category)
+        )
+        return self._record(row) if row is not None else None
+
+    async def list(self) -> List[dict]:
+        rows = await self.db.fetchall('SELECT * FROM task_states WHERE category = ? ORDER BY id', (self.category,))
+        return [self._record(row) for row in rows]
+
+    async def results(self, task_id: int, offset: int, limit: int) -> List[Any]:
+        rows = await self.db.fetchall(
+            'SELECT item FROM task_results WHERE task_id = ? AND seq >= ? ORDER BY seq LIMIT ?',
+            (task_id, offset, limit)
+        )
+        return [orjson.loads(row[0]) for row in rows]
+
+    async def stream(self, task_id: int, offset: int = 0, batch: int = 1000) -> AsyncIterator[bytes]:
+        """Results as NDJSON from ``offset``, polling the table until the task ends."""
+        while True:
+            record = await self.get(task_id)
+            results = await self.results(task_id, offset, batch)
+            if results:
+                offset += len(results)
+                yield b''.join(orjson.dumps(item) + b'\n' for item in results)
+                continue
+            if record is None or record['state'] not in ACTIVE_STATES:
+                return
+            await asyncio.sleep(self.interval)
+
+    async def find_active(self, kind: Optional[str] = None, key: Optional[Hashable] = None) -> Optional[dict]:
+        """A live pending or running task, of ``kind`` and ``key`` when given."""
+        conditions, params = ['category = ?', "state IN ('pending', 'running')", 'updated_at > ?'], [
+            self.category, time.time() - self.stale_after
+        ]
+        if kind is not None:
+            conditions.append('kind = ?')
+            params.append(kind)
+        if key is not None:
+            conditions.append('task_key = ?')
+            params.append(key_digest(key))
+        row = await self.db.fetchone(
+            f"SELECT * FROM task_states WHERE {' AND '.join(conditions)} ORDER BY id LIMIT 1", tuple(params)
+        )
+        return self._record(row) if row is not None else None
+
+    async def request_cancel(self, task_id: int) -> bool:
+        cursor = await self.db.execute(
+            'UPDATE task_states SET cancel_requested = 1 WHERE id = ? AND category = ?', (task_id, self.category)
+        )
+        return cursor.rowcount > 0
@@ -0,0 +1,76 @@
+import atexit
+import os
+import shutil
+import sys
+import tempfile
+
+import pytest
+
+# The backend modules are imported as top-level modules, as uvicorn does
+# when run from the backend directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# The app (see the client fixture) keeps its databases in a scratch
+# directory, never in a configured one; config reads these on import
+APP_DIR = tempfile.mkdtemp(prefix="dcmon-tests-")
+atexit.register(shutil.rmtree, APP_DIR, True)
+os.environ["DCMON_DB_PATH"] = os.path.join(APP_DIR, "servers.db")
+os.environ["DCMON_HISTORY_DB_PATH"] = os.path.join(APP_DIR, "history.db")
+os.environ.pop("DCMON_DATABASE_URL", None)
+os.environ["DCMON_PROBE_LOOP"] = "0"
+
+from db import Database  # noqa: E402
+from migrations import migrate  # noqa: E402
+
+# PostgreSQL cases run against this server and are skipped without it, e.g.
+# DCMON_TEST_DATABASE_URL=postgresql://postgres@/dcmon_test?host=/tmp/pgdata
+TEST_DATABASE_URL = os.environ.get("DCMON_TEST_DATABASE_URL", "")
+
+
+def postgres_database():
+    if not TEST_DATABASE_URL:
+        pytest.skip("DCMON_TEST_DATABASE_URL is not set")
+    try:
+        from pg import PostgresDatabase
+    except ImportError:
+        pytest.skip("psycopg2 is not installed")
+    database = PostgresDatabase(TEST_DATABASE_URL)
+    try:
+        conn = database.connect()
+    except database.Error as e:
+        pytest.skip(f"PostgreSQL is not available: {e}")
+    # Every test starts from an empty database
+    conn.execute('DROP SCHEMA public CASCADE')
+    conn.execute('CREATE SCHEMA public')
+    conn.close()
+    return database
+
+
+@pytest.fixture
+def sqlite_db(tmp_path):
+    database = Database(str(tmp_path / "servers.db"))
+    yield database
+    database.close()
+
+
+@pytest.fixture(params=["sqlite", "postgres"])
+def database(request, tmp_path):
+    """A migrated, open Database of each dialect."""
+    if request.param == "sqlite":
+        database = Database(str(tmp_path / "servers.db"))
+    else:
+        database = postgres_database()
+    migrate(database)
+    database.open()
+    yield database
+    database.close()
+
+
+@pytest.fixture
+def client():
+    """The API on a SQLite database shared by the session's tests."""
+    from fastapi.testclient import TestClient
+
+    import main
+    with TestClient(main.app) as client:
+        yield client
@@ -0,0 +1,40 @@
+import asyncio
+import time
+
+from history import HistoryStore, servers_selector
+from migrations import migrate
+from repository import ApplicationRepository, ServerRepository
+
+# Past SQLite's default limit of 32766 bound parameters
+MANY_IDS = 40000
+
+
+def test_application_history_selectors(sqlite_db):
+    # History is always kept in SQLite, with the inventory or on its own
+    database = sqlite_db
+    migrate(database)
+    database.open()
+    conn = database.connect()
+    app_id = ApplicationRepository().insert(conn, {"name": "shop", "description": ""})
+    servers = ServerRepository()
+    in_app = [
+        servers.insert(conn, {"name": f"web{i}", "type": "WEB", "application_id": app_id}) for i in range(3)
+    ]
+    other = servers.insert(conn, {"name": "other", "type": "WEB"})
+    conn.close()
+
+    store = HistoryStore(database)
+    now = time.time()
+    for server_id in in_app + [other]:
+        store.record(server_id, {"status": "online", "latency_ms": 5.0}, now - 60)
+    store.record(in_app[0], {"status": "offline", "error": "timeout"}, now - 30)
+
+    async def query(selector, params):
+        return await store.query(selector, params, None, None)
+
+    subquery = asyncio.run(query('server_id IN (SELECT id FROM servers WHERE application_id = ?)', (app_id,)))
+    listed = asyncio.run(query(*servers_selector(in_app + list(range(other + 1, other + MANY_IDS)))))
+    for summary in (subquery, listed):
+        assert summary["samples"] == 4
+        assert summary["uptime_pct"] == 75.0
+    assert asyncio.run(query(*servers_selector([])))["samples"] == 0
@@ -0,0 +1,89 @@
+import asyncio
+import io
+
+from importer import KEPT_INDEXES, CsvImporter, decoded_lines
+from migrations import ensure_schema
+
+
+def csv_upload(rows: int) -> io.BytesIO:
+    lines = ["name,type,team,host,port,application"]
+    lines += [f"shop_web{i},WEB,ops,web{i}.example.com,80,shop" for i in range(rows)]
+    return io.BytesIO("\n".join(lines).encode())
+
+
+def index_names(database, importer: CsvImporter) -> set:
+    return {name for name, _ in asyncio.run(database.read(importer._server_indexes))}
+
+
+def test_large_import_rebuilds_the_indexes_it_drops(database):
+    importer = CsvImporter(database, chunk_rows=50, rebuild_index_rows=100)
+    before = index_names(database, importer)
+    assert set(KEPT_INDEXES) < before
+    during = []
+    import_chunk = importer._import_chunk
+
+    def record_indexes(conn, *args):
+        during.append({name for name, _ in importer._server_indexes(conn)})
+        return import_chunk(conn, *args)
+    importer._import_chunk = record_indexes
+
+    summary = asyncio.run(importer.run(csv_upload(500)))
+    assert summary.imported == 500
+    # Dropped after the first chunk, all but the change feed's
+    assert during[0] == before
+    assert during[-1] == set(KEPT_INDEXES)
+    assert index_names(database, importer) == before
+
+
+def test_indexes_left_dropped_are_restored_on_start(database):
+    importer = CsvImporter(database)
+    before = index_names(database, importer)
+    # An import that died before its rebuild
+    dropped = asyncio.run(database.write(importer._drop_indexes, 10 ** 6))
+    assert dropped
+    assert index_names(database, importer) == set(KEPT_INDEXES)
+
+    assert ensure_schema(database) is None
+    assert index_names(database, importer) == before
+    # The import's own rebuild skips what is back already
+    asyncio.run(database.write(importer._create_indexes, dropped))
+    assert index_names(database, importer) == before
+
+
+class BareUpload:
+    """read, seek and tell only, as SpooledTemporaryFile before Python 3.11."""
+
+    def __init__(self, data: bytes):
+        self._file = io.BytesIO(data)
+        self.read = self._file.read
+        self.seek = self._file.seek
+        self.tell = self._file.tell
+
+
+def test_decoded_lines_across_chunks():
+    text = '\ufeffname,team\r\n"db\r\n1",Zoë\rweb,ops\nlast,é'
+    for chunk_bytes in (1, 2, 3, 7, 1024):
+        lines = list(decoded_lines(BareUpload(text.encode()), chunk_bytes))
+        assert lines == ['name,team\r\n', '"db\r\n', '1",Zoë\r', 'web,ops\n', 'last,é']
+
+
+def test_import_from_an_upload_without_readable(database):
+    upload = BareUpload('\ufeffname,type,team,host\r\nshop_db1,DB_MYSQL,Zoë,db1\r\n'.encode())
+    summary = asyncio.run(CsvImporter(database).run(upload))
+    assert summary.as_dict()["imported"] == 1
+
+
+def test_import_csv_endpoint(client):
+    data = '\ufeffname,type,team,host,port,application\r\n' + ''.join(
+        f'csvtest_web{i},WEB,Zoë,web{i}.example.com,80,csvtest\r\n' for i in range(3)
+    ) + 'csvtest_bad,NOPE,ops,bad,80,csvtest\r\n'
+    response = client.post('/servers/import-csv', files={'file': ('servers.csv', data.encode(), 'text/csv')})
+    assert response.status_code == 200
+    summary = response.json()
+    assert (summary["imported"], summary["failed"]) == (3, 1)
+    servers = client.get('/search', params={'q': 'csvtest_web', 'limit': 10}).json()["items"]
+    assert sorted(server["name"] for server in servers) == [f"csvtest_web{i}" for i in range(3)]
+    assert {server["owner_name"] for server in servers} == {"Zoë"}
+
+    response = client.post('/servers/import-csv', files={'file': ('bad.csv', b'name\n\xff\xfe', 'text/csv')})
+    assert response.status_code == 400
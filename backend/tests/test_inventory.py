@@ -0,0 +1,72 @@
+import asyncio
+import random
+
+import orjson
+
+from inventory import ServerRecord, TableCache
+from listing import SERVER_COLUMNS, build_list_query, encode_page
+
+FIELDS = list(SERVER_COLUMNS)
+
+
+def insert_servers(conn, count: int, rng: random.Random):
+    conn.executemany(
+        'INSERT INTO servers (name, type, hostname, owner_name, port) VALUES (?, ?, ?, ?, ?)',
+        [
+            (f"server{rng.randrange(50):02d}", "WEB", f"host{i:04d}", rng.choice([None, "ops", "dba", "web"]), 80)
+            for i in range(count)
+        ],
+    )
+
+
+def change_servers(conn, rng: random.Random):
+    ids = [row[0] for row in conn.execute('SELECT id FROM servers')]
+    for server_id in rng.sample(ids, 20):
+        conn.execute(
+            'UPDATE servers SET name = ?, owner_name = ? WHERE id = ?',
+            (f"server{rng.randrange(50):02d}", rng.choice([None, "ops", "net"]), server_id)
+        )
+    for server_id in rng.sample(ids, 5):
+        conn.execute('DELETE FROM servers WHERE id = ?', (server_id,))
+    insert_servers(conn, 10, rng)
+
+
+def database_pages(conn, sort: str, order: str, limit: int) -> list:
+    pages, cursor = [], None
+    while True:
+        sql, params, selected = build_list_query('servers', FIELDS, [], [], sort, order, cursor, limit)
+        page = orjson.loads(encode_page(conn.execute(sql, params).fetchall(), selected, FIELDS, sort, limit))
+        pages.append(page)
+        cursor = page["next_cursor"]
+        if not cursor:
+            return pages
+
+
+def cache_pages(cache: TableCache, sort: str, order: str, limit: int) -> list:
+    pages, cursor = [], None
+    while True:
+        page = orjson.loads(cache.page(FIELDS, {}, sort, order, cursor, limit))
+        pages.append(page)
+        cursor = page["next_cursor"]
+        if not cursor:
+            return pages
+
+
+def test_cache_pages_match_the_database_after_changes(database):
+    rng = random.Random(4)
+    cache = TableCache(database, 'server', ServerRecord, shared=True)
+    conn = database.connect()
+    try:
+        insert_servers(conn, 200, rng)
+        asyncio.run(cache.sync())
+        # Build the sort orders, so the changes below patch them in place
+        for sort in ('id', 'name', 'owner_name'):
+            cache.order(sort)
+        change_servers(conn, rng)
+        asyncio.run(cache.sync())
+        assert len(cache.records) == 205
+        for sort in ('id', 'name', 'owner_name'):
+            for order in ('asc', 'desc'):
+                assert cache_pages(cache, sort, order, 15) == database_pages(conn, sort, order, 15)
+    finally:
+        conn.close()
@@ -0,0 +1,153 @@
+import asyncio
+import math
+import socket
+
+from jobs import JobManager
+import probes
+from probes import PROBE_CANCELLED, ProbeScheduler, ProbeTarget
+from task_store import TaskStore
+
+
+def slow_scheduler(delay: float) -> ProbeScheduler:
+    async def probe(hostname, port, server_type, address=None):
+        await asyncio.sleep(delay)
+        return {"status": "online", "message": "ok"}
+    # Numeric hostnames, so nothing is looked up
+    return ProbeScheduler(sweep_deadline=0.05, probe=probe)
+
+
+TARGETS = [ProbeTarget(i, f"127.0.0.{i}", 22, "SSH") for i in range(1, 6)]
+
+
+def cancelled() -> float:
+    return sum(sample[-1] for sample in PROBE_CANCELLED.samples())
+
+
+def test_scheduler_without_deadline_probes_everything(capsys):
+    before = cancelled()
+
+    async def main():
+        scheduler = slow_scheduler(0.2)
+        cut_short = await scheduler.run(TARGETS)
+        complete = await scheduler.run(TARGETS, deadline=math.inf)
+        return cut_short, complete
+    cut_short, complete = asyncio.run(main())
+    assert cut_short == {}
+    assert sorted(complete) == [target.id for target in TARGETS]
+    # Counted, not printed
+    assert cancelled() - before == len(TARGETS)
+    assert capsys.readouterr().out == ""
+
+
+def test_unresolved_target_has_a_latency(monkeypatch):
+    async def resolve(hostname):
+        await asyncio.sleep(0.01)
+        raise socket.gaierror(hostname)
+    monkeypatch.setattr(probes.resolver, "resolve", resolve)
+    target = ProbeTarget(1, "missing.example.com", 22, "SSH")
+    result = asyncio.run(slow_scheduler(0).run([target], deadline=math.inf))[1]
+    assert result["error"] == "dns"
+    assert result["latency_ms"] >= 10
+
+
+def run_job(total: int, processed: int):
+    async def main():
+        async def work(job):
+            for i in range(processed):
+                job.add({"id": i})
+            return {"processed": processed}
+        manager = JobManager()
+        progress, started = await manager.submit("test", total, work)
+        job = manager.get(progress["id"])
+        await job.task
+        return job
+    return asyncio.run(main())
+
+
+def test_job_that_processes_everything_completes():
+    job = run_job(3, 3)
+    assert job.state == 'completed'
+    assert job.error is None
+
+
+def test_job_that_leaves_items_is_incomplete():
+    job = run_job(10, 4)
+    assert job.state == 'incomplete'
+    assert job.error == "6 of 10 items were not processed"
+    assert job.summary == {"processed": 4}
+
+
+def test_jobs_are_shared_between_workers(database):
+    # Two API workers: each its own manager and store over one database
+    async def main():
+        first = JobManager(store=TaskStore(database, 'job', interval=0.01))
+        second = JobManager(store=TaskStore(database, 'job', interval=0.01))
+        release = asyncio.Event()
+
+        async def work(job):
+            job.add({"id": 1})
+            job.add({"id": 2})
+            await release.wait()
+            job.add({"id": 3})
+            return {"message": "done"}
+
+        progress, started = await first.submit("sweep", 3, work, key=frozenset({1, 2, 3}))
+        job_id = progress["id"]
+        await asyncio.sleep(0)
+        await first.store.sync()
+
+        seen = await second.progress(job_id, offset=0)
+        assert seen["state"] == 'running'
+        assert seen["results"] == [{"id": 1}, {"id": 2}]
+        # The same sweep submitted to the other worker joins the running one
+        joined, started = await second.submit("sweep", 3, work, key=frozenset({3, 2, 1}))
+        assert (joined["id"], started) == (job_id, False)
+
+        streamed = asyncio.create_task(collect(await second.stream(job_id)))
+        release.set()
+        await first.jobs[job_id].task
+        await first.store.sync()
+        finished = await second.progress(job_id)
+        assert (finished["state"], finished["done"], finished["summary"]) == ('completed', 3, {"message": "done"})
+        assert await streamed == b'{"id":1}\n{"id":2}\n{"id":3}\n'
+
+        assert await second.progress(job_id + 100) is None
+        assert await second.cancel(job_id + 100) is False
+
+    asyncio.run(main())
+
+
+async def collect(stream) -> bytes:
+    return b''.join([chunk async for chunk in stream])
+
+
+def test_cancel_through_another_worker(database):
+    async def main():
+        first = JobManager(store=TaskStore(database, 'job', interval=0.01))
+        second = JobManager(store=TaskStore(database, 'job', interval=0.01))
+
+        async def work(job):
+            await asyncio.sleep(30)
+
+        progress, _ = await first.submit("sweep", 1, work)
+        await asyncio.sleep(0)
+        assert await second.cancel(progress["id"])
+        await first.store.sync()
+        await asyncio.wait_for(asyncio.gather(first.jobs[progress["id"]].task, return_exceptions=True), 1)
+        await first.store.sync()
+        return await second.progress(progress["id"])
+
+    assert asyncio.run(main())["state"] == 'cancelled'
+
+
+def test_job_of_a_stopped_worker_is_lost(database):
+    async def main():
+        store = TaskStore(database, 'job', stale_after=0.05)
+        job_id = await store.create("sweep")
+        # Nothing syncs it: its process is gone
+        await asyncio.sleep(0.1)
+        return await store.get(job_id), await store.find_active("sweep")
+
+    record, active = asyncio.run(main())
+    assert record["state"] == 'lost'
+    assert active is None
@@ -0,0 +1,104 @@
+import sqlite3
+
+from migrations import LATEST_VERSION, ensure_schema, migrate, stored_version
+from sync import changes_since, current_version
+
+# What init_db() created before schema versioning
+BASELINE_SCHEMA = '''
+CREATE TABLE servers (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT NOT NULL,
+    description TEXT,
+    type TEXT NOT NULL CHECK(type IN ('WEB', 'HTTPS', 'DB_MYSQL', 'DB_POSTGRES', 'DB_MONGO', 'DB_REDIS',
+        'APP_TOMCAT', 'APP_NODEJS', 'APP_PYTHON', 'MAIL', 'FTP', 'SSH', 'DNS', 'MONITORING', 'CUSTOM')),
+    status TEXT DEFAULT 'Unknown',
+    shutdown_status TEXT DEFAULT 'Not Started',
+    test_response TEXT,
+    owner_name TEXT,
+    owner_contact TEXT,
+    hostname TEXT,
+    port INTEGER,
+    application_id INTEGER,
+    FOREIGN KEY (application_id) REFERENCES applications (id)
+);
+CREATE TABLE applications (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT NOT NULL,
+    description TEXT,
+    status TEXT DEFAULT 'Unknown',
+    test_response TEXT
+);
+'''
+
+
+def create_baseline(path: str, servers: int = 30, applications: int = 3):
+    conn = sqlite3.connect(path)
+    conn.executescript(BASELINE_SCHEMA)
+    conn.executemany(
+        'INSERT INTO applications (name, description) VALUES (?, ?)',
+        [(f"app{i}", "") for i in range(applications)],
+    )
+    conn.executemany(
+        'INSERT INTO servers (name, type, hostname, port, application_id) VALUES (?, ?, ?, ?, ?)',
+        [(f"app{i % applications}_server{i}", "WEB", f"host{i}", 80, i % applications + 1) for i in range(servers)],
+    )
+    # Gaps in the ids, as deletes leave them
+    conn.execute('DELETE FROM servers WHERE id % 7 = 0')
+    conn.commit()
+    conn.close()
+
+
+def read_all(conn, kind: str) -> dict:
+    return changes_since(conn, kind, ['id', 'row_version'], 0, [], [], 1000)
+
+
+def test_upgrade_versions_existing_rows(sqlite_db):
+    create_baseline(sqlite_db.path)
+    migrate(sqlite_db)
+    assert stored_version(sqlite_db) == LATEST_VERSION
+
+    conn = sqlite_db.connect()
+    try:
+        servers = read_all(conn, 'server')
+        ids = [row[0] for row in conn.execute('SELECT id FROM servers ORDER BY id')]
+        assert sorted(item['id'] for item in servers['items']) == ids
+        versions = [item['row_version'] for item in servers['items']]
+        assert 0 not in versions
+        assert len(set(versions)) == len(versions)
+        assert servers['version'] == current_version(conn, 'server') == max(versions)
+        assert len(read_all(conn, 'application')['items']) == 3
+
+        # Later writes are numbered after the upgraded rows
+        conn.execute("UPDATE servers SET status = 'online' WHERE id = ?", (ids[0],))
+        changed = changes_since(conn, 'server', ['id'], servers['version'], [], [], 100)
+        assert changed['items'] == [{'id': ids[0]}]
+    finally:
+        conn.close()
+
+
+def test_rows_left_at_version_zero_are_repaired(sqlite_db):
+    # A database upgraded before migration 4 numbered existing rows
+    create_baseline(sqlite_db.path)
+    migrate(sqlite_db)
+    conn = sqlite_db.connect()
+    conn.execute('UPDATE servers SET row_version = 0')
+    conn.execute('UPDATE applications SET row_version = 0')
+    # Back to version 6, before the repair and what came after it
+    conn.execute('DELETE FROM schema_version WHERE version > 6')
+    conn.execute('DROP TABLE task_states')
+    conn.execute('DROP TABLE task_results')
+    conn.close()
+
+    assert ensure_schema(sqlite_db) == {"from": 6, "to": LATEST_VERSION}
+    conn = sqlite_db.connect()
+    try:
+        total = conn.execute('SELECT COUNT(*) FROM servers').fetchone()[0]
+        assert len(read_all(conn, 'server')['items']) == total
+        assert conn.execute('SELECT COUNT(*) FROM servers WHERE row_version = 0').fetchone()[0] == 0
+    finally:
+        conn.close()
+
+
+def test_ensure_schema_skips_a_current_database(sqlite_db):
+    assert ensure_schema(sqlite_db) == {"from": 0, "to": LATEST_VERSION}
+    assert ensure_schema(sqlite_db) is None
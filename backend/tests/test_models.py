@@ -0,0 +1,22 @@
+import pytest
+from pydantic import ValidationError
+
+from models import ServerUpdate
+
+
+def test_server_update_keeps_only_sent_fields():
+    assert ServerUpdate(owner_name="ops").model_dump(exclude_unset=True) == {"owner_name": "ops"}
+    # Nullable columns can be cleared
+    assert ServerUpdate(application_id=None).model_dump(exclude_unset=True) == {"application_id": None}
+
+
+@pytest.mark.parametrize("field", ["name", "type"])
+def test_server_update_rejects_null_for_not_null_columns(field):
+    with pytest.raises(ValidationError, match="may not be null"):
+        ServerUpdate(**{field: None})
+
+
+def test_server_update_checks_the_type():
+    with pytest.raises(ValidationError, match="Invalid server type"):
+        ServerUpdate(type="NOPE")
+    assert ServerUpdate(type="SSH").type == "SSH"
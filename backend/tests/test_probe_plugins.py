@@ -0,0 +1,246 @@
+import asyncio
+import shutil
+import socket
+import ssl
+import subprocess
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import probe_plugins
+from probe_plugins import POSTGRES_SSL_REQUEST, certificate_not_after, plugin_for, run_plugin
+
+
+def run_check(server_type: str, handler, timeout: float = 1.0, server_ssl=None) -> dict:
+    """Probe a stand-in server on localhost that talks through ``handler``."""
+    async def main():
+        server = await asyncio.start_server(handler, "127.0.0.1", 0, ssl=server_ssl)
+        port = server.sockets[0].getsockname()[1]
+        async with server:
+            entry = plugin_for(server_type)._replace(timeout=timeout)
+            return await run_plugin(entry, "localhost", "127.0.0.1", port)
+    return asyncio.run(main())
+
+
+def replies(*chunks: bytes, expect: int = 0, received: list = None, hang_up: bool = False):
+    """Handler that reads ``expect`` bytes, sends ``chunks`` and waits for the client to go.
+
+    With ``hang_up`` it closes the connection itself once the chunks are sent.
+    """
+    async def handler(reader, writer):
+        if expect:
+            data = await reader.readexactly(expect)
+            if received is not None:
+                received.append(data)
+        for chunk in chunks:
+            writer.write(chunk)
+        await writer.drain()
+        if not hang_up:
+            await reader.read()
+        writer.close()
+    return handler
+
+
+# Accepts and never says a word
+silent = replies()
+
+
+def assert_online(result: dict, text: str):
+    assert result["status"] == "online", result
+    assert text in result["message"]
+
+
+def assert_failed(result: dict, error: str):
+    assert result["status"] == "offline", result
+    assert result["error"] == error
+
+
+def test_connection_refused():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    result = asyncio.run(run_plugin(plugin_for("SSH"), "localhost", "127.0.0.1", port))
+    assert_failed(result, "connect")
+
+
+def test_ssh():
+    assert_online(run_check("SSH", replies(b"SSH-2.0-OpenSSH_9.6\r\n")), "SSH-2.0-OpenSSH_9.6")
+    # Lines before the identification string are skipped
+    assert_online(run_check("SSH", replies(b"Welcome\r\n", b"SSH-2.0-dropbear\r\n")), "dropbear")
+    assert_failed(run_check("SSH", replies(b"HTTP/1.1 400 Bad Request\r\n" * 5)), "protocol")
+    assert_failed(run_check("SSH", silent, timeout=0.2), "timeout")
+
+
+@pytest.mark.parametrize("server_type,protocol", [("MAIL", "SMTP"), ("FTP", "FTP")])
+def test_greetings(server_type, protocol):
+    result = run_check(server_type, replies(b"220-mail.example.com\r\n220-more\r\n220 ready\r\n"))
+    assert_online(result, f"{protocol} server ready: 220-mail.example.com")
+    assert_failed(run_check(server_type, replies(b"554 go away\r\n")), "protocol")
+    # Closed halfway through a multi-line greeting
+    assert_failed(run_check(server_type, replies(b"220-partial\r\n", hang_up=True)), "protocol")
+    assert_failed(run_check(server_type, silent, timeout=0.2), "timeout")
+
+
+def test_redis():
+    assert_online(run_check("DB_REDIS", replies(b"+PONG\r\n", expect=6)), "Redis responded PONG")
+    assert_online(
+        run_check("DB_REDIS", replies(b"-NOAUTH Authentication required.\r\n", expect=6)), "NOAUTH"
+    )
+    assert_failed(run_check("DB_REDIS", replies(b"HTTP/1.1 400\r\n", expect=6)), "protocol")
+    assert_failed(run_check("DB_REDIS", silent, timeout=0.2), "timeout")
+
+
+def test_postgres():
+    received = []
+    result = run_check("DB_POSTGRES", replies(b"S", expect=8, received=received))
+    assert_online(result, "accepts SSL")
+    assert received == [POSTGRES_SSL_REQUEST]
+    assert_online(run_check("DB_POSTGRES", replies(b"N", expect=8)), "SSL not enabled")
+    assert_online(run_check("DB_POSTGRES", replies(b"E", expect=8)), "error to SSLRequest")
+    assert_failed(run_check("DB_POSTGRES", replies(b"H", expect=8)), "protocol")
+    assert_failed(run_check("DB_POSTGRES", silent, timeout=0.2), "timeout")
+
+
+def mysql_packet(payload: bytes) -> bytes:
+    return len(payload).to_bytes(3, "little") + b"\x00" + payload
+
+
+def test_mysql():
+    handshake = mysql_packet(b"\x0a8.0.36\x00" + b"\x01\x00\x00\x00" + b"salt" * 5)
+    assert_online(run_check("DB_MYSQL", replies(handshake)), "MySQL server version 8.0.36")
+    refused = mysql_packet(b"\xff\x6a\x04Host '10.0.0.1' is not allowed to connect")
+    assert_online(run_check("DB_MYSQL", replies(refused)), "is not allowed to connect")
+    assert_failed(run_check("DB_MYSQL", replies(mysql_packet(b"\x00junk"))), "protocol")
+    # Header promises more than arrives
+    assert_failed(run_check("DB_MYSQL", replies(handshake[:10], hang_up=True)), "protocol")
+    assert_failed(run_check("DB_MYSQL", silent, timeout=0.2), "timeout")
+
+
+class DnsStandIn(asyncio.DatagramProtocol):
+    def __init__(self, answer):
+        self.answer = answer
+        self.queries = []
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        self.queries.append(data)
+        reply = self.answer(data)
+        if reply is not None:
+            self.transport.sendto(reply, addr)
+
+
+def run_dns(answer, timeout: float = 1.0):
+    async def main():
+        loop = asyncio.get_running_loop()
+        transport, server = await loop.create_datagram_endpoint(
+            lambda: DnsStandIn(answer), local_addr=("127.0.0.1", 0)
+        )
+        try:
+            port = transport.get_extra_info("sockname")[1]
+            entry = plugin_for("DNS")._replace(timeout=timeout)
+            return await run_plugin(entry, "localhost", "127.0.0.1", port), server.queries
+        finally:
+            transport.close()
+    return asyncio.run(main())
+
+
+def dns_reply(query: bytes, rcode: int) -> bytes:
+    # Same id and question, QR bit set
+    return query[:2] + bytes([0x80, rcode]) + query[4:]
+
+
+def test_dns_query():
+    result, queries = run_dns(lambda query: dns_reply(query, 0))
+    assert_online(result, "NOERROR")
+    query = queries[0]
+    # Header: no flags (not recursive), one question; then the root name,
+    # type NS, class IN
+    assert query[2:12] == b"\x00\x00\x00\x01\x00\x00\x00\x00\x00\x00"
+    assert query[12:] == b"\x00\x00\x02\x00\x01"
+
+
+def test_dns_replies():
+    assert_online(run_dns(lambda query: dns_reply(query, 5))[0], "REFUSED")
+    assert_online(run_dns(lambda query: dns_reply(query, 9))[0], "(9)")
+    # Not answers to this query: another id, the query echoed, a runt
+    wrong_id = lambda query: dns_reply(bytes([query[0] ^ 0xFF]) + query[1:], 0)  # noqa: E731
+    for answer in (wrong_id, lambda query: query, lambda query: b"\x00\x01"):
+        assert_failed(run_dns(answer, timeout=0.2)[0], "timeout")
+    assert_failed(run_dns(lambda query: None, timeout=0.2)[0], "timeout")
+
+
+def der(tag: int, content: bytes) -> bytes:
+    length = len(content)
+    if length < 0x80:
+        return bytes([tag, length]) + content
+    size = (length.bit_length() + 7) // 8
+    return bytes([tag, 0x80 | size]) + length.to_bytes(size, "big") + content
+
+
+def certificate(not_after: bytes, time_tag: int = 0x17, version: bool = True, issuer: bytes = b"issuer") -> bytes:
+    """Just enough of a DER certificate for certificate_not_after()."""
+    not_before = b"200101000000Z" if time_tag == 0x17 else b"20200101000000Z"
+    validity = der(0x30, der(time_tag, not_before) + der(time_tag, not_after))
+    tbs = (
+        (der(0xA0, der(0x02, b"\x02")) if version else b"")
+        + der(0x02, b"\x10\x01")
+        + der(0x30, der(0x06, b"\x2a\x86\x48"))
+        + der(0x30, der(0x0C, issuer))
+        + validity
+        + der(0x30, der(0x0C, b"subject"))
+    )
+    return der(0x30, der(0x30, tbs) + der(0x30, b"") + der(0x03, b"\x00sig"))
+
+
+def test_certificate_not_after():
+    utc = timezone.utc
+    assert certificate_not_after(certificate(b"311231235959Z")) == datetime(2031, 12, 31, 23, 59, 59, tzinfo=utc)
+    assert certificate_not_after(certificate(b"20510131120000Z", time_tag=0x18)) == datetime(
+        2051, 1, 31, 12, 0, tzinfo=utc
+    )
+    # Version 1 certificates leave out the [0] version field
+    assert certificate_not_after(certificate(b"301231000000Z", version=False)).year == 2030
+    # Long-form lengths, one and two bytes
+    for issuer in (b"x" * 200, b"x" * 1000):
+        assert certificate_not_after(certificate(b"301231000000Z", issuer=issuer)).year == 2030
+    with pytest.raises((IndexError, ValueError)):
+        certificate_not_after(certificate(b"not a time"))
+
+
+@pytest.fixture
+def tls_server_context(tmp_path):
+    openssl = shutil.which("openssl")
+    if openssl is None:
+        pytest.skip("openssl is not installed")
+    cert, key = tmp_path / "cert.pem", tmp_path / "key.pem"
+    subprocess.run(
+        [openssl, "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "30", "-subj", "/CN=localhost",
+         "-keyout", str(key), "-out", str(cert)],
+        check=True, capture_output=True,
+    )
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(cert, key)
+    return context
+
+
+def test_tls(tls_server_context, monkeypatch):
+    result = run_check("HTTPS", replies(), server_ssl=tls_server_context)
+    assert_online(result, "TLS handshake completed")
+    assert 29 < result["certificate_days_left"] <= 30
+
+    monkeypatch.setattr(probe_plugins, "TLS_EXPIRY_WARN_DAYS", 60)
+    assert_online(run_check("HTTPS", replies(), server_ssl=tls_server_context), "(in 29 days)")
+
+    expired = datetime.now(timezone.utc) - timedelta(days=3)
+    monkeypatch.setattr(probe_plugins, "certificate_not_after", lambda der: expired)
+    result = run_check("HTTPS", replies(), server_ssl=tls_server_context)
+    assert_failed(result, "protocol")
+    assert "expired" in result["message"]
+
+
+def test_tls_failures():
+    # Plain text where a TLS server hello belongs
+    assert run_check("HTTPS", replies(b"SSH-2.0-OpenSSH_9.6\r\n"))["status"] == "offline"
+    assert_failed(run_check("HTTPS", silent, timeout=0.2), "timeout")
@@ -0,0 +1,120 @@
+import pytest
+
+from listing import encode_cursor
+from repository import ID_CHUNK, PROBE_COLUMNS, ApplicationRepository, ServerRepository
+
+
+@pytest.fixture
+def conn(database):
+    conn = database.connect()
+    yield conn
+    conn.close()
+
+
+@pytest.fixture
+def servers(database):
+    return ServerRepository(database.dialect)
+
+
+@pytest.fixture
+def applications(database):
+    return ApplicationRepository(database.dialect)
+
+
+def server(name: str, **fields) -> dict:
+    return {"name": name, "type": "WEB", "hostname": f"{name}.example.com", "port": 80, **fields}
+
+
+def test_insert_get_update_delete(conn, servers):
+    server_id = servers.insert(conn, server("web1", owner_name="ops"))
+    assert servers.exists(conn, server_id)
+    row = servers.get(conn, server_id)
+    assert (row["name"], row["owner_name"], row["status"]) == ("web1", "ops", "Unknown")
+
+    assert servers.update(conn, server_id, {"owner_name": "dba", "port": 8080})
+    assert servers.get(conn, server_id)["port"] == 8080
+    assert not servers.update(conn, server_id + 1, {"owner_name": "dba"})
+
+    assert servers.delete(conn, server_id)
+    assert not servers.delete(conn, server_id)
+    assert servers.get(conn, server_id) is None
+    assert servers.check_fields({"name": "x", "nope": 1}) == ["nope"]
+
+
+def test_update_many_spans_id_chunks(conn, servers):
+    ids = [servers.insert(conn, server(f"web{i}")) for i in range(ID_CHUNK + 20)]
+    assert servers.update_many(conn, ids + [ids[-1] + 1], {"shutdown_status": "Done"}) == len(ids)
+    assert servers.count_by(conn, "shutdown_status") == {"Done": len(ids)}
+
+
+def test_upsert_many(conn, servers):
+    first = servers.insert(conn, server("web1"))
+    summary = servers.upsert_many(conn, [
+        {"id": first, "owner_name": "ops"},
+        server("web2"),
+        {"id": first + 100, **server("web3")},
+    ])
+    assert summary == {"inserted": 2, "updated": 1}
+    assert servers.get(conn, first)["owner_name"] == "ops"
+    assert servers.get(conn, first + 100)["name"] == "web3"
+    # Plain inserts carry on past the explicit id
+    assert servers.insert(conn, server("web4")) > first + 100
+
+
+def test_application_delete_detaches_servers(conn, servers, applications):
+    app_id = applications.insert(conn, {"name": "shop", "description": ""})
+    ids = [servers.insert(conn, server(f"web{i}", application_id=app_id)) for i in range(3)]
+    servers.insert(conn, server("other"))
+    assert applications.server_ids(conn, app_id) == ids
+    assert applications.delete(conn, app_id)
+    assert applications.server_ids(conn, app_id) == []
+    assert all(servers.get(conn, server_id)["application_id"] is None for server_id in ids)
+
+
+def test_select_filters(conn, servers, applications):
+    app_id = applications.insert(conn, {"name": "shop", "description": ""})
+    in_app = servers.insert(conn, server("web1", application_id=app_id))
+    alone = servers.insert(conn, server("web2"))
+
+    rows = servers.select(conn, PROBE_COLUMNS)
+    assert [row[0] for row in rows] == [in_app, alone]
+    assert tuple(rows[0]) == (in_app, "web1.example.com", 80, "WEB", app_id, "Unknown", None)
+    assert [row[0] for row in servers.select(conn, ("id",), alone)] == [alone]
+    assert [row[0] for row in servers.select(conn, ("id",), None, app_id)] == [in_app]
+    assert [row[0] for row in servers.select(conn, ("id",), None, None, True)] == [in_app]
+    assert servers.select(conn, ("id",), alone + 1) == []
+
+
+def test_page_walks_in_both_orders(conn, servers):
+    for i, owner in enumerate(["ops", None, "dba", None, "ops", "web"]):
+        servers.insert(conn, server(f"web{i}", owner_name=owner))
+    fields = ["id", "owner_name"]
+    for order, expected in (
+        ("asc", [None, None, "dba", "ops", "ops", "web"]),
+        ("desc", ["web", "ops", "ops", "dba", None, None]),
+    ):
+        seen, cursor = [], None
+        while True:
+            rows, selected = servers.page(conn, fields, [], [], "owner_name", order, cursor, 4)
+            seen.extend(row[1] for row in rows[:4])
+            if len(rows) <= 4:
+                break
+            last = rows[3]
+            cursor = encode_cursor(last[selected.index("owner_name")], last[selected.index("id")])
+        assert seen == expected
+
+    rows, _ = servers.page(conn, fields, ["owner_name = ?"], ["ops"], "id", "asc", None, 10)
+    assert [row[1] for row in rows] == ["ops", "ops"]
+
+
+def test_changes_follow_writes(conn, servers):
+    first = servers.insert(conn, server("web1"))
+    second = servers.insert(conn, server("web2"))
+    changes = servers.changes(conn, ["id", "name"], 0, [], [], 100)
+    assert [item["id"] for item in changes["items"]] == [first, second]
+
+    servers.update(conn, first, {"name": "renamed"})
+    servers.delete(conn, second)
+    later = servers.changes(conn, ["id", "name"], changes["version"], [], [], 100)
+    assert later["items"] == [{"id": first, "name": "renamed"}]
+    assert later["deleted"] == [second]
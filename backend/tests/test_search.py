@@ -0,0 +1,44 @@
+import pytest
+
+from repository import ServerRepository
+from search import search_servers
+
+
+@pytest.fixture
+def conn(database):
+    conn = database.connect()
+    servers = ServerRepository(database.dialect)
+    for name, hostname in (
+        ("DBMaster", "master.example.com"),
+        ("web1", "DB1.Example.com"),
+        ("mail", "mail.example.com"),
+    ):
+        servers.insert(conn, {"name": name, "type": "WEB", "hostname": hostname})
+    yield conn
+    conn.close()
+
+
+@pytest.mark.parametrize("query", ["db", "DB", "dB"])
+def test_short_query_matches_any_case(conn, database, query):
+    # Shorter than a trigram: only the name and hostname prefixes find these
+    found = search_servers(conn, query, 10, database.dialect)
+    assert [server["name"] for server in found] == ["DBMaster", "web1"]
+
+
+def test_longer_query_matches_any_case(conn, database):
+    found = search_servers(conn, "EXAMPLE.com MAST", 10, database.dialect)
+    assert [server["name"] for server in found] == ["DBMaster"]
+
+
+def test_prefix_lookup_uses_the_lower_index(sqlite_db):
+    from migrations import migrate
+    migrate(sqlite_db)
+    conn = sqlite_db.connect()
+    try:
+        plan = ' '.join(
+            str(row[3]) for row in
+            conn.execute('EXPLAIN QUERY PLAN SELECT id FROM servers WHERE lower(name) >= ? AND lower(name) < ?', ('a', 'b'))
+        )
+        assert 'idx_servers_lower_name' in plan
+    finally:
+        conn.close()
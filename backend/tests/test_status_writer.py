@@ -0,0 +1,40 @@
+import asyncio
+import threading
+
+from repository import ApplicationRepository, ServerRepository
+from rollup import ApplicationRollup
+from status_writer import StatusWriter
+
+
+def test_results_recorded_while_the_rollup_loads_are_counted(database):
+    conn = database.connect()
+    app_id = ApplicationRepository(database.dialect).insert(conn, {"name": "shop", "description": ""})
+    servers = ServerRepository(database.dialect)
+    ids = [servers.insert(conn, {"name": f"web{i}", "type": "WEB", "application_id": app_id}) for i in range(4)]
+    conn.close()
+
+    rollup = ApplicationRollup()
+    writer = StatusWriter(database, rollup, max_rows=1000, max_delay=60)
+    entered, release = threading.Event(), threading.Event()
+    write = writer._write
+
+    def held_write(conn, batch, mark):
+        entered.set()
+        release.wait(5)
+        return write(conn, batch, mark)
+    writer._write = held_write
+
+    async def main():
+        writer.record_server(ids[0], "online", "ok", ("Unknown", None), app_id)
+        flushing = asyncio.ensure_future(writer.flush())
+        await asyncio.get_running_loop().run_in_executor(None, entered.wait, 5)
+        # Taken after the first batch, so not in the table load() counts
+        writer.record_server(ids[1], "online", "ok", ("Unknown", None), app_id)
+        release.set()
+        await flushing
+        await writer.flush()
+
+    asyncio.run(main())
+    assert rollup.status_of(app_id) == ("partial", "2/4 servers online")
+    row = asyncio.run(database.fetchone('SELECT status, test_response FROM applications WHERE id = ?', (app_id,)))
+    assert tuple(row) == ("partial", "2/4 servers online")
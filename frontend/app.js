@@ -24,6 +24,17 @@ createApp({
             editingServer: null,
             editingApp: null,
             searchQuery: '',
+            pageSize: 100,
+            serverCursor: null,
+            nextServerCursor: null,
+            serverCursorHistory: [],
+            statusFilter: '',
+            typeFilter: '',
+            serverSummary: { total: 0, by_status: {} },
+            eventSource: null,
+            pendingRefresh: {},
+            refreshTimer: null,
+            searchTimer: null,
             serverTypes: {
                 'WEB': { defaultPort: 80, description: 'Web Server (HTTP)' },
                 'HTTPS': { defaultPort: 443, description: 'Secure Web Server (HTTPS)' },
@@ -67,12 +78,23 @@ createApp({
         }
     },
     computed: {
+        visibleServers() {
+            // Search results replace the page while a query is set
+            return this.searchQuery.trim() ? this.filteredServers : this.servers
+        },
         serverStats() {
-            const total = this.servers.length
-            const online = this.servers.filter(s => s.status.toLowerCase() === 'online').length
-            const offline = this.servers.filter(s => s.status.toLowerCase() === 'offline').length
-            const issues = this.servers.filter(s => s.status.toLowerCase() === 'error').length
-            const pending = this.servers.filter(s => s.status.toLowerCase() === 'pending').length
+            // Counts come from /servers/summary, the list only holds one page
+            const byStatus = {}
+            Object.entries(this.serverSummary.by_status).forEach(([status, count]) => {
+                const key = (status || 'unknown').toLowerCase()
+                byStatus[key] = (byStatus[key] || 0) + count
+            })
+            const total = this.serverSummary.total
+            // Degraded servers are slow but up
+            const online = (byStatus.online || 0) + (byStatus.degraded || 0)
+            const offline = byStatus.offline || 0
+            const issues = byStatus.error || 0
+            const pending = byStatus.pending || 0
             
             return {
                 total,
@@ -98,11 +120,10 @@ createApp({
             }
         },
         selectAllServers() {
-            const serverList = this.searchQuery ? this.filteredServers : this.servers
-            if (this.selectedServers.length === serverList.length) {
+            if (this.selectedServers.length === this.visibleServers.length) {
                 this.selectedServers = []
             } else {
-                this.selectedServers = serverList.map(s => s.id)
+                this.selectedServers = this.visibleServers.map(s => s.id)
             }
         },
         clearSelection() {
@@ -135,8 +156,11 @@ createApp({
                     const error = await response.json()
                     throw new Error(error.detail || 'Failed to update servers')
                 }
+                if (response.status === 202) {
+                    await this.waitForJob(await response.json())
+                }
 
-                await this.fetchServers()
+                // The event stream reloads the list
                 this.showSuccess('Bulk update successful')
                 this.selectedServers = []
                 this.showBulkModal = false
@@ -149,25 +173,32 @@ createApp({
                 this.showError('Error updating servers: ' + error.message)
             }
         },
-        filterItems() {
-            if (!this.searchQuery) {
+        searchInput() {
+            // One search once typing pauses, not one per keystroke
+            clearTimeout(this.searchTimer)
+            if (!this.searchQuery.trim()) {
+                this.filterItems()
+                return
+            }
+            this.searchTimer = setTimeout(() => this.filterItems(), 250)
+        },
+        async filterItems() {
+            if (!this.searchQuery.trim()) {
                 this.filteredServers = this.servers;
                 return;
             }
+            if (this.activeView !== 'servers') return;
             
-            const query = this.searchQuery.toLowerCase();
-            
-            if (this.activeView === 'servers') {
-                this.filteredServers = this.servers.filter(server => {
-                    const appName = this.getAppName(server.application_id) || '';
-                    return (
-                        (server.name || '').toLowerCase().includes(query) ||
-                        (server.type || '').toLowerCase().includes(query) ||
-                        (server.owner_name || '').toLowerCase().includes(query) ||
-                        (server.hostname || '').toLowerCase().includes(query) ||
-                        appName.toLowerCase().includes(query)
-                    );
-                });
+            // Ranked by the server's search index; answers to older
+            // queries are dropped if the user has typed on since
+            const query = this.searchQuery;
+            try {
+                const response = await fetch(`${API_BASE_URL}/search?q=${encodeURIComponent(query)}&limit=1000`);
+                if (!response.ok) throw new Error('Search failed');
+                const data = await response.json();
+                if (query === this.searchQuery) this.filteredServers = data.items;
+            } catch (error) {
+                this.showError('Error searching servers: ' + error.message);
             }
         },
         async handleFileUpload(event) {
@@ -184,16 +215,21 @@ createApp({
                 })
 
                 if (!response.ok) throw new Error('Failed to import CSV')
+                const summary = await response.json()
 
-                await this.fetchServers()
                 event.target.value = ''
-                this.showSuccess('CSV imported successfully')
+                if (summary.failed) {
+                    const first = summary.errors[0]
+                    this.showError(`Imported ${summary.imported} servers, ${summary.failed} rows failed (line ${first.line}: ${first.error})`)
+                } else {
+                    this.showSuccess(`Imported ${summary.imported} servers`)
+                }
             } catch (error) {
                 this.showError('Error importing CSV: ' + error.message)
             }
         },
         getServersByApp(appId) {
-            const serverList = this.searchQuery ? this.filteredServers : this.servers
+            const serverList = this.visibleServers
             if (!appId) {
                 return serverList.filter(server => !server.application_id)
             }
@@ -204,34 +240,136 @@ createApp({
             const app = this.applications.find(a => a.id === appId)
             return app ? app.name : 'Unknown'
         },
+        serverQuery() {
+            const params = new URLSearchParams({ limit: this.pageSize })
+            if (this.serverCursor) params.set('cursor', this.serverCursor)
+            if (this.statusFilter) params.set('status', this.statusFilter)
+            if (this.typeFilter) params.set('type', this.typeFilter)
+            return params
+        },
         async fetchServers() {
             try {
-                const response = await fetch(`${API_BASE_URL}/servers`)
+                const response = await fetch(`${API_BASE_URL}/servers?${this.serverQuery()}`)
                 if (!response.ok) {
                     throw new Error(`HTTP error! status: ${response.status}`)
                 }
                 const data = await response.json()
-                this.servers = data
+                this.servers = data.items
+                this.nextServerCursor = data.next_cursor
                 this.filterItems()
+                await this.fetchServerSummary()
             } catch (error) {
                 console.error('Error fetching servers:', error)
                 this.showError('Failed to load servers: ' + error.message)
             }
         },
+        async fetchServerSummary() {
+            const response = await fetch(`${API_BASE_URL}/servers/summary`)
+            if (response.ok) {
+                this.serverSummary = await response.json()
+            }
+        },
+        async nextServerPage() {
+            if (!this.nextServerCursor) return
+            this.serverCursorHistory.push(this.serverCursor)
+            this.serverCursor = this.nextServerCursor
+            this.selectedServers = []
+            await this.fetchServers()
+        },
+        async previousServerPage() {
+            if (!this.serverCursorHistory.length) return
+            this.serverCursor = this.serverCursorHistory.pop()
+            this.selectedServers = []
+            await this.fetchServers()
+        },
+        async applyServerFilters() {
+            this.serverCursor = null
+            this.serverCursorHistory = []
+            this.selectedServers = []
+            await this.fetchServers()
+        },
         async fetchApplications() {
             try {
-                const response = await fetch(`${API_BASE_URL}/applications`)
-                if (!response.ok) {
-                    throw new Error(`HTTP error! status: ${response.status}`)
-                }
-                const data = await response.json()
-                this.applications = data
+                // Applications are few and needed for name lookups, so all
+                // pages are loaded
+                const applications = []
+                let cursor = null
+                do {
+                    const params = new URLSearchParams({ limit: 1000 })
+                    if (cursor) params.set('cursor', cursor)
+                    const response = await fetch(`${API_BASE_URL}/applications?${params}`)
+                    if (!response.ok) {
+                        throw new Error(`HTTP error! status: ${response.status}`)
+                    }
+                    const data = await response.json()
+                    applications.push(...data.items)
+                    cursor = data.next_cursor
+                } while (cursor)
+                this.applications = applications
                 this.filterItems()
             } catch (error) {
                 console.error('Error fetching applications:', error)
                 this.showError('Failed to load applications: ' + error.message)
             }
         },
+        connectEvents() {
+            // Status transitions and inventory changes are pushed by the
+            // backend, so nothing is refetched after an action
+            const source = new EventSource(`${API_BASE_URL}/events`)
+            source.addEventListener('status', event => this.applyStatusEvent(JSON.parse(event.data)))
+            source.addEventListener('server', () => this.scheduleRefresh('servers'))
+            source.addEventListener('servers', () => this.scheduleRefresh('servers'))
+            // Shutdown/startup runs move shutdown_status on many servers
+            source.addEventListener('orchestration', () => this.scheduleRefresh('servers'))
+            source.addEventListener('application', () => {
+                this.scheduleRefresh('applications')
+                this.scheduleRefresh('servers')
+            })
+            // Sent after a reconnect or when events were dropped for us
+            source.addEventListener('resync', () => {
+                this.scheduleRefresh('applications')
+                this.scheduleRefresh('servers')
+            })
+            source.onopen = () => {
+                if (this.eventSource) {
+                    this.scheduleRefresh('applications')
+                    this.scheduleRefresh('servers')
+                }
+                this.eventSource = source
+            }
+        },
+        applyStatusEvent(data) {
+            const servers = new Map(this.servers.map(s => [s.id, s]))
+            data.servers.forEach(update => {
+                const server = servers.get(update.id)
+                if (server) {
+                    server.status = update.status
+                    server.test_response = update.test_response
+                }
+            })
+            const applications = new Map(this.applications.map(a => [a.id, a]))
+            data.applications.forEach(update => {
+                const app = applications.get(update.id)
+                if (app) {
+                    app.status = update.status
+                    app.test_response = update.test_response
+                }
+            })
+            if (data.servers.length) this.scheduleRefresh('summary')
+        },
+        scheduleRefresh(what) {
+            // Bursts of events collapse into one reload of each kind
+            this.pendingRefresh[what] = true
+            if (this.refreshTimer) return
+            this.refreshTimer = setTimeout(async () => {
+                const pending = this.pendingRefresh
+                this.pendingRefresh = {}
+                this.refreshTimer = null
+                if (pending.applications) await this.fetchApplications()
+                if (pending.servers) await this.fetchServers()
+                else if (pending.summary) await this.fetchServerSummary()
+            }, 250)
+        },
         getDefaultPort(type) {
             const typeConfig = this.serverTypes[type] || this.serverTypes['CUSTOM']
             return typeConfig.defaultPort || null
@@ -309,11 +447,12 @@ createApp({
         getStatusClass(status) {
             return {
                 'online': 'status-online',
+                'degraded': 'status-degraded',
                 'offline': 'status-offline',
                 'error': 'status-error',
                 'pending': 'status-pending',
                 'unknown': 'status-unknown'
-            }[status.toLowerCase()] || 'status-unknown'
+            }[(status || '').toLowerCase()] || 'status-unknown'
         },
         showError(message) {
             this.errorMessage = message
@@ -323,6 +462,17 @@ createApp({
             this.successMessage = message
             setTimeout(() => this.successMessage = '', 5000)
         },
+        async waitForJob(job) {
+            // Long operations run as background jobs; poll until this one ends
+            while (job.state === 'pending' || job.state === 'running') {
+                await new Promise(resolve => setTimeout(resolve, 1000))
+                const response = await fetch(`${API_BASE_URL}/jobs/${job.id}`)
+                if (!response.ok) throw new Error('Lost track of the background job')
+                job = await response.json()
+            }
+            if (job.state !== 'completed') throw new Error(job.error || `Job ${job.state}`)
+            return job
+        },
         async updateServer() {
             try {
                 const response = await fetch(`${API_BASE_URL}/servers/${this.editingServer.id}`, {
@@ -332,7 +482,6 @@ createApp({
                 });
 
                 if (!response.ok) throw new Error('Failed to update server');
-                await this.fetchServers();
                 this.showEditServerModal = false;
                 this.editingServer = null;
             } catch (error) {
@@ -365,7 +514,6 @@ createApp({
                     throw new Error(error.detail || 'Failed to update application');
                 }
 
-                await this.fetchApplications();
                 this.showSuccess('Application updated successfully');
                 this.showEditAppModal = false;
                 this.editingApp = null;
@@ -399,17 +547,10 @@ createApp({
                 });
 
                 if (!response.ok) throw new Error('Failed to test servers');
-                const data = await response.json();
+                const job = await this.waitForJob(await response.json());
                 
-                // Update local state
-                data.results.forEach(result => {
-                    const server = this.servers.find(s => s.id === result.id);
-                    if (server) {
-                        server.status = result.result.status;
-                        server.test_response = result.result.message;
-                    }
-                });
-                this.showSuccess('All servers tested successfully');
+                // Statuses arrive through the event stream as the sweep runs
+                this.showSuccess(job.summary.message);
             } catch (error) {
                 this.showError('Error testing servers: ' + error.message);
             }
@@ -452,10 +593,10 @@ createApp({
                 });
 
                 if (!response.ok) throw new Error('Failed to test applications');
-                const data = await response.json();
+                const job = await this.waitForJob(await response.json());
                 
                 // Update local state
-                data.results.forEach(result => {
+                job.summary.results.forEach(result => {
                     const app = this.applications.find(a => a.id === result.id);
                     if (app) {
                         app.status = result.result.status;
@@ -472,5 +613,6 @@ createApp({
     async mounted() {
         await this.fetchApplications()
         await this.fetchServers()
+        this.connectEvents()
     }
 }).mount('#app')